@@ -0,0 +1,71 @@
+import asyncio
+import logging
+import time
+from typing import AsyncIterator, List, Optional
+
+from benchmark.api.schemas import StoryBatchItem
+from benchmark.llms.base import BaseLlm
+from benchmark.llms.cache import StoryCache
+from benchmark.storage.archive import StoryArchiver, archive_story
+
+
+logger = logging.getLogger(__name__)
+
+
+async def generate_batch(
+    llm: BaseLlm,
+    cache: StoryCache,
+    topics: List[str],
+    concurrency: int,
+    process_semaphore: asyncio.Semaphore,
+    archiver: Optional[StoryArchiver] = None,
+) -> AsyncIterator[str]:
+    """Generates a story per topic and yields each one as an NDJSON line as
+    soon as it completes, in completion order.
+
+    At most `concurrency` stories of this batch run at once, and every batch
+    of the worker shares `process_semaphore`, so one large batch can't take
+    every upstream slot. Failures are reported per item. Pending stories are
+    cancelled if the client goes away.
+
+    Parameters
+    ----------
+    llm : BaseLlm
+        Provider that generates the stories
+    cache : StoryCache
+        Story cache, shared with `/write-story`
+    topics : List[str]
+        Topics of the stories, the position is reported as `index`
+    concurrency : int
+        Max stories of this batch generated at once
+    process_semaphore : asyncio.Semaphore
+        Limit shared by every batch of the worker
+    archiver : Optional[StoryArchiver]
+        Archive of the generated stories, when enabled
+    """
+    batch_semaphore = asyncio.Semaphore(concurrency)
+
+    async def generate(index: int, topic: str) -> StoryBatchItem:
+        async with batch_semaphore, process_semaphore:
+            started_at = time.perf_counter()
+            try:
+                data, cache_status = await cache.get_story_async(llm, topic=topic)
+            except Exception as e:
+                logger.warning("Batch item %s failed: %r", index, e)
+                return StoryBatchItem(index=index, topic=topic, error=type(e).__name__)
+
+        archive_story(archiver, "write-stories", llm, data, started_at, cache_status)
+
+        return StoryBatchItem(index=index, topic=topic, story=data["story"])
+
+    tasks = [
+        asyncio.ensure_future(generate(index, topic))
+        for index, topic in enumerate(topics)
+    ]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            item = await next_done
+            yield item.model_dump_json(exclude_none=True) + "\n"
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,150 @@
+import re
+from typing import Dict, Iterator, Optional, Tuple
+
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+
+from benchmark.api.dependencies import get_dataset
+from benchmark.core.config import settings
+from benchmark.storage.dataset import DatasetSnapshot
+
+router = APIRouter(prefix="/data", tags=["data"])
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+QUERY_PARAMS = {"offset", "limit"}
+"""Query parameters of `/data/records` that aren't field filters"""
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parses a single-range `Range` header into `start, end` offsets, end
+    excluded. Returns None for headers that aren't a single byte range,
+    which are served as a full response.
+
+    Raises
+    ------
+    HTTPException
+        416 when the range starts past the end of the dataset or is an empty
+        suffix
+    """
+    match = _RANGE.match(header.strip())
+    if match is None or match.groups() == ("", ""):
+        return None
+
+    first, last = match.groups()
+    if not first:
+        # Suffix range, i.e. the last `last` bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise HTTPException(
+                status_code=416,
+                detail="Range not satisfiable",
+                headers={"Content-Range": f"bytes */{size}"},
+            )
+        return max(size - length, 0), size
+
+    start = int(first)
+    end = min(int(last) + 1, size) if last else size
+    if start >= size or start >= end:
+        raise HTTPException(
+            status_code=416,
+            detail="Range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    return start, end
+
+
+def _validators(snapshot: DatasetSnapshot) -> Dict[str, str]:
+    headers = {"ETag": snapshot.etag}
+    if snapshot.last_modified is not None:
+        headers["Last-Modified"] = snapshot.last_modified
+    return headers
+
+
+def _ndjson(records: Iterator[bytes]) -> Iterator[bytes]:
+    for record in records:
+        if b"\n" in record:
+            # Pretty-printed in the dataset, JSON Lines needs it on one line
+            record = orjson.dumps(orjson.loads(record))
+        yield record + b"\n"
+
+
+@router.get("")
+def get_dataset_file(
+    request: Request, snapshot: DatasetSnapshot = Depends(get_dataset)
+) -> Response:
+    """Streams the dataset file, or the single byte range of a `Range`
+    request. Answers 304 when `If-None-Match` has the current ETag."""
+    headers = _validators(snapshot)
+    if request.headers.get("if-none-match") == snapshot.etag:
+        return Response(status_code=304, headers=headers)
+
+    headers["Accept-Ranges"] = "bytes"
+    status_code = 200
+    start, end = 0, snapshot.size
+
+    byte_range = request.headers.get("range")
+    if byte_range is not None:
+        parsed = parse_range(byte_range, snapshot.size)
+        if parsed is not None:
+            start, end = parsed
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end - 1}/{snapshot.size}"
+
+    headers["Content-Length"] = str(end - start)
+    return StreamingResponse(
+        snapshot.chunks(start, end, settings.DATASET_CHUNK_SIZE),
+        status_code=status_code,
+        headers=headers,
+        media_type="application/json",
+    )
+
+
+@router.get("/records")
+def query_records(
+    request: Request,
+    offset: int = 0,
+    limit: int = 100,
+    snapshot: DatasetSnapshot = Depends(get_dataset),
+) -> Response:
+    """Streams the records matching the query as JSON Lines.
+
+    Every query parameter other than `offset` and `limit` is a `field=value`
+    filter, e.g. `/data/records?kind=asteroid&orbit.class=main-belt`.
+    Records are parsed one at a time while the response is sent.
+    """
+    if offset < 0 or not 0 < limit <= settings.DATASET_MAX_LIMIT:
+        raise HTTPException(
+            status_code=422,
+            detail=f"offset must be >= 0 and limit in [1, {settings.DATASET_MAX_LIMIT}]",
+        )
+
+    filters = {
+        name: value
+        for name, value in request.query_params.items()
+        if name not in QUERY_PARAMS
+    }
+
+    return StreamingResponse(
+        _ndjson(snapshot.query(filters, offset, limit)),
+        headers=_validators(snapshot),
+        media_type=NDJSON_MEDIA_TYPE,
+    )
+
+
+@router.get("/records/{index}")
+def get_record(
+    index: int, snapshot: DatasetSnapshot = Depends(get_dataset)
+) -> Response:
+    """Returns record `index` of the dataset as it is stored"""
+    if not 0 <= index < len(snapshot):
+        raise HTTPException(status_code=404, detail=f"No record {index}")
+
+    return Response(
+        snapshot.record(index),
+        headers=_validators(snapshot),
+        media_type="application/json",
+    )
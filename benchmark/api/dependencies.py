@@ -0,0 +1,45 @@
+import asyncio
+from typing import Optional
+
+from fastapi import HTTPException, Request
+
+from benchmark.api.schemas import StorytellerModel
+from benchmark.jobs.worker import JobQueue
+from benchmark.llms.base import BaseLlm
+from benchmark.llms.cache import StoryCache
+from benchmark.storage.archive import StoryArchiver
+from benchmark.storage.dataset import DatasetSnapshot
+
+
+async def get_llm(model: StorytellerModel, request: Request) -> BaseLlm:
+    """Resolves the worker's shared `BaseLlm` for the requested model"""
+    return await request.app.state.llm_registry.aget(model)
+
+
+async def get_story_cache(request: Request) -> StoryCache:
+    return request.app.state.story_cache
+
+
+async def get_batch_semaphore(request: Request) -> asyncio.Semaphore:
+    return request.app.state.batch_semaphore
+
+
+async def get_story_archiver(request: Request) -> Optional[StoryArchiver]:
+    return request.app.state.story_archiver
+
+
+async def get_dataset(request: Request) -> DatasetSnapshot:
+    """Resolves the current version of the worker's S3 dataset"""
+    dataset = request.app.state.dataset
+    if dataset is None:
+        raise HTTPException(status_code=404, detail="The dataset is not enabled")
+    if dataset.snapshot is None:
+        raise HTTPException(status_code=503, detail="The dataset is not loaded yet")
+    return dataset.snapshot
+
+
+async def get_job_queue(request: Request) -> JobQueue:
+    job_queue = request.app.state.job_queue
+    if job_queue is None:
+        raise HTTPException(status_code=404, detail="Jobs are not enabled")
+    return job_queue
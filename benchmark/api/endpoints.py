@@ -1,13 +1,35 @@
+import asyncio
 import logging
-from typing import Dict
-
-from fastapi import APIRouter
-from fastapi.responses import StreamingResponse
-from opentelemetry import trace
-
-from benchmark.api.schemas import StoryResponse, StorytellerModel
-from benchmark.llms.bedrock import ClaudeBedrockLlm
-from benchmark.llms.gpt import OpenAILlm
+import time
+from typing import Dict, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
+
+from benchmark.api.batch import generate_batch
+from benchmark.api.dependencies import (
+    get_batch_semaphore,
+    get_llm,
+    get_story_archiver,
+    get_story_cache,
+)
+from benchmark.api.schemas import StoryBatchRequest, StoryResponse
+from benchmark.api.sse import SSE_MEDIA_TYPE, SseEncoder, asse_stream, sse_stream
+from benchmark.api.streaming import (
+    aprime_stream,
+    prime_stream,
+    stream_until_disconnect,
+)
+from benchmark.core.config import settings
+from benchmark.core.timing import phase, record_unattributed
+from benchmark.llms.base import BaseLlm
+from benchmark.llms.cache import CACHE_HEADER, StoryCache
+from benchmark.storage.archive import (
+    StoryArchiver,
+    aarchived_stream,
+    archive_story,
+    archived_stream,
+)
 
 
 logger = logging.getLogger(__name__)
@@ -15,68 +37,154 @@ logger.setLevel(logging.DEBUG)
 
 router = APIRouter()
 
-tracer: trace.Tracer = trace.get_tracer(__name__)
 
+def story_response(data: Dict[str, str], cache_status: Optional[str]) -> Response:
+    """Validates `data` once and serializes it with orjson.
+
+    Returning a `Response` makes FastAPI skip the `response_model`
+    validation and serialization, which would be a second pass over the
+    same data. `response_model` is kept for the OpenAPI schema.
+    """
+    with phase("serialization"):
+        StoryResponse.model_validate(data)
+
+        headers = None
+        if cache_status is not None:
+            headers = {CACHE_HEADER: cache_status}
+
+        return ORJSONResponse(data, headers=headers)
 
-# async def astreamer(generator):
-#     try:
-#         for i in generator:
-#             logger.info(i)
-#             yield (i)
-#             await asyncio.sleep(.1)
-#     except asyncio.CancelledError:
-#         print('cancelled')
+
+def build_sse_encoder() -> SseEncoder:
+    return SseEncoder(
+        coalesce_bytes=settings.SSE_COALESCE_BYTES,
+        coalesce_window=settings.SSE_COALESCE_WINDOW,
+    )
 
 
 @router.get("/health")
 def healthcheck() -> Dict[str, str]:
     """Returns a health check"""
-    with tracer.start_as_current_span("test") as span:
-        span.set_attribute("test", "test")
     return {"status": "healthy"}
 
 
 @router.post("/write-story", response_model=StoryResponse)
-def write_story(model: StorytellerModel, topic: str):
-    if model in [
-        StorytellerModel.BEDROCK_CLAUDE_SONNET,
-        StorytellerModel.BEDROCK_CLAUDE_HAIKU,
-    ]:
-        llm = ClaudeBedrockLlm(model.value)
-    else:
-        llm = OpenAILlm(model.value)
+def write_story(
+    topic: str,
+    llm: BaseLlm = Depends(get_llm),
+    cache: StoryCache = Depends(get_story_cache),
+    archiver: Optional[StoryArchiver] = Depends(get_story_archiver),
+):
+    started_at = time.perf_counter()
+    record_unattributed("routing")
+    logger.info("Topic: %s", topic)
 
-    logger.info(topic)
+    data, cache_status = cache.get_story(llm, topic=topic)
+    archive_story(archiver, "write-story", llm, data, started_at, cache_status)
 
-    data = llm.get_story(topic=topic)
+    return story_response(data, cache_status)
 
-    data = StoryResponse.model_validate(data)
 
-    return data
+@router.post("/write-story-async", response_model=StoryResponse)
+async def write_story_async(
+    topic: str,
+    llm: BaseLlm = Depends(get_llm),
+    cache: StoryCache = Depends(get_story_cache),
+    archiver: Optional[StoryArchiver] = Depends(get_story_archiver),
+):
+    started_at = time.perf_counter()
+    record_unattributed("routing")
+    logger.info("Topic: %s", topic)
 
+    data, cache_status = await cache.get_story_async(llm, topic=topic)
+    archive_story(archiver, "write-story-async", llm, data, started_at, cache_status)
+
+    return story_response(data, cache_status)
 
-@router.post("/write-story-async", response_model=StoryResponse)
-async def write_story_async(model: StorytellerModel, topic: str):
-    llm = ClaudeBedrockLlm(model.value)
 
-    logger.info(topic)
+@router.post("/stream-story")
+def stream_story(
+    topic: str,
+    llm: BaseLlm = Depends(get_llm),
+    archiver: Optional[StoryArchiver] = Depends(get_story_archiver),
+):
+    started_at = time.perf_counter()
+    record_unattributed("routing")
+    logger.info("Topic: %s", topic)
+
+    encoder = build_sse_encoder()
+    stream = archived_stream(
+        prime_stream(llm.stream_story(topic=topic)),
+        archiver,
+        "stream-story",
+        llm,
+        topic,
+        started_at,
+    )
+
+    return StreamingResponse(
+        sse_stream(stream, encoder, settings.SSE_HEARTBEAT_SECONDS),
+        media_type=SSE_MEDIA_TYPE,
+    )
 
-    data = await llm.get_story_async(topic=topic)
 
-    data = StoryResponse.model_validate(data)
+@router.post("/stream-story-async")
+async def stream_story_async(
+    request: Request,
+    topic: str,
+    llm: BaseLlm = Depends(get_llm),
+    archiver: Optional[StoryArchiver] = Depends(get_story_archiver),
+):
+    started_at = time.perf_counter()
+    record_unattributed("routing")
+    logger.info("Topic: %s", topic)
+
+    encoder = build_sse_encoder()
+    stream = aarchived_stream(
+        await aprime_stream(llm.astream_story(topic=topic)),
+        archiver,
+        "stream-story-async",
+        llm,
+        topic,
+        started_at,
+    )
 
-    return data
+    return StreamingResponse(
+        asse_stream(
+            stream_until_disconnect(request, llm, stream),
+            encoder,
+            settings.SSE_HEARTBEAT_SECONDS,
+        ),
+        media_type=SSE_MEDIA_TYPE,
+    )
 
 
-@router.post("/stream-story")
-def stream_story(model: StorytellerModel, topic: str):
-    if model == StorytellerModel.BEDROCK_CLAUDE_SONNET:
-        llm = ClaudeBedrockLlm(model.value)
-    else:
-        llm = OpenAILlm(model.value)
+@router.post("/write-stories")
+async def write_stories(
+    batch: StoryBatchRequest,
+    request: Request,
+    cache: StoryCache = Depends(get_story_cache),
+    process_semaphore: asyncio.Semaphore = Depends(get_batch_semaphore),
+    archiver: Optional[StoryArchiver] = Depends(get_story_archiver),
+):
+    record_unattributed("routing")
+    if len(batch.topics) > settings.BATCH_MAX_TOPICS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"A batch can have at most {settings.BATCH_MAX_TOPICS} topics",
+        )
+
+    llm = await request.app.state.llm_registry.aget(batch.model)
+    concurrency = min(
+        batch.concurrency or settings.BATCH_MAX_CONCURRENCY,
+        settings.BATCH_MAX_CONCURRENCY,
+    )
 
-    logger.info(topic)
+    logger.info("Writing %s stories with %s", len(batch.topics), batch.model.value)
 
     return StreamingResponse(
-        llm.stream_story(topic=topic), media_type="text/event-stream; charset=utf-8"
+        generate_batch(
+            llm, cache, batch.topics, concurrency, process_semaphore, archiver
+        ),
+        media_type="application/x-ndjson",
     )
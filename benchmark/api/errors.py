@@ -0,0 +1,56 @@
+import logging
+import math
+
+from fastapi import FastAPI, Request
+from fastapi.responses import ORJSONResponse
+
+from benchmark.llms.exceptions import (
+    LlmOverloadedException,
+    LlmThrottledException,
+    LlmTimeoutException,
+)
+
+
+logger = logging.getLogger(__name__)
+
+THROTTLED_RETRY_AFTER = 1
+"""Seconds clients are asked to wait after the provider throttled a call"""
+
+
+def _retry_after(seconds: float) -> str:
+    return str(max(math.ceil(seconds), 1))
+
+
+async def overloaded_handler(request: Request, exc: LlmOverloadedException):
+    """A full wait queue means the client should back off (429), a queue
+    timeout means the service is saturated (503)"""
+    status_code = 429 if exc.queue_full else 503
+    logger.warning("Shedding %s with %s: %s", request.url.path, status_code, exc)
+
+    return ORJSONResponse(
+        status_code=status_code,
+        content={"detail": str(exc)},
+        headers={"Retry-After": _retry_after(exc.retry_after)},
+    )
+
+
+async def throttled_handler(request: Request, exc: LlmThrottledException):
+    return ORJSONResponse(
+        status_code=503,
+        content={"detail": "The LLM provider is throttling requests"},
+        headers={"Retry-After": _retry_after(THROTTLED_RETRY_AFTER)},
+    )
+
+
+async def timeout_handler(request: Request, exc: LlmTimeoutException):
+    return ORJSONResponse(
+        status_code=504,
+        content={"detail": "The LLM provider didn't answer in time"},
+    )
+
+
+def add_exception_handlers(app: FastAPI) -> None:
+    """Maps LLM admission and provider errors to HTTP responses"""
+    app.add_exception_handler(LlmOverloadedException, overloaded_handler)
+    app.add_exception_handler(LlmThrottledException, throttled_handler)
+    app.add_exception_handler(LlmTimeoutException, timeout_handler)
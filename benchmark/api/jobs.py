@@ -0,0 +1,109 @@
+from dataclasses import asdict
+from typing import AsyncIterator
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
+
+from benchmark.api.dependencies import get_job_queue
+from benchmark.api.schemas import JobRequest, JobResponse, JobStatus
+from benchmark.api.sse import HEARTBEAT, SSE_MEDIA_TYPE, format_event
+from benchmark.core.config import settings
+from benchmark.jobs.store import Job
+from benchmark.jobs.worker import JobQueue
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+QUEUE_FULL_RETRY_AFTER = 1
+"""Seconds clients are asked to wait when the job queue is full"""
+
+
+def to_schema(job: Job) -> JobResponse:
+    return JobResponse.model_validate(asdict(job))
+
+
+def job_response(job: Job, status_code: int = 200) -> Response:
+    return ORJSONResponse(
+        to_schema(job).model_dump(mode="json"), status_code=status_code
+    )
+
+
+def _event_name(job: Job) -> str:
+    if job.status == JobStatus.SUCCEEDED:
+        return "done"
+    if job.status == JobStatus.FAILED:
+        return "error"
+    return "status"
+
+
+async def job_events(
+    job_queue: JobQueue, job: Job, heartbeat: float
+) -> AsyncIterator[str]:
+    """Sends the job as an event each time its status changes, until it
+    finished with a `done` or `error` event. Heartbeats are sent in
+    between."""
+    event_id = 0
+    while True:
+        event_id += 1
+        yield format_event(
+            to_schema(job).model_dump_json(), event=_event_name(job), event_id=event_id
+        )
+        if job.finished:
+            return
+
+        status = job.status
+        while job.status == status:
+            changed = await job_queue.wait(job.id, heartbeat, status=status)
+            if changed is None:
+                # Expired in the meantime
+                return
+            if changed.status == status:
+                yield HEARTBEAT
+            job = changed
+
+
+@router.post("", response_model=JobResponse, status_code=202)
+async def submit_job(request: JobRequest, job_queue: JobQueue = Depends(get_job_queue)):
+    """Queues a story and answers right away. The story is then fetched
+    from `/jobs/{id}`."""
+    job = await job_queue.submit(request.model, request.topic)
+    if job is None:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many jobs waiting",
+            headers={"Retry-After": str(QUEUE_FULL_RETRY_AFTER)},
+        )
+
+    response = job_response(job, status_code=202)
+    response.headers["Location"] = f"{router.prefix}/{job.id}"
+    return response
+
+
+@router.get("/{job_id}", response_model=JobResponse)
+async def get_job(
+    job_id: str,
+    wait: float = Query(
+        default=0.0,
+        ge=0,
+        description="Seconds to wait for the job to finish, capped by the server",
+    ),
+    job_queue: JobQueue = Depends(get_job_queue),
+):
+    """Returns the job. With `wait`, long-polls until it finished."""
+    job = await job_queue.wait(job_id, min(wait, settings.JOBS_MAX_WAIT))
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No job {job_id}")
+
+    return job_response(job)
+
+
+@router.get("/{job_id}/events")
+async def get_job_events(job_id: str, job_queue: JobQueue = Depends(get_job_queue)):
+    """Streams the status changes of the job as server-sent events"""
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No job {job_id}")
+
+    return StreamingResponse(
+        job_events(job_queue, job, settings.SSE_HEARTBEAT_SECONDS),
+        media_type=SSE_MEDIA_TYPE,
+    )
@@ -1,5 +1,8 @@
 import enum
-from pydantic import BaseModel
+from datetime import datetime
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
 
 
 class StoryResponse(BaseModel):
@@ -12,3 +15,53 @@ class StorytellerModel(enum.Enum):
     GPT_4O_MINI = "gpt-4o-mini"
     BEDROCK_CLAUDE_SONNET = "anthropic.claude-3-5-sonnet-20240620-v1:0"
     BEDROCK_CLAUDE_HAIKU = "anthropic.claude-3-haiku-20240307-v1:0"
+    MOCK_INSTANT = "mock-instant"
+    MOCK_FAST = "mock-fast"
+    MOCK_REALISTIC = "mock-realistic"
+    MOCK_SLOW = "mock-slow"
+    MOCK_FLAKY = "mock-flaky"
+
+
+class StoryBatchRequest(BaseModel):
+    model: StorytellerModel
+    topics: List[str] = Field(min_length=1)
+    concurrency: Optional[int] = Field(
+        default=None,
+        ge=1,
+        description="Max stories generated at once, capped by the server limit",
+    )
+
+
+class StoryBatchItem(BaseModel):
+    """One NDJSON line of a `/write-stories` response"""
+
+    index: int
+    topic: str
+    story: Optional[str] = None
+    error: Optional[str] = None
+
+
+class JobStatus(str, enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+class JobRequest(BaseModel):
+    model: StorytellerModel
+    topic: str
+
+
+class JobResponse(BaseModel):
+    """State of a story job, with its story once it succeeded"""
+
+    id: str
+    status: JobStatus
+    model: str
+    topic: str
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    story: Optional[str] = None
+    error: Optional[str] = None
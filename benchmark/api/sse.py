@@ -0,0 +1,270 @@
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+import anyio
+import orjson
+
+from benchmark.core.timing import current_timer
+from benchmark.llms.exceptions import LlmException
+
+
+logger = logging.getLogger(__name__)
+
+SSE_MEDIA_TYPE = "text/event-stream; charset=utf-8"
+HEARTBEAT = ": ping\n\n"
+PUMP_QUEUE_SIZE = 64
+"""Deltas read ahead of the client before the provider stream is paused"""
+
+_END = object()
+_TICK = object()
+
+
+def _dumps(data: Dict[str, Any]) -> str:
+    return orjson.dumps(data).decode("utf-8")
+
+
+def format_event(
+    data: str, event: Optional[str] = None, event_id: Optional[int] = None
+) -> str:
+    """Frames `data` as a server-sent event, one `data:` line per line"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event is not None:
+        lines.append(f"event: {event}")
+    lines.extend(f"data: {line}" for line in data.split("\n"))
+    return "\n".join(lines) + "\n\n"
+
+
+class SseEncoder:
+    """Turns story deltas into server-sent events.
+
+    Deltas are buffered and sent as a single `message` event once the buffer
+    reaches `coalesce_bytes` or its oldest delta waited `coalesce_window`
+    seconds. A threshold at 0 is disabled, and with both at 0 every delta is
+    its own event. The stream ends with a `done` event carrying the stream
+    stats, or an `error` event when the provider fails mid-stream. Timed
+    requests also get their phases in that event, as the `Server-Timing`
+    header is sent before the stream.
+
+    Parameters
+    ----------
+    coalesce_bytes : int
+        Buffered bytes that trigger a flush, 0 disables it
+    coalesce_window : float
+        Max seconds a delta is buffered, 0 disables it
+    """
+
+    def __init__(self, coalesce_bytes: int = 0, coalesce_window: float = 0.0) -> None:
+        self.coalesce_bytes = coalesce_bytes
+        self.coalesce_window = coalesce_window
+
+        self.start_time = time.perf_counter()
+        self.first_delta_time: Optional[float] = None
+        self.next_id = 0
+        self.deltas = 0
+        self.bytes = 0
+        self.frames = 0
+        self._buffer: List[str] = []
+        self._buffered_bytes = 0
+        self._buffered_at = 0.0
+
+    @property
+    def flush_deadline(self) -> Optional[float]:
+        """`perf_counter` time at which the buffer must be flushed, None when
+        there's no time limit"""
+        if not self._buffer or not self.coalesce_window:
+            return None
+        return self._buffered_at + self.coalesce_window
+
+    def push(self, delta: str) -> Optional[str]:
+        """Buffers `delta`, returns a frame if the buffer must be flushed"""
+        now = time.perf_counter()
+        if self.first_delta_time is None:
+            self.first_delta_time = now
+        if not self._buffer:
+            self._buffered_at = now
+
+        self._buffer.append(delta)
+        self._buffered_bytes += len(delta.encode("utf-8"))
+        self.deltas += 1
+
+        if not (self.coalesce_bytes or self.coalesce_window):
+            return self.flush()
+
+        full = self.coalesce_bytes and self._buffered_bytes >= self.coalesce_bytes
+        expired = (
+            self.coalesce_window and now - self._buffered_at >= self.coalesce_window
+        )
+        if full or expired:
+            return self.flush()
+        return None
+
+    def flush(self) -> Optional[str]:
+        """Returns the buffered deltas as a single frame, if any"""
+        if not self._buffer:
+            return None
+
+        frame = format_event("".join(self._buffer), event_id=self._take_id())
+        self.frames += 1
+        self.bytes += self._buffered_bytes
+        self._buffer.clear()
+        self._buffered_bytes = 0
+        return frame
+
+    def done(self) -> str:
+        """Flushes the buffer and appends the final `done` event"""
+        frame = self.flush() or ""
+        return frame + format_event(
+            _dumps(self.stats()), event="done", event_id=self._take_id()
+        )
+
+    def error(self, e: Exception) -> str:
+        """Flushes the buffer and appends an `error` event for `e`"""
+        frame = self.flush() or ""
+        data = {"error": type(e).__name__, "detail": str(e), **self.stats()}
+        return frame + format_event(
+            _dumps(data), event="error", event_id=self._take_id()
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        duration = time.perf_counter() - self.start_time
+        ttft = None
+        if self.first_delta_time is not None:
+            ttft = round(self.first_delta_time - self.start_time, 4)
+
+        stats = {
+            "deltas": self.deltas,
+            "bytes": self.bytes,
+            "frames": self.frames,
+            "time_to_first_delta": ttft,
+            "duration": round(duration, 4),
+            "deltas_per_second": round(self.deltas / duration, 2) if duration else None,
+        }
+
+        timer = current_timer()
+        if timer is not None:
+            stats["phases"] = timer.summary()
+
+        return stats
+
+    def _take_id(self) -> int:
+        self.next_id += 1
+        return self.next_id
+
+
+def sse_stream(
+    stream: Iterator[str], encoder: SseEncoder, heartbeat: float
+) -> Iterator[str]:
+    """Encodes a sync story stream as server-sent events.
+
+    A blocked sync iterator can't be interrupted, so the coalescing window
+    and heartbeats are only checked when a delta arrives.
+    """
+    last_sent = time.perf_counter()
+    try:
+        for delta in stream:
+            frame = encoder.push(delta)
+            if frame is None and time.perf_counter() - last_sent >= heartbeat:
+                frame = encoder.flush() or HEARTBEAT
+            if frame is not None:
+                last_sent = time.perf_counter()
+                yield frame
+
+    except LlmException as e:
+        logger.warning("Stream failed after %s deltas: %r", encoder.deltas, e)
+        yield encoder.error(e)
+        return
+
+    finally:
+        stream.close()
+
+    yield encoder.done()
+
+
+async def _pump(stream: AsyncIterator[str], queue: asyncio.Queue) -> None:
+    """Moves the deltas of `stream` to `queue`, followed by `_END` or the
+    exception that ended the stream"""
+    item: Any = _END
+    try:
+        async for delta in stream:
+            await queue.put(delta)
+    except Exception as e:
+        item = e
+    finally:
+        await stream.aclose()
+
+    await queue.put(item)
+
+
+def _tick(queue: asyncio.Queue) -> None:
+    try:
+        queue.put_nowait(_TICK)
+    except asyncio.QueueFull:
+        # Deltas are waiting, they'll wake the encoder anyway
+        pass
+
+
+async def asse_stream(
+    stream: AsyncIterator[str], encoder: SseEncoder, heartbeat: float
+) -> AsyncIterator[str]:
+    """Encodes an async story stream as server-sent events.
+
+    The stream is consumed by a separate task and a loop timer wakes the
+    encoder, so buffered deltas are flushed when the coalescing window ends
+    and heartbeats are sent while the provider is silent, even if no delta
+    arrives.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=PUMP_QUEUE_SIZE)
+    pump = asyncio.ensure_future(_pump(stream, queue))
+    timer: Optional[asyncio.TimerHandle] = None
+    last_sent = time.perf_counter()
+    try:
+        while True:
+            deadline = last_sent + heartbeat
+            if encoder.flush_deadline is not None:
+                deadline = min(deadline, encoder.flush_deadline)
+            timer = loop.call_later(
+                max(deadline - time.perf_counter(), 0), _tick, queue
+            )
+
+            item = await queue.get()
+            timer.cancel()
+
+            if item is _END:
+                break
+            if isinstance(item, Exception):
+                raise item
+
+            if item is _TICK:
+                # Ticks may be stale, check which deadline actually passed
+                now = time.perf_counter()
+                frame = None
+                if encoder.flush_deadline is not None and now >= encoder.flush_deadline:
+                    frame = encoder.flush()
+                elif now - last_sent >= heartbeat:
+                    frame = encoder.flush() or HEARTBEAT
+            else:
+                frame = encoder.push(item)
+
+            if frame is not None:
+                last_sent = time.perf_counter()
+                yield frame
+
+    except LlmException as e:
+        logger.warning("Stream failed after %s deltas: %r", encoder.deltas, e)
+        yield encoder.error(e)
+        return
+
+    finally:
+        if timer is not None:
+            timer.cancel()
+        if not pump.done():
+            pump.cancel()
+            with anyio.CancelScope(shield=True):
+                await asyncio.gather(pump, return_exceptions=True)
+
+    yield encoder.done()
@@ -0,0 +1,111 @@
+import logging
+from typing import AsyncIterator, Iterator, Optional
+
+import anyio
+from starlette.requests import Request
+
+from benchmark.llms.base import BaseLlm
+from benchmark.utils import STREAM_TOKENS_SAVED, STREAMS_ABORTED
+
+
+logger = logging.getLogger(__name__)
+
+
+def prime_stream(stream: Iterator[str]) -> Iterator[str]:
+    """Pulls the first delta of `stream` right away, so admission and
+    provider errors are raised before the response starts and can still be
+    answered with a proper status code. Returns an iterator over the whole
+    stream."""
+    try:
+        first = next(stream)
+    except StopIteration:
+        return _chain(None, stream)
+    except BaseException:
+        stream.close()
+        raise
+
+    return _chain(first, stream)
+
+
+def _chain(first: Optional[str], stream: Iterator[str]) -> Iterator[str]:
+    try:
+        if first is not None:
+            yield first
+        yield from stream
+    finally:
+        stream.close()
+
+
+async def aprime_stream(stream: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Async equivalent of `prime_stream`"""
+    try:
+        first = await stream.__anext__()
+    except StopAsyncIteration:
+        return _achain(None, stream)
+    except BaseException:
+        await stream.aclose()
+        raise
+
+    return _achain(first, stream)
+
+
+async def _achain(
+    first: Optional[str], stream: AsyncIterator[str]
+) -> AsyncIterator[str]:
+    try:
+        if first is not None:
+            yield first
+        async for delta in stream:
+            yield delta
+    finally:
+        await stream.aclose()
+
+
+async def stream_until_disconnect(
+    request: Request, llm: BaseLlm, stream: AsyncIterator[str]
+) -> AsyncIterator[str]:
+    """Relays `stream`, a story stream of `llm`, to the client, closing the
+    upstream stream as soon as the client goes away.
+
+    Disconnects are detected both by polling the request between chunks and
+    by the cancellation `StreamingResponse` raises when it receives
+    `http.disconnect`. Either way the upstream generator is closed inside a
+    shielded scope so the provider connection is released right away.
+
+    Parameters
+    ----------
+    request : Request
+        The incoming request, used to detect client disconnects
+    llm : BaseLlm
+        Provider that generates the story
+    stream : AsyncIterator[str]
+        Story stream, usually primed with `aprime_stream`
+    """
+    deltas = 0
+    aborted = False
+
+    try:
+        async for delta in stream:
+            if await request.is_disconnected():
+                aborted = True
+                break
+
+            deltas += 1
+            yield delta
+
+    except (anyio.get_cancelled_exc_class(), GeneratorExit):
+        aborted = True
+        raise
+
+    finally:
+        if aborted:
+            logger.info(
+                "Client disconnected after %s deltas, closing upstream stream", deltas
+            )
+            STREAMS_ABORTED.labels(provider=llm.provider, model=llm.model_id).inc()
+            STREAM_TOKENS_SAVED.labels(provider=llm.provider, model=llm.model_id).inc(
+                max(llm.max_tokens - deltas, 0)
+            )
+
+        with anyio.CancelScope(shield=True):
+            await stream.aclose()
@@ -1,8 +1,10 @@
-from typing import List, Optional
+from typing import Any, Dict, List, Literal, Optional
 
 from pydantic import AnyHttpUrl
 from pydantic_settings import BaseSettings
 
+from benchmark.core.constants import CACHE_DIR
+
 
 class Settings(BaseSettings):
     BACKEND_CORS_ORIGINS: List[AnyHttpUrl] = []
@@ -13,6 +15,285 @@ class Settings(BaseSettings):
     AWS_S3_ENDPOINT_URL: Optional[str] = None
     AWS_S3_BUCKET_NAME: str
 
+    WEB_CONCURRENCY: int = 1
+    """Workers started by gunicorn, which reads the same variable. Workers set
+    with `-w` instead aren't seen here."""
+
+    BEDROCK_REGION: str = "us-east-1"
+    BEDROCK_REGIONS: List[str] = []
+    """Extra Bedrock regions stories can be routed to"""
+
+    ROUTING_ENABLED: bool = False
+    """Routes every model to the fastest healthy region or equivalent model"""
+    MODEL_GROUPS: Dict[str, List[str]] = {}
+    """Models each model can fail over to, as JSON, e.g.
+    {"anthropic.claude-3-haiku-20240307-v1:0": ["gpt-4o-mini"]}"""
+    ROUTING_EWMA_ALPHA: float = 0.2
+    """Weight of the latest call in the backend latency and error rate"""
+    ROUTING_FAILURE_THRESHOLD: float = 0.5
+    """Error rate that opens the circuit of a backend"""
+    ROUTING_MIN_CALLS: int = 10
+    """Calls to a backend before its circuit can open"""
+    ROUTING_OPEN_SECONDS: float = 30.0
+    """Seconds a circuit stays open before a probe call"""
+    ROUTING_EXPLORE_RATE: float = 0.05
+    """Share of calls routed to a random healthy backend to refresh its stats"""
+
+    LLM_MAX_POOL_CONNECTIONS: int = 100
+    """Max connections kept by each provider client's HTTP pool"""
+    LLM_KEEPALIVE_EXPIRY: float = 60.0
+    """Seconds an idle pooled connection is kept alive"""
+    LLM_TIMEOUT: float = 60.0
+    """Read timeout, in seconds, of the async Bedrock HTTP client"""
+
+    LIMITER_ENABLED: bool = False
+    """Enables adaptive concurrency limiting and load shedding per model"""
+    LIMITER_INITIAL_LIMIT: int = 20
+    LIMITER_MIN_LIMIT: int = 1
+    LIMITER_MAX_LIMIT: int = 200
+    LIMITER_MAX_QUEUE: int = 50
+    """Max calls waiting for a slot, more are rejected with a 429"""
+    LIMITER_QUEUE_TIMEOUT: float = 5.0
+    """Max seconds a call waits for a slot before being rejected with a 503"""
+    LIMITER_BACKOFF: float = 0.9
+    """Factor applied to the limit when the provider shows congestion"""
+    LIMITER_LATENCY_TOLERANCE: float = 2.0
+    """Short/long-term latency ratio treated as congestion"""
+
+    HEDGING_ENABLED: bool = False
+    """Hedges non-streaming calls running past the latency percentile"""
+    HEDGING_PERCENTILE: float = 95.0
+    """Latency percentile of the model after which a call is hedged"""
+    HEDGING_BUDGET_PERCENT: float = 5.0
+    """Max hedges, as a percentage of the non-streaming calls"""
+    HEDGING_WINDOW: int = 500
+    """Number of recent call durations the percentile is computed on"""
+    HEDGING_MIN_SAMPLES: int = 20
+    """Calls observed before hedging starts"""
+
+    ANYIO_THREADPOOL_SIZE: int = 40
+    """Threads running sync endpoints, dependencies and stream iterators"""
+    HEDGING_EXECUTOR_WORKERS: int = 100
+    """Threads running the sync calls of hedged models"""
+
+    LOOP_MONITOR_ENABLED: bool = False
+    """Samples event loop lag and reports what blocks the loop"""
+    LOOP_MONITOR_INTERVAL: float = 0.1
+    """Seconds between two event loop lag samples"""
+    LOOP_BLOCK_THRESHOLD: float = 0.25
+    """Seconds the loop can be blocked before the offending stack is logged"""
+
+    PHASE_TIMING_ENABLED: bool = False
+    """Times the phases of each request and sends them in `Server-Timing`"""
+    PHASE_METRICS_ENABLED: bool = False
+    """Also exports the phase durations as histograms"""
+
+    LOG_FORMAT: Literal["text", "json"] = "text"
+    """`json` writes one JSON object per record, with trace and span ids"""
+    LOG_QUEUE_ENABLED: bool = False
+    """Formats and writes log records on a background thread"""
+    LOG_QUEUE_SIZE: int = 10000
+    """Records waiting for the log thread before new ones are dropped"""
+    LOG_SAMPLE_RATE: float = 1.0
+    """Fraction of DEBUG and INFO records kept"""
+    LOG_RATE_LIMIT: float = 0.0
+    """Max DEBUG and INFO records per second of each call site, 0 disables it"""
+
+    LAZY_PROVIDER_IMPORTS: bool = False
+    """Imports boto3 and openai on the first request of a model that needs
+    them instead of on startup"""
+    PREWARM_MODELS: List[str] = []
+    """Models whose clients are created and connections opened before the
+    worker reports ready"""
+    PREWARM_CONNECTIONS: int = 4
+    """Upstream connections opened by each pre-warmed client"""
+    PREWARM_TIMEOUT: float = 5.0
+    """Seconds startup waits for the pre-warmed connections"""
+
+    MOCK_LLM_SEED: int = 0
+    MOCK_LLM_PROFILE_OVERRIDES: Dict[str, Dict[str, Any]] = {}
+    """Per mock model overrides of `MockProfile` fields, as JSON, e.g.
+    {"mock-fast": {"ttft": 0.1, "throttle_rate": 0.05}}"""
+
+    BATCH_MAX_TOPICS: int = 1000
+    BATCH_MAX_CONCURRENCY: int = 8
+    """Max stories of a single batch generated at once"""
+    BATCH_PROCESS_MAX_CONCURRENCY: int = 32
+    """Max batch stories generated at once across all batches of a worker"""
+
+    SSE_HEARTBEAT_SECONDS: float = 15.0
+    """Seconds without events after which a heartbeat comment is sent"""
+    SSE_COALESCE_BYTES: int = 0
+    """Buffered bytes that flush a story stream event, 0 disables it. With
+    both thresholds at 0 every delta is sent as its own event."""
+    SSE_COALESCE_WINDOW: float = 0.0
+    """Max seconds a delta is buffered before its event is sent, 0 disables it"""
+
+    STREAM_FANOUT_ENABLED: bool = False
+    """Concurrent /stream-story requests for the same model and topic share
+    one upstream stream"""
+    STREAM_FANOUT_REPLAY_SIZE: int = 4096
+    """Deltas of a shared stream replayed to late subscribers"""
+    STREAM_FANOUT_MAX_LAG: int = 256
+    """Max deltas a subscriber can fall behind before the stream waits"""
+    STREAM_FANOUT_LAG_TIMEOUT: float = 5.0
+    """Seconds a lagging subscriber can hold a shared stream before it is
+    dropped"""
+
+    STORY_CACHE_BACKEND: Optional[Literal["memory", "disk"]] = None
+    """Where generated stories are cached, caching is disabled when None"""
+    STORY_CACHE_TTL: float = 3600.0
+    STORY_CACHE_MAX_ENTRIES: int = 1024
+    STORY_CACHE_PATH: str = str(CACHE_DIR / "stories.sqlite3")
+
+    DATASET_ENABLED: bool = False
+    """Serves the S3 dataset under /data from a local copy in each worker"""
+    DATASET_CACHE_DIR: str = str(CACHE_DIR / "dataset")
+    DATASET_REFRESH_INTERVAL: float = 300.0
+    """Seconds between two ETag checks of the dataset, 0 disables them"""
+    DATASET_CHUNK_SIZE: int = 64 * 1024
+    """Bytes per chunk of a streamed dataset response"""
+    DATASET_MAX_LIMIT: int = 1000
+    """Max records returned by one dataset query"""
+
+    ARCHIVE_ENABLED: bool = False
+    """Archives every generated story to S3 as gzipped JSON Lines"""
+    ARCHIVE_BUCKET_NAME: Optional[str] = None
+    """Bucket of the archive, `AWS_S3_BUCKET_NAME` when not set"""
+    ARCHIVE_PREFIX: str = "stories"
+    ARCHIVE_QUEUE_SIZE: int = 10000
+    """Stories waiting to be archived before new ones are dropped"""
+    ARCHIVE_BATCH_BYTES: int = 32 * 1024 * 1024
+    """Uncompressed bytes of stories that trigger an upload"""
+    ARCHIVE_FLUSH_INTERVAL: float = 60.0
+    """Max seconds a story waits to be uploaded"""
+    ARCHIVE_PART_SIZE: int = 8 * 1024 * 1024
+    """Compressed bytes per part, larger batches use a multipart upload"""
+    ARCHIVE_CLOSE_TIMEOUT: float = 30.0
+    """Max seconds shutdown waits for the last stories to be uploaded"""
+
+    JOBS_ENABLED: bool = False
+    """Serves /jobs, stories generated in the background and fetched later"""
+    JOBS_STORE: Optional[Literal["memory", "sqlite"]] = None
+    """Where jobs are kept. The memory store is only seen by the worker that
+    ran the job, so with several workers `GET /jobs/{id}` answers 404 when
+    it reaches another one. `sqlite` lets every worker of the node read
+    them. When None, `sqlite` is used if `WEB_CONCURRENCY` is over 1."""
+    JOBS_STORE_PATH: str = str(CACHE_DIR / "jobs.sqlite3")
+    JOBS_CONCURRENCY: int = 16
+    """Jobs generated at once by each worker"""
+    JOBS_QUEUE_SIZE: int = 1000
+    """Jobs waiting in a worker before new ones are rejected with a 429"""
+    JOBS_RESULT_TTL: float = 3600.0
+    """Seconds a finished job is kept, and after which an unfinished one is
+    failed by the next worker that starts"""
+    JOBS_MAX_ENTRIES: int = 10000
+    """Max jobs of the memory store, the oldest finished ones are evicted first"""
+    JOBS_MAX_WAIT: float = 30.0
+    """Max seconds a `GET /jobs/{id}?wait=` long-poll is held"""
+    JOBS_POLL_INTERVAL: float = 0.5
+    """Seconds between two reads of the store while waiting for a job run by
+    another worker"""
+    JOBS_SHUTDOWN_TIMEOUT: float = 10.0
+    """Seconds shutdown waits for running jobs before failing them"""
+
+    TRACING_ENABLED: bool = False
+    """Traces requests and upstream calls, exported over OTLP"""
+    TRACING_SAMPLE_RATIO: float = 1.0
+    """Fraction of the traces kept. Keep it at 1 when the collector does
+    tail sampling, or it never sees the dropped slow and failed traces."""
+    TRACING_PARENT_BASED: bool = True
+    """Follows the sampling decision of the caller for requests that are
+    part of a trace"""
+    TRACING_EXCLUDED_URLS: List[str] = ["/health", "/metrics"]
+    """Regular expressions of the URLs that aren't traced"""
+    TRACING_MAX_ATTRIBUTES: int = 32
+    """Max attributes per span, more are dropped"""
+    TRACING_MAX_EVENTS: int = 32
+    """Max events per span, e.g. request phases, more are dropped"""
+    TRACING_MAX_ATTRIBUTE_LENGTH: int = 2048
+    """Max characters of an attribute value, longer ones are truncated"""
+    TRACING_MAX_QUEUE_SIZE: int = 2048
+    """Spans waiting to be exported before new ones are dropped"""
+
+    METRICS_ENABLED: bool = True
+    """Exports Prometheus metrics on /metrics, with per-request metrics"""
+    PROMETHEUS_MULTIPROC_DIR: Optional[str] = None
+    """Enables prometheus_client's multi-process mode when set"""
+    METRICS_SCRAPE_CACHE_SECONDS: float = 1.0
+    """How long an aggregated multi-process scrape is reused"""
+    METRICS_EXEMPLARS_ENABLED: bool = False
+    """Attaches the trace and span ids of the request to LLM latency
+    observations. Exemplars are only exposed in the OpenMetrics format and
+    are lost in multi-process mode."""
+    TTFB_BUCKETS: List[float] = [
+        0.1,
+        0.25,
+        0.5,
+        0.75,
+        1,
+        1.5,
+        2,
+        3,
+        5,
+        7.5,
+        10,
+        15,
+        20,
+        30,
+        60,
+    ]
+    """Buckets of the LLM time to first byte, in seconds"""
+    FULL_RESPONSE_BUCKETS: List[float] = [
+        0.5,
+        1,
+        2.5,
+        5,
+        7.5,
+        10,
+        15,
+        20,
+        30,
+        45,
+        60,
+        90,
+        120,
+        180,
+        300,
+    ]
+    """Buckets of the LLM time to full response, in seconds"""
+    INTER_TOKEN_BUCKETS: List[float] = [
+        0.001,
+        0.005,
+        0.01,
+        0.02,
+        0.03,
+        0.05,
+        0.075,
+        0.1,
+        0.15,
+        0.25,
+        0.5,
+        1,
+        2.5,
+    ]
+    """Buckets of the time between two streamed deltas, in seconds"""
+    TOKENS_PER_SECOND_BUCKETS: List[float] = [
+        5,
+        10,
+        20,
+        30,
+        40,
+        50,
+        75,
+        100,
+        150,
+        200,
+        300,
+        500,
+    ]
+    """Buckets of the output tokens generated per second"""
+
     class Config:
         case_sensitive = True
 
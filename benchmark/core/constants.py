@@ -11,4 +11,7 @@ ROOT_DIR = (Path(CONSTANTS_DIR) / "..").resolve()
 LOGS_DIR = (ROOT_DIR / ".." / "logs").resolve()
 """Directory where logs are saved"""
 
+CACHE_DIR = (ROOT_DIR / ".." / "cache").resolve()
+"""Directory where on-disk caches are saved"""
+
 S3_DATA_KEY = "ceres.json"
@@ -0,0 +1,160 @@
+import asyncio
+import contextvars
+import logging
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from anyio import CapacityLimiter, to_thread
+
+from benchmark.core.timing import current_timer
+from benchmark.utils import (
+    THREADPOOL_BUSY_WORKERS,
+    THREADPOOL_QUEUE_DEPTH,
+    THREADPOOL_QUEUE_WAIT,
+    THREADPOOL_RUN_TIME,
+    THREADPOOL_SIZE,
+)
+
+try:
+    from anyio._backends._asyncio import _default_thread_limiter
+except ImportError:  # pragma: no cover - private AnyIO API moved
+    _default_thread_limiter = None
+
+
+logger = logging.getLogger(__name__)
+
+
+class _PoolMetrics:
+    """Labelled metric children of one pool"""
+
+    def __init__(self, pool: str, size: float) -> None:
+        self.queued = THREADPOOL_QUEUE_DEPTH.labels(pool=pool)
+        self.busy = THREADPOOL_BUSY_WORKERS.labels(pool=pool)
+        self.queue_wait = THREADPOOL_QUEUE_WAIT.labels(pool=pool)
+        self.run_time = THREADPOOL_RUN_TIME.labels(pool=pool)
+        THREADPOOL_SIZE.labels(pool=pool).set(size)
+
+
+class InstrumentedThreadPoolExecutor(ThreadPoolExecutor):
+    """`ThreadPoolExecutor` that exports its queue depth, busy workers, and
+    how long each task waited for a worker apart from how long it ran.
+    Tasks run in a copy of the submitter's context, so they keep its request
+    timer and active span.
+
+    Parameters
+    ----------
+    pool : str
+        Name of the pool, used as a metric label
+    max_workers : int
+        Max number of worker threads
+    """
+
+    def __init__(self, pool: str, max_workers: int) -> None:
+        super().__init__(max_workers=max_workers, thread_name_prefix=pool)
+        self.pool = pool
+        self._metrics = _PoolMetrics(pool, max_workers)
+
+    def submit(self, fn: Callable[..., Any], /, *args: Any, **kwargs: Any) -> Future:
+        metrics = self._metrics
+        enqueued_at = time.perf_counter()
+        context = contextvars.copy_context()
+
+        def run() -> Any:
+            started_at = time.perf_counter()
+            metrics.queued.dec()
+            metrics.queue_wait.observe(started_at - enqueued_at)
+            metrics.busy.inc()
+            try:
+                return context.run(fn, *args, **kwargs)
+            finally:
+                metrics.busy.dec()
+                metrics.run_time.observe(time.perf_counter() - started_at)
+
+        metrics.queued.inc()
+        future = super().submit(run)
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _on_done(self, future: Future) -> None:
+        # Tasks cancelled before reaching a worker never leave the queue
+        if future.cancelled():
+            self._metrics.queued.dec()
+
+
+class InstrumentedCapacityLimiter:
+    """Wraps the AnyIO `CapacityLimiter` guarding `to_thread.run_sync`, which
+    runs sync endpoints, dependencies and streaming iterators, with the same
+    metrics as `InstrumentedThreadPoolExecutor`. Calls that had to queue for
+    a thread record the wait as the `threadpool_wait` phase of the request.
+
+    Parameters
+    ----------
+    pool : str
+        Name of the pool, used as a metric label
+    limiter : CapacityLimiter
+        The wrapped limiter
+    """
+
+    def __init__(self, pool: str, limiter: CapacityLimiter) -> None:
+        self.pool = pool
+        self.limiter = limiter
+        self._metrics = _PoolMetrics(pool, limiter.total_tokens)
+        self._started_at: Dict[Optional[asyncio.Task], float] = {}
+
+    @property
+    def total_tokens(self) -> float:
+        return self.limiter.total_tokens
+
+    @total_tokens.setter
+    def total_tokens(self, value: float) -> None:
+        self.limiter.total_tokens = value
+        THREADPOOL_SIZE.labels(pool=self.pool).set(value)
+
+    async def __aenter__(self) -> None:
+        metrics = self._metrics
+        enqueued_at = time.perf_counter()
+        queued = self.limiter.available_tokens < 1
+        metrics.queued.inc()
+        try:
+            await self.limiter.acquire()
+        finally:
+            metrics.queued.dec()
+
+        started_at = time.perf_counter()
+        metrics.queue_wait.observe(started_at - enqueued_at)
+        if queued:
+            timer = current_timer()
+            if timer is not None:
+                timer.record("threadpool_wait", started_at - enqueued_at)
+        metrics.busy.inc()
+        self._started_at[asyncio.current_task()] = started_at
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        started_at = self._started_at.pop(asyncio.current_task())
+        self._metrics.busy.dec()
+        self._metrics.run_time.observe(time.perf_counter() - started_at)
+        self.limiter.release()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.limiter, name)
+
+
+def configure_default_thread_limiter(size: int) -> None:
+    """Resizes AnyIO's default threadpool and instruments it. Must be called
+    from the event loop serving requests, e.g. in `lifespan`.
+
+    Falls back to only resizing it if AnyIO's internals can't be patched.
+    """
+    limiter = to_thread.current_default_thread_limiter()
+    limiter.total_tokens = size
+
+    if _default_thread_limiter is None:
+        logger.warning("Can't instrument the AnyIO threadpool, only resizing it")
+        THREADPOOL_SIZE.labels(pool="anyio").set(size)
+        return
+
+    if not isinstance(limiter, InstrumentedCapacityLimiter):
+        _default_thread_limiter.set(InstrumentedCapacityLimiter("anyio", limiter))
+
+    logger.info("AnyIO threadpool size set to %s", size)
@@ -1,4 +1,13 @@
+import atexit
+import copy
+import logging
+import logging.config
+from logging.handlers import QueueListener
+from typing import Optional
+
+from benchmark.core.config import Settings
 from benchmark.core.constants import LOGS_DIR
+from benchmark.core.logging.handlers import build_filters, install_queue_handler
 
 
 LOGGING_CONFIG = {
@@ -16,6 +25,7 @@ LOGGING_CONFIG = {
             ),
             "style": "{",
         },
+        "json": {"()": "benchmark.core.logging.handlers.JsonFormatter"},
     },
     "handlers": {
         "file_handler": {
@@ -41,3 +51,38 @@ LOGGING_CONFIG = {
         }
     },
 }
+
+
+def configure_logging(settings: Settings) -> Optional[QueueListener]:
+    """Applies `LOGGING_CONFIG` and the logging settings of `settings`.
+
+    With `LOG_QUEUE_ENABLED` the handlers of the `benchmark` logger are moved
+    behind a queue, so formatting and disk I/O happen on a background thread
+    instead of in request handlers and on the event loop. The queue is
+    flushed when the process exits.
+
+    Returns
+    -------
+    Optional[QueueListener]
+        The thread writing the records, when queued
+    """
+    config = copy.deepcopy(LOGGING_CONFIG)
+    if settings.LOG_FORMAT == "json":
+        for handler in config["handlers"].values():
+            handler["formatter"] = "json"
+    logging.config.dictConfig(config)
+
+    logger = logging.getLogger("benchmark")
+    filters = build_filters(
+        settings.LOG_FORMAT, settings.LOG_SAMPLE_RATE, settings.LOG_RATE_LIMIT
+    )
+
+    if not settings.LOG_QUEUE_ENABLED:
+        for handler in logger.handlers:
+            for log_filter in filters:
+                handler.addFilter(log_filter)
+        return None
+
+    listener = install_queue_handler(logger, settings.LOG_QUEUE_SIZE, filters)
+    atexit.register(listener.stop)
+    return listener
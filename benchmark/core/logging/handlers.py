@@ -0,0 +1,209 @@
+import atexit
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from queue import Full, Queue
+from typing import Any, Dict, List, Tuple
+
+import orjson
+from opentelemetry import trace
+
+from benchmark.utils import LOG_RECORDS_DROPPED
+
+
+class TraceContextFilter(logging.Filter):
+    """Adds the trace and span ids of the current span to every record.
+
+    Must run on the thread that logs, i.e. on the `QueueHandler` when
+    records are written by a `QueueListener`.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = trace.get_current_span().get_span_context()
+        if context.is_valid:
+            record.trace_id = trace.format_trace_id(context.trace_id)
+            record.span_id = trace.format_span_id(context.span_id)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Thins out high-volume DEBUG and INFO records, warnings and errors
+    always pass.
+
+    A `sample_rate` fraction of the records is kept at random, then each
+    call site, i.e. source line, can log at most `rate_limit` records per
+    second with bursts of up to `rate_limit` records.
+
+    Parameters
+    ----------
+    sample_rate : float
+        Fraction of the records kept, between 0 and 1
+    rate_limit : float
+        Records per second of each call site, 0 disables the limit
+    """
+
+    def __init__(self, sample_rate: float = 1.0, rate_limit: float = 0.0) -> None:
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.rate_limit = rate_limit
+        self.burst = max(rate_limit, 1.0)
+        self._lock = threading.Lock()
+        self._buckets: Dict[Tuple[str, int], Tuple[float, float]] = {}
+        self._sampled_out = LOG_RECORDS_DROPPED.labels(reason="sampled")
+        self._rate_limited = LOG_RECORDS_DROPPED.labels(reason="rate_limited")
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            self._sampled_out.inc()
+            return False
+
+        if self.rate_limit > 0 and not self._take_token(record):
+            self._rate_limited.inc()
+            return False
+
+        return True
+
+    def _take_token(self, record: logging.LogRecord) -> bool:
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate_limit)
+            if tokens < 1.0:
+                self._buckets[key] = (tokens, now)
+                return False
+
+            self._buckets[key] = (tokens - 1.0, now)
+            return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, with the trace and span
+    ids added by `TraceContextFilter`"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data: Dict[str, Any] = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "process": record.process,
+            "thread": record.thread,
+            "filename": record.filename,
+            "lineno": record.lineno,
+        }
+
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id is not None:
+            data["trace_id"] = trace_id
+            data["span_id"] = record.span_id
+
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exception"] = record.exc_text
+
+        return orjson.dumps(data).decode("utf-8")
+
+
+class DeferredQueueHandler(QueueHandler):
+    """`QueueHandler` that leaves all the formatting to the listener thread.
+
+    The stock `prepare` merges the message and arguments and formats the
+    traceback on the logging thread, which is the work this handler is
+    meant to move off the request path. Records are handed over as they
+    are instead, so arguments are formatted when the record is written and
+    must not be mutated after being logged. Records are dropped when the
+    queue is full rather than blocking the caller.
+    """
+
+    def __init__(self, queue: Queue) -> None:
+        super().__init__(queue)
+        self._queue_full = LOG_RECORDS_DROPPED.labels(reason="queue_full")
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self._queue_full.inc()
+
+
+def install_queue_handler(
+    logger: logging.Logger, queue_size: int, filters: List[logging.Filter]
+) -> QueueListener:
+    """Moves the handlers of `logger` behind a `DeferredQueueHandler` and
+    starts the `QueueListener` thread that feeds them.
+
+    Parameters
+    ----------
+    logger : logging.Logger
+        Logger whose handlers are moved
+    queue_size : int
+        Records waiting to be written before new ones are dropped
+    filters : List[logging.Filter]
+        Filters run on the logging thread, before records are queued
+
+    Returns
+    -------
+    QueueListener
+        The started listener, `stop` it to flush the queue
+
+    Notes
+    -----
+    Threads don't survive a fork, so a process forked after this call, e.g.
+    a gunicorn worker of a preloaded app, gets a new queue and listener,
+    stopped when it exits instead of the returned one.
+    """
+    handlers = list(logger.handlers)
+    queue_handler = DeferredQueueHandler(Queue(maxsize=queue_size))
+    # Records no handler would write are dropped before being queued
+    queue_handler.setLevel(min((h.level for h in handlers), default=logging.NOTSET))
+    for log_filter in filters:
+        queue_handler.addFilter(log_filter)
+
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(queue_handler)
+
+    listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+
+    def restart_in_child() -> None:
+        # The parent's queue may hold records and its lock may be taken
+        queue: Queue = Queue(maxsize=queue_size)
+        child_listener = QueueListener(queue, *handlers, respect_handler_level=True)
+        queue_handler.queue = queue
+        child_listener.start()
+        # The parent's listener has no thread in the child
+        atexit.unregister(listener.stop)
+        atexit.register(child_listener.stop)
+
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=restart_in_child)
+
+    return listener
+
+
+def build_filters(
+    log_format: str, sample_rate: float, rate_limit: float
+) -> List[logging.Filter]:
+    """Returns the filters the logging settings call for"""
+    filters: List[logging.Filter] = []
+    if sample_rate < 1.0 or rate_limit > 0:
+        filters.append(SamplingFilter(sample_rate, rate_limit))
+    if log_format == "json":
+        filters.append(TraceContextFilter())
+    return filters
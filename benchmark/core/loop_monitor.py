@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import Dict, Optional
+
+from opentelemetry import trace
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from benchmark.utils import EVENT_LOOP_BLOCKS, EVENT_LOOP_LAG
+
+
+logger = logging.getLogger(__name__)
+
+MAX_STACK_FRAMES = 30
+
+_task_spans: Dict[asyncio.Task, trace.Span] = {}
+"""Span of every in-flight request task. C tasks don't expose their context
+to other threads before Python 3.12, so this is how the watchdog finds the
+span of the request that blocked the loop."""
+
+
+class TaskSpanMiddleware:
+    """Pure ASGI middleware that registers the current span of each request
+    task for `LoopMonitor`"""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        task = asyncio.current_task()
+        _task_spans[task] = trace.get_current_span()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _task_spans.pop(task, None)
+
+
+class LoopMonitor:
+    """Measures event loop health from inside and outside the loop.
+
+    A task sleeps for `interval` and records how late it wakes up in the
+    `EVENT_LOOP_LAG` histogram. A watchdog thread checks that those wake ups
+    keep coming: when the loop has been stuck for more than `threshold`
+    seconds, it captures the loop thread's stack and attaches it to a
+    warning log and, when the blocking task serves a request, to its span.
+
+    Parameters
+    ----------
+    interval : float
+        Seconds between two lag samples
+    threshold : float
+        Seconds the loop can be blocked before the stack is captured
+    """
+
+    def __init__(self, interval: float, threshold: float) -> None:
+        self.interval = interval
+        self.threshold = threshold
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._last_beat = time.monotonic()
+        self._reported_beat = 0.0
+
+    def start(self) -> None:
+        """Starts monitoring the running loop"""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._task = self._loop.create_task(self._sample())
+        self._watchdog = threading.Thread(
+            target=self._watch, name="loop-watchdog", daemon=True
+        )
+        self._watchdog.start()
+        logger.info(
+            "Monitoring event loop lag every %ss, reporting blocks over %ss",
+            self.interval,
+            self.threshold,
+        )
+
+    async def stop(self) -> None:
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _sample(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            EVENT_LOOP_LAG.observe(max(loop.time() - start - self.interval, 0.0))
+            self._last_beat = time.monotonic()
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self.threshold / 2):
+            last_beat = self._last_beat
+            blocked_for = time.monotonic() - last_beat - self.interval
+            if blocked_for > self.threshold and last_beat != self._reported_beat:
+                self._reported_beat = last_beat
+                self._report(blocked_for)
+
+    def _report(self, blocked_for: float) -> None:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+
+        stack = "".join(traceback.format_stack(frame)[-MAX_STACK_FRAMES:])
+        EVENT_LOOP_BLOCKS.inc()
+        logger.warning(
+            "Event loop blocked for over %.3fs, loop thread stack:\n%s",
+            blocked_for,
+            stack,
+        )
+
+        task = asyncio.current_task(self._loop)
+        span = _task_spans.get(task) if task is not None else None
+        if span is not None and span.is_recording():
+            span.add_event(
+                "event_loop.blocked",
+                {"blocked_seconds": round(blocked_for, 3), "stack": stack},
+            )
@@ -0,0 +1,94 @@
+"""Helpers for prometheus_client's multi-process mode under gunicorn.
+
+Each worker writes its metrics into mmap-backed files inside
+``PROMETHEUS_MULTIPROC_DIR`` and ``/metrics`` aggregates all of them. Files of
+dead workers are compacted into a single archive per metric type, so the
+number of files read on every scrape stays bounded by the number of live
+workers instead of growing with every worker restart.
+
+This module is imported by ``gunicorn.conf.py`` in the master process, so it
+must not import the application.
+"""
+import fcntl
+import glob
+import os
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+from prometheus_client.mmap_dict import MmapedDict
+from prometheus_client.multiprocess import mark_process_dead
+
+LOCK_FILE = ".lock"
+
+ARCHIVE_ID = "archive"
+"""Takes the place of the pid in archive file names, e.g. ``counter_archive.db``"""
+
+COMPACTED_TYPES = ("counter", "histogram", "summary")
+"""Metric types whose samples can be summed across processes"""
+
+
+@contextmanager
+def directory_lock(path: str, shared: bool = False) -> Iterator[None]:
+    """Locks the multiprocess directory.
+
+    Scrapes take a shared lock and compaction an exclusive one, so a scrape
+    never sees a dead worker's samples both in its own file and in the archive.
+
+    Parameters
+    ----------
+    path : str
+        The multiprocess directory
+    shared : bool, optional
+        Whether to take a shared lock instead of an exclusive one, by default False
+    """
+    with open(os.path.join(path, LOCK_FILE), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def reset_directory(path: str) -> None:
+    """Creates `path` and removes metric files left over by a previous run"""
+    os.makedirs(path, exist_ok=True)
+    for f in glob.glob(os.path.join(path, "*.db")):
+        os.remove(f)
+
+
+def compact_dead_worker(path: str, pid: int) -> None:
+    """Removes the files of a dead worker, folding its counters, histograms and
+    summaries into the per-type archive files.
+
+    Parameters
+    ----------
+    path : str
+        The multiprocess directory
+    pid : int
+        Pid of the worker that exited
+    """
+    with directory_lock(path):
+        mark_process_dead(pid, path)
+
+        for typ in COMPACTED_TYPES:
+            worker_file = os.path.join(path, f"{typ}_{pid}.db")
+            if not os.path.exists(worker_file):
+                continue
+
+            archive_file = os.path.join(path, f"{typ}_{ARCHIVE_ID}.db")
+            values: Dict[str, float] = {}
+            for f in (archive_file, worker_file):
+                if os.path.exists(f):
+                    for key, value, _ in MmapedDict.read_all_values_from_file(f):
+                        values[key] = values.get(key, 0.0) + value
+
+            tmp_file = os.path.join(path, f"{typ}_{ARCHIVE_ID}.tmp")
+            archive = MmapedDict(tmp_file)
+            try:
+                for key, value in values.items():
+                    archive.write_value(key, value)
+            finally:
+                archive.close()
+
+            os.replace(tmp_file, archive_file)
+            os.remove(worker_file)
@@ -0,0 +1,85 @@
+"""Startup time breakdown of a worker and the helpers that keep it short.
+
+This module is imported by ``gunicorn.conf.py`` in the master process, so it
+must not import the application nor the provider SDKs at module level.
+"""
+import importlib
+import logging
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Tuple
+
+PROVIDER_MODULES: Tuple[str, ...] = (
+    "benchmark.llms.bedrock",
+    "benchmark.llms.gpt",
+)
+"""Modules that pull in the provider SDKs, i.e. boto3, botocore and openai"""
+
+
+class StartupTimer:
+    """Accumulates the time spent in each step of a worker's startup.
+
+    The clock starts when this module is imported, which is before the rest
+    of the application when ``benchmark.main`` imports it first, and is
+    restarted in every worker forked by gunicorn. Steps are kept in the order
+    they first ran.
+    """
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.steps: Dict[str, float] = {}
+
+    def reset(self) -> None:
+        """Restarts the clock and drops the steps, e.g. right after a fork"""
+        self.start = time.perf_counter()
+        self.steps = {}
+
+    def record(self, name: str, duration: float) -> None:
+        """Adds `duration` seconds to step `name`"""
+        self.steps[name] = self.steps.get(name, 0.0) + duration
+
+    def record_unattributed(self, name: str) -> None:
+        """Records the time since the clock started that no step accounts
+        for yet as step `name`"""
+        elapsed = time.perf_counter() - self.start
+        self.record(name, max(elapsed - sum(self.steps.values()), 0.0))
+
+    @contextmanager
+    def step(self, name: str) -> Iterator[None]:
+        """Times the body of the `with` block as step `name`"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def summary(self) -> Dict[str, float]:
+        """Milliseconds spent in each step, and since the clock started"""
+        summary = {name: round(d * 1000, 1) for name, d in self.steps.items()}
+        summary["total"] = round((time.perf_counter() - self.start) * 1000, 1)
+        return summary
+
+    def report(self, logger: logging.Logger) -> None:
+        """Logs the breakdown and exports it to `STARTUP_DURATION`"""
+        # Imported here, the metrics need the settings of a worker
+        from benchmark.utils import STARTUP_DURATION
+
+        summary = self.summary()
+        for name, ms in summary.items():
+            STARTUP_DURATION.labels(step=name).set(ms / 1000)
+
+        logger.info(
+            "Startup took %.1f ms (%s)",
+            summary.pop("total"),
+            ", ".join(f"{name}: {ms} ms" for name, ms in summary.items()),
+        )
+
+
+startup_timer = StartupTimer()
+"""Startup timer of the current process"""
+
+
+def import_providers() -> None:
+    """Imports the provider SDKs ahead of the first request that needs them"""
+    for module in PROVIDER_MODULES:
+        importlib.import_module(module)
@@ -0,0 +1,201 @@
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Any, ContextManager, Dict, Iterator, Optional
+
+from opentelemetry import trace
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from benchmark.utils import REQUEST_PHASE_DURATION
+
+if TYPE_CHECKING:
+    import httpx
+
+
+SERVER_TIMING_HEADER = "Server-Timing"
+
+UPSTREAM_TRACE_PHASES = {
+    "connect_tcp": "upstream_connect",
+    "start_tls": "upstream_connect",
+    "receive_response_body": "upstream_body",
+}
+"""Phase of each timed httpcore step. TTFB spans several steps and is
+handled apart."""
+
+_current_timer: ContextVar[Optional["PhaseTimer"]] = ContextVar(
+    "phase_timer", default=None
+)
+
+
+class PhaseTimer:
+    """Accumulates the time a request spends in each phase.
+
+    Phases are kept in the order they first ran and add up when they run
+    more than once. Every recorded phase is also added as an event to the
+    active span.
+    """
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+
+    def record(self, name: str, duration: float) -> None:
+        """Adds `duration` seconds to phase `name`"""
+        self.phases[name] = self.phases.get(name, 0.0) + duration
+
+        span = trace.get_current_span()
+        if span.is_recording():
+            span.add_event(f"phase.{name}", {"duration_ms": round(duration * 1000, 3)})
+
+    def record_unattributed(self, name: str) -> None:
+        """Records the time since the request started that no phase
+        accounts for yet as phase `name`"""
+        elapsed = time.perf_counter() - self.start
+        self.record(name, max(elapsed - sum(self.phases.values()), 0.0))
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Times the body of the `with` block as phase `name`"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def summary(self) -> Dict[str, float]:
+        """Milliseconds spent in each phase, and since the request started"""
+        summary = {name: round(d * 1000, 3) for name, d in self.phases.items()}
+        summary["total"] = round((time.perf_counter() - self.start) * 1000, 3)
+        return summary
+
+    def server_timing(self) -> str:
+        """Formats the phases as a `Server-Timing` header value"""
+        return ", ".join(f"{name};dur={ms}" for name, ms in self.summary().items())
+
+    def observe(self) -> None:
+        """Feeds the phase durations to `REQUEST_PHASE_DURATION`"""
+        for name, duration in self.phases.items():
+            REQUEST_PHASE_DURATION.labels(phase=name).observe(duration)
+        REQUEST_PHASE_DURATION.labels(phase="total").observe(
+            time.perf_counter() - self.start
+        )
+
+
+def current_timer() -> Optional[PhaseTimer]:
+    """Returns the `PhaseTimer` of the request being served, if timed"""
+    return _current_timer.get()
+
+
+def phase(name: str) -> ContextManager[None]:
+    """Times the body of the `with` block as phase `name` of the request
+    being served. Does nothing outside of a timed request."""
+    timer = _current_timer.get()
+    if timer is None:
+        return nullcontext()
+    return timer.phase(name)
+
+
+def record_unattributed(name: str) -> None:
+    """`PhaseTimer.record_unattributed` on the request being served"""
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.record_unattributed(name)
+
+
+class UpstreamTrace:
+    """httpcore `trace` extension that records the connection setup, time
+    to first byte and body read of an upstream request as phases.
+
+    Parameters
+    ----------
+    timer : PhaseTimer
+        Timer of the request that made the upstream call
+    """
+
+    def __init__(self, timer: PhaseTimer) -> None:
+        self.timer = timer
+        self._started: Dict[str, float] = {}
+
+    def __call__(self, event: str, info: Dict[str, Any]) -> None:
+        # e.g. "connection.connect_tcp.started", "http11.receive_response_body.complete"
+        step, _, status = event.partition(".")[2].rpartition(".")
+        if status == "started":
+            self._started[step] = time.perf_counter()
+            return
+
+        if step == "receive_response_headers":
+            started = self._started.get("send_request_headers")
+            name = "upstream_ttfb"
+        else:
+            started = self._started.get(step)
+            name = UPSTREAM_TRACE_PHASES.get(step)
+
+        if started is not None and name is not None:
+            self.timer.record(name, time.perf_counter() - started)
+
+
+class AsyncUpstreamTrace(UpstreamTrace):
+    """`UpstreamTrace` for async httpx clients"""
+
+    async def __call__(self, event: str, info: Dict[str, Any]) -> None:
+        super().__call__(event, info)
+
+
+def trace_upstream(request: "httpx.Request") -> None:
+    """Request event hook of sync httpx clients, adds an `UpstreamTrace`
+    when the request is made while serving a timed request"""
+    timer = _current_timer.get()
+    if timer is not None:
+        request.extensions["trace"] = UpstreamTrace(timer)
+
+
+async def atrace_upstream(request: "httpx.Request") -> None:
+    """Request event hook of async httpx clients, see `trace_upstream`"""
+    timer = _current_timer.get()
+    if timer is not None:
+        request.extensions["trace"] = AsyncUpstreamTrace(timer)
+
+
+class ServerTimingMiddleware:
+    """Pure ASGI middleware that times the phases of every request.
+
+    A `PhaseTimer` is carried in a context variable through the request, so
+    endpoints, providers and the threadpool can record phases with `phase`.
+    The phases recorded when the response starts are sent in a
+    `Server-Timing` header. Streams can't have their late phases in a
+    header, they report them in their final event instead.
+
+    Parameters
+    ----------
+    app : ASGIApp
+        The wrapped application
+    histograms : bool
+        Whether to export the phase durations to `REQUEST_PHASE_DURATION`
+    """
+
+    def __init__(self, app: ASGIApp, histograms: bool = False) -> None:
+        self.app = app
+        self.histograms = histograms
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timer = PhaseTimer()
+        token = _current_timer.set(timer)
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append(
+                    SERVER_TIMING_HEADER, timer.server_timing()
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_timer.reset(token)
+            if self.histograms:
+                timer.observe()
@@ -0,0 +1,90 @@
+import logging
+from typing import Optional
+
+from fastapi import FastAPI
+from opentelemetry import trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import SpanLimits, TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor
+from opentelemetry.sdk.trace.sampling import ParentBased, Sampler, TraceIdRatioBased
+
+from benchmark.core.config import Settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def build_sampler(settings: Settings) -> Sampler:
+    """Keeps `TRACING_SAMPLE_RATIO` of the traces. With
+    `TRACING_PARENT_BASED`, requests that are part of a trace follow the
+    sampling decision of their caller instead."""
+    sampler: Sampler = TraceIdRatioBased(settings.TRACING_SAMPLE_RATIO)
+    if settings.TRACING_PARENT_BASED:
+        sampler = ParentBased(sampler)
+    return sampler
+
+
+def configure_tracing(settings: Settings) -> Optional[TracerProvider]:
+    """Sets up the global tracer provider when `TRACING_ENABLED`.
+
+    Spans are exported over OTLP, configured by the standard
+    `OTEL_EXPORTER_OTLP_*` variables, and the service is named after
+    `OTEL_SERVICE_NAME`. Without a provider every span is a no-op.
+
+    The export thread and gRPC channel don't survive a fork, so this runs
+    in each worker, from the lifespan, and never in a preloading master.
+
+    Returns
+    -------
+    Optional[TracerProvider]
+        The configured provider, None when tracing is disabled
+    """
+    if not settings.TRACING_ENABLED:
+        return None
+
+    # Imported here, gRPC is slow to import and only needed with tracing on
+    from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+
+    provider = TracerProvider(
+        resource=Resource.create(),
+        sampler=build_sampler(settings),
+        span_limits=SpanLimits(
+            max_span_attributes=settings.TRACING_MAX_ATTRIBUTES,
+            max_events=settings.TRACING_MAX_EVENTS,
+            max_attribute_length=settings.TRACING_MAX_ATTRIBUTE_LENGTH,
+        ),
+    )
+    provider.add_span_processor(
+        BatchSpanProcessor(
+            OTLPSpanExporter(), max_queue_size=settings.TRACING_MAX_QUEUE_SIZE
+        )
+    )
+    trace.set_tracer_provider(provider)
+
+    logger.info(
+        "Tracing %s of the requests, excluding %s",
+        f"{settings.TRACING_SAMPLE_RATIO:.0%}",
+        ", ".join(settings.TRACING_EXCLUDED_URLS) or "none",
+    )
+    return provider
+
+
+def instrument_app(app: FastAPI, settings: Settings) -> None:
+    """Traces the requests of `app`, but for `TRACING_EXCLUDED_URLS`, and
+    its upstream calls through httpx and botocore, when `TRACING_ENABLED`.
+
+    Instrumentations use the global tracer provider, so spans are recorded
+    once `configure_tracing` sets it up in the worker.
+    """
+    if not settings.TRACING_ENABLED:
+        return
+
+    from opentelemetry.instrumentation.botocore import BotocoreInstrumentor
+    from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+    from opentelemetry.instrumentation.httpx import HTTPXClientInstrumentor
+
+    FastAPIInstrumentor.instrument_app(
+        app, excluded_urls=",".join(settings.TRACING_EXCLUDED_URLS)
+    )
+    HTTPXClientInstrumentor().instrument()
+    BotocoreInstrumentor().instrument()
@@ -0,0 +1,235 @@
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field, replace
+from typing import TYPE_CHECKING, Dict, Optional
+
+from benchmark.api.schemas import JobStatus
+
+if TYPE_CHECKING:
+    from benchmark.core.config import Settings
+
+
+@dataclass
+class Job:
+    """A story generated in the background. Times are Unix timestamps."""
+
+    id: str
+    model: str
+    topic: str
+    status: JobStatus = JobStatus.QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    story: Optional[str] = None
+    error: Optional[str] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JobStatus.SUCCEEDED, JobStatus.FAILED)
+
+
+class JobStore(ABC):
+    """Where jobs are kept, from their submission until `ttl` seconds after
+    they finished"""
+
+    blocking: bool = False
+    """Whether calls block on I/O, `JobQueue` then runs them in a thread"""
+
+    @abstractmethod
+    def create(self, job: Job) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Job]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def update(self, job: Job) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def fail_stale(self, before: float, error: str) -> int:
+        """Fails the unfinished jobs created before `before`, left behind by
+        a worker that stopped. Returns how many were failed."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryJobStore(JobStore):
+    """Thread-safe in-memory store, only seen by the worker that owns it
+
+    Parameters
+    ----------
+    ttl : float
+        Seconds a finished job is kept
+    max_entries : int
+        Max number of jobs, the oldest finished ones are evicted first
+    """
+
+    def __init__(self, ttl: float, max_entries: int) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Job] = {}
+
+    def create(self, job: Job) -> None:
+        with self._lock:
+            self._purge()
+            self._jobs[job.id] = replace(job)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or self._expired(job, time.time()):
+                return None
+            return replace(job)
+
+    def update(self, job: Job) -> None:
+        with self._lock:
+            if job.id in self._jobs:
+                self._jobs[job.id] = replace(job)
+
+    def fail_stale(self, before: float, error: str) -> int:
+        with self._lock:
+            stale = [
+                job
+                for job in self._jobs.values()
+                if not job.finished and job.created_at < before
+            ]
+            for job in stale:
+                job.status = JobStatus.FAILED
+                job.finished_at = time.time()
+                job.error = error
+            return len(stale)
+
+    def _expired(self, job: Job, now: float) -> bool:
+        return job.finished_at is not None and job.finished_at + self.ttl < now
+
+    def _purge(self) -> None:
+        now = time.time()
+        over = len(self._jobs) + 1 - self.max_entries
+        # Oldest first, jobs are kept in submission order
+        for job in list(self._jobs.values()):
+            if self._expired(job, now) or (over > 0 and job.finished):
+                del self._jobs[job.id]
+                over -= 1
+
+
+class SqliteJobStore(JobStore):
+    """SQLite-backed store shared by every worker of the node, so a job can
+    be fetched from any of them
+
+    Parameters
+    ----------
+    path : str
+        Path of the SQLite database file
+    ttl : float
+        Seconds a finished job is kept
+    """
+
+    blocking = True
+
+    def __init__(self, path: str, ttl: float) -> None:
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, model TEXT NOT NULL, topic TEXT NOT NULL, "
+            "status TEXT NOT NULL, created_at REAL NOT NULL, started_at REAL, "
+            "finished_at REAL, story TEXT, error TEXT)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_finished_at ON jobs (finished_at)"
+        )
+        self._conn.commit()
+
+    def create(self, job: Job) -> None:
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM jobs WHERE finished_at < ?", (time.time() - self.ttl,)
+            )
+            self._conn.execute(
+                "INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    job.id,
+                    job.model,
+                    job.topic,
+                    job.status.value,
+                    job.created_at,
+                    job.started_at,
+                    job.finished_at,
+                    job.story,
+                    job.error,
+                ),
+            )
+            self._conn.commit()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE id = ? "
+                "AND (finished_at IS NULL OR finished_at >= ?)",
+                (job_id, time.time() - self.ttl),
+            ).fetchone()
+
+        if row is None:
+            return None
+        job = Job(*row)
+        job.status = JobStatus(job.status)
+        return job
+
+    def update(self, job: Job) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, started_at = ?, finished_at = ?, "
+                "story = ?, error = ? WHERE id = ?",
+                (
+                    job.status.value,
+                    job.started_at,
+                    job.finished_at,
+                    job.story,
+                    job.error,
+                    job.id,
+                ),
+            )
+            self._conn.commit()
+
+    def fail_stale(self, before: float, error: str) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, error = ? "
+                "WHERE finished_at IS NULL AND created_at < ?",
+                (JobStatus.FAILED.value, time.time(), error, before),
+            )
+            self._conn.commit()
+            return cursor.rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def build_job_store(settings: "Settings") -> JobStore:
+    """Creates the `JobStore` configured by `settings`"""
+    store = settings.JOBS_STORE
+    if store is None:
+        store = "sqlite" if settings.WEB_CONCURRENCY > 1 else "memory"
+
+    if store == "sqlite":
+        return SqliteJobStore(
+            path=settings.JOBS_STORE_PATH, ttl=settings.JOBS_RESULT_TTL
+        )
+
+    return MemoryJobStore(
+        ttl=settings.JOBS_RESULT_TTL, max_entries=settings.JOBS_MAX_ENTRIES
+    )
@@ -0,0 +1,256 @@
+import asyncio
+import logging
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from anyio import to_thread
+
+from benchmark.api.schemas import JobStatus, StorytellerModel
+from benchmark.core.config import Settings
+from benchmark.jobs.store import Job, JobStore, build_job_store
+from benchmark.llms.cache import StoryCache
+from benchmark.llms.registry import LlmRegistry
+from benchmark.storage.archive import StoryArchiver, archive_story
+from benchmark.utils import JOBS, JOBS_QUEUE_DEPTH, JOBS_QUEUE_WAIT
+
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue:
+    """Generates stories in the background of the worker.
+
+    `submit` saves the job in `store` and puts it on a bounded queue, read
+    by `concurrency` worker tasks of the event loop. They generate the
+    story through the story cache, as `/write-story-async` does, and save
+    the result or error in the store, where clients fetch it with `get` or
+    `wait`. A job is run by the worker it was submitted to; with a store
+    shared between workers, the others see it by polling the store every
+    `poll_interval` seconds. Blocking stores are called in a thread.
+
+    Jobs still unfinished `stale_after` seconds after their submission are
+    failed when a worker starts, since the worker that ran them stopped
+    without saving their outcome.
+
+    Parameters
+    ----------
+    store : JobStore
+        Where jobs and their stories are kept
+    registry : LlmRegistry
+        Providers of the stories
+    cache : StoryCache
+        Story cache, shared with the story endpoints
+    archiver : Optional[StoryArchiver]
+        Archive of the generated stories, when enabled
+    concurrency : int
+        Jobs generated at once
+    queue_size : int
+        Jobs waiting for a worker task before new ones are rejected
+    poll_interval : float
+        Seconds between two reads of the store while waiting for a job
+    stale_after : float
+        Seconds after which an unfinished job is considered lost
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        registry: LlmRegistry,
+        cache: StoryCache,
+        archiver: Optional[StoryArchiver],
+        concurrency: int,
+        queue_size: int,
+        poll_interval: float,
+        stale_after: float,
+    ) -> None:
+        self.store = store
+        self.registry = registry
+        self.cache = cache
+        self.archiver = archiver
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._workers: List[asyncio.Task] = []
+        self._running: Set[asyncio.Task] = set()
+        self._waiters: Dict[str, Set[asyncio.Future]] = {}
+        self._closing = False
+
+    async def start(self) -> None:
+        stale = await self._call_store(
+            self.store.fail_stale, time.time() - self.stale_after, "WorkerLost"
+        )
+        if stale:
+            logger.warning("Failed %s jobs left unfinished by a stopped worker", stale)
+
+        self._workers = [
+            asyncio.ensure_future(self._work()) for _ in range(self.concurrency)
+        ]
+        logger.info("Running story jobs with %s worker tasks", self.concurrency)
+
+    async def submit(self, model: StorytellerModel, topic: str) -> Optional[Job]:
+        """Queues a story job, None when the queue is full"""
+        if self._queue.full():
+            return None
+
+        job = Job(id=uuid.uuid4().hex, model=model.value, topic=topic)
+        await self._call_store(self.store.create, job)
+        try:
+            self._queue.put_nowait((job, time.perf_counter()))
+        except asyncio.QueueFull:
+            # Filled up while the job was being created
+            await self._finish(job, error="QueueFull")
+            return None
+
+        JOBS_QUEUE_DEPTH.inc()
+        return job
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        return await self._call_store(self.store.get, job_id)
+
+    async def wait(
+        self, job_id: str, timeout: float, status: Optional[JobStatus] = None
+    ) -> Optional[Job]:
+        """Waits at most `timeout` seconds for job `job_id` to finish, or to
+        leave `status` when given
+
+        Returns
+        -------
+        Optional[Job]
+            The job as it is when done waiting, None if it doesn't exist
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            job = await self.get(job_id)
+            if job is None or job.finished or (status and job.status != status):
+                return job
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return job
+
+            await self._wait_for_change(job_id, min(remaining, self.poll_interval))
+
+    async def aclose(self, timeout: float) -> None:
+        """Waits at most `timeout` seconds for the running jobs, then fails
+        them and the queued ones"""
+        # Busy workers stop once their job is done
+        self._closing = True
+        for worker in self._workers:
+            if worker not in self._running:
+                worker.cancel()
+
+        if self._running:
+            _, pending = await asyncio.wait(set(self._running), timeout=timeout)
+            if pending:
+                logger.warning("Failing %s jobs still running", len(pending))
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+        while not self._queue.empty():
+            job, _ = self._queue.get_nowait()
+            JOBS_QUEUE_DEPTH.dec()
+            await self._finish(job, error="ShutdownError")
+
+        await self._call_store(self.store.close)
+
+    async def _work(self) -> None:
+        while not self._closing:
+            job, queued_at = await self._queue.get()
+            JOBS_QUEUE_DEPTH.dec()
+            JOBS_QUEUE_WAIT.observe(time.perf_counter() - queued_at)
+
+            task = asyncio.current_task()
+            self._running.add(task)
+            try:
+                await self._run(job)
+            finally:
+                self._running.discard(task)
+
+    async def _run(self, job: Job) -> None:
+        started_at = time.perf_counter()
+        try:
+            job.status = JobStatus.RUNNING
+            job.started_at = time.time()
+            await self._save(job)
+
+            llm = await self.registry.aget(StorytellerModel(job.model))
+            data, cache_status = await self.cache.get_story_async(llm, topic=job.topic)
+        except asyncio.CancelledError:
+            # Saved from a shielded task, this one is being cancelled
+            await asyncio.shield(self._finish(job, error="ShutdownError"))
+            raise
+        except Exception as e:
+            logger.warning("Job %s failed: %r", job.id, e)
+            await self._finish(job, error=type(e).__name__)
+            return
+
+        await self._finish(job, story=data["story"])
+        archive_story(self.archiver, "jobs", llm, data, started_at, cache_status)
+
+    async def _finish(
+        self, job: Job, story: Optional[str] = None, error: Optional[str] = None
+    ) -> None:
+        job.status = JobStatus.FAILED if error is not None else JobStatus.SUCCEEDED
+        job.finished_at = time.time()
+        job.story = story
+        job.error = error
+        JOBS.labels(model=job.model, status=job.status.value).inc()
+        await self._save(job)
+
+    async def _save(self, job: Job) -> None:
+        try:
+            await self._call_store(self.store.update, job)
+        except Exception as e:
+            logger.warning("Error saving job %s: %s", job.id, e)
+
+        for waiter in self._waiters.pop(job.id, ()):
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def _call_store(self, method: Callable[..., Any], *args: Any) -> Any:
+        if self.store.blocking:
+            return await to_thread.run_sync(method, *args)
+        return method(*args)
+
+    async def _wait_for_change(self, job_id: str, timeout: float) -> None:
+        """Waits at most `timeout` seconds for this worker to update the job"""
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(job_id, set()).add(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            waiters = self._waiters.get(job_id)
+            if waiters is not None:
+                waiters.discard(waiter)
+                if not waiters:
+                    del self._waiters[job_id]
+
+
+def build_job_queue(
+    settings: Settings,
+    registry: LlmRegistry,
+    cache: StoryCache,
+    archiver: Optional[StoryArchiver],
+) -> Optional[JobQueue]:
+    """Creates the `JobQueue` configured by `settings`, None when
+    `JOBS_ENABLED` is off"""
+    if not settings.JOBS_ENABLED:
+        return None
+
+    return JobQueue(
+        build_job_store(settings),
+        registry,
+        cache,
+        archiver,
+        concurrency=settings.JOBS_CONCURRENCY,
+        queue_size=settings.JOBS_QUEUE_SIZE,
+        poll_interval=settings.JOBS_POLL_INTERVAL,
+        stale_after=settings.JOBS_RESULT_TTL,
+    )
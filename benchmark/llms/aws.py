@@ -0,0 +1,143 @@
+import base64
+from typing import Any, AsyncIterator, Dict, Optional
+from urllib.parse import quote
+
+import boto3
+import httpx
+import orjson
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.eventstream import EventStreamBuffer
+
+from benchmark.core.timing import phase
+
+
+class BedrockRuntimeError(Exception):
+    """Raised when Bedrock answers with an error status or exception event"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+
+STREAM_EXCEPTION_STATUS = {
+    "throttlingException": 429,
+    "serviceUnavailableException": 503,
+    "modelTimeoutException": 408,
+}
+"""HTTP status equivalent to the exception events of a response stream"""
+
+
+class AsyncBedrockRuntime:
+    """Minimal non-blocking client for the Bedrock runtime API.
+
+    Requests are signed with SigV4 using the credentials resolved by the
+    boto3 session and sent through a pooled `httpx.AsyncClient`, so awaiting
+    a model invocation costs a coroutine instead of a thread.
+
+    Parameters
+    ----------
+    region : str
+        AWS region hosting the Bedrock runtime endpoint
+    session : Optional[boto3.Session]
+        Session used to resolve credentials, by default a new one
+    http_client : Optional[httpx.AsyncClient]
+        Pooled HTTP client, by default a new one with httpx defaults
+    """
+
+    service_name = "bedrock"
+
+    def __init__(
+        self,
+        region: str,
+        session: Optional[boto3.Session] = None,
+        http_client: Optional[httpx.AsyncClient] = None,
+    ) -> None:
+        self.region = region
+        self.session = session if session is not None else boto3.Session()
+        self.http_client = (
+            http_client if http_client is not None else httpx.AsyncClient()
+        )
+        self.endpoint_url = f"https://bedrock-runtime.{region}.amazonaws.com"
+
+    async def invoke_model(self, model_id: str, body: bytes) -> Dict[str, Any]:
+        """Async equivalent of boto3's `invoke_model`, returns the parsed body"""
+        url = f"{self.endpoint_url}/model/{quote(model_id, safe='')}/invoke"
+
+        response = await self.http_client.post(
+            url,
+            content=body,
+            headers=self._signed_headers(url, body, accept="application/json"),
+        )
+        if response.status_code != 200:
+            raise BedrockRuntimeError(
+                f"Bedrock returned {response.status_code}: {response.text}",
+                status_code=response.status_code,
+            )
+
+        with phase("parse"):
+            return orjson.loads(response.content)
+
+    async def invoke_model_with_response_stream(
+        self, model_id: str, body: bytes
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Async equivalent of boto3's `invoke_model_with_response_stream`.
+
+        Yields every decoded `chunk` payload. Closing the generator closes the
+        upstream HTTP stream.
+        """
+        url = (
+            f"{self.endpoint_url}/model/{quote(model_id, safe='')}"
+            "/invoke-with-response-stream"
+        )
+        headers = self._signed_headers(
+            url, body, accept="application/vnd.amazon.eventstream"
+        )
+
+        async with self.http_client.stream(
+            "POST", url, content=body, headers=headers
+        ) as response:
+            if response.status_code != 200:
+                await response.aread()
+                raise BedrockRuntimeError(
+                    f"Bedrock returned {response.status_code}: {response.text}",
+                    status_code=response.status_code,
+                )
+
+            buffer = EventStreamBuffer()
+            async for data in response.aiter_bytes():
+                buffer.add_data(data)
+                for message in buffer:
+                    yield self._decode_event(message.headers, message.payload)
+
+    async def aclose(self) -> None:
+        await self.http_client.aclose()
+
+    def _signed_headers(self, url: str, body: bytes, accept: str) -> Dict[str, str]:
+        credentials = self.session.get_credentials()
+        if credentials is None:
+            raise BedrockRuntimeError("No AWS credentials found")
+
+        request = AWSRequest(
+            method="POST",
+            url=url,
+            data=body,
+            headers={"Content-Type": "application/json", "Accept": accept},
+        )
+        SigV4Auth(
+            credentials.get_frozen_credentials(), self.service_name, self.region
+        ).add_auth(request)
+
+        return dict(request.headers.items())
+
+    @staticmethod
+    def _decode_event(headers: Dict[str, Any], payload: bytes) -> Dict[str, Any]:
+        if headers.get(":message-type") != "event":
+            exception_type = headers.get(":exception-type", "Unknown error")
+            raise BedrockRuntimeError(
+                f"{exception_type}: {payload.decode('utf-8', errors='replace')}",
+                status_code=STREAM_EXCEPTION_STATUS.get(exception_type),
+            )
+
+        event = orjson.loads(payload)
+        return orjson.loads(base64.b64decode(event["bytes"]))
@@ -1,12 +1,28 @@
 from abc import ABC, abstractmethod
-from typing import Dict
+from typing import AsyncIterator, Dict, Iterator
 
 
 class BaseLlm(ABC):
+    provider: str
+    """Name of the upstream provider, used as a metric label"""
+    model_id: str
+    max_tokens: int = 2000
+    """Upper bound of output tokens requested per story"""
+
     @abstractmethod
     def get_story(self, topic: str) -> Dict[str, str]:
         raise NotImplementedError
 
     @abstractmethod
-    def stream_story(self, topic: str):
+    def stream_story(self, topic: str) -> Iterator[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_story_async(self, topic: str) -> Dict[str, str]:
+        """Non-blocking `get_story`, must not tie up a thread while waiting"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def astream_story(self, topic: str) -> AsyncIterator[str]:
+        """Non-blocking `stream_story`, implemented as an async generator"""
         raise NotImplementedError
@@ -1,45 +1,85 @@
-import asyncio
-from concurrent.futures import ThreadPoolExecutor
-import time
-import json
 import logging
-from typing import Any, Dict
+from typing import Any, AsyncIterator, Dict, Optional
 import boto3
+import httpx
+import orjson
+from botocore.exceptions import ClientError, ConnectTimeoutError, ReadTimeoutError
 
+from benchmark.core.timing import phase
+from benchmark.llms.aws import AsyncBedrockRuntime, BedrockRuntimeError
 from benchmark.llms.base import BaseLlm
-from benchmark.llms.exceptions import LlmException
-from benchmark.utils import TIME_TO_FIRST_BYTE, TIME_TO_FULL_RESPONSE
+from benchmark.llms.exceptions import (
+    LlmException,
+    LlmThrottledException,
+    LlmTimeoutException,
+)
+from benchmark.llms.payload import TOPIC_PLACEHOLDER, PayloadTemplate
+from benchmark.llms.telemetry import CallMetrics
+from benchmark.utils import LLM_CLIENT_POOL_IN_USE
 
 
 logger = logging.getLogger(__name__)
 
-shared_executor = ThreadPoolExecutor(max_workers=100)  # Adjust max_workers as needed
+THROTTLING_ERROR_CODES = {
+    "ThrottlingException",
+    "ServiceUnavailableException",
+    "ModelNotReadyException",
+}
+
+
+def output_tokens(usage: Optional[Dict[str, Any]]) -> Optional[int]:
+    """Reads the output tokens of a response or `message_delta` usage"""
+    if not usage:
+        return None
+    return usage.get("output_tokens")
+
+
+def as_llm_exception(e: Exception) -> LlmException:
+    """Maps a boto3/httpx error to the matching `LlmException`"""
+    if isinstance(e, (ConnectTimeoutError, ReadTimeoutError, httpx.TimeoutException)):
+        return LlmTimeoutException()
+    if isinstance(e, ClientError):
+        if e.response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES:
+            return LlmThrottledException()
+    if isinstance(e, BedrockRuntimeError):
+        if e.status_code in (429, 503):
+            return LlmThrottledException()
+        if e.status_code == 408:
+            return LlmTimeoutException()
+    return LlmException()
 
 
 class ClaudeBedrockLlm(BaseLlm):
-    def __init__(self, model_id: str) -> None:
+    provider = "bedrock"
+
+    def __init__(
+        self,
+        model_id: str,
+        region: str = "us-east-1",
+        client: Optional[Any] = None,
+        async_client: Optional[AsyncBedrockRuntime] = None,
+    ) -> None:
         super().__init__()
-        self.client = boto3.client(
-            service_name="bedrock-runtime", region_name="us-east-1"
-        )
+        if client is None:
+            client = boto3.client(service_name="bedrock-runtime", region_name=region)
+        if async_client is None:
+            async_client = AsyncBedrockRuntime(region=region)
+        self.region = region
+        self.client = client
+        self.async_client = async_client
         self.system_prompt = (
             "You are a sci-fi writer born in Argentina. Your goal is to write "
             "a short story in no more than 3 paragraphs about a topic defined by the user"
         )
         self.model_id = model_id
-
-    def get_story(self, topic: str) -> Dict[str, Any]:
-        max_length = 2000
-
-        user_message = {"role": "user", "content": topic}
-
-        messages = [user_message]
-
-        body = json.dumps(
+        self.pool_in_use = LLM_CLIENT_POOL_IN_USE.labels(
+            provider="bedrock", model=model_id
+        )
+        self.body_template = PayloadTemplate(
             {
-                "messages": messages,
+                "messages": [{"role": "user", "content": TOPIC_PLACEHOLDER}],
                 "system": self.system_prompt,
-                "max_tokens": max_length,
+                "max_tokens": self.max_tokens,
                 "temperature": 0.4,
                 "top_k": 250,
                 "top_p": 1,
@@ -47,152 +87,129 @@ class ClaudeBedrockLlm(BaseLlm):
             }
         )
 
-        logger.debug(f"About to write an story about: {topic}")
+    def get_story(self, topic: str) -> Dict[str, Any]:
+        with phase("payload_build"):
+            body = self.body_template.render(topic)
+
+        logger.debug("About to write an story about: %s", topic)
 
-        start_time = time.perf_counter_ns() / 1e9
+        metrics = CallMetrics("bedrock", self.model_id, "write")
 
-        try:
-            response: Dict[str, Any] = self.client.invoke_model(
-                modelId=self.model_id,
-                accept="application/json",
-                contentType="application/json",
-                body=body,
-            )
-        except Exception as e:
-            logger.exception(e)
-            raise LlmException() from e
+        with self.pool_in_use.track_inprogress():
+            try:
+                with phase("upstream_ttfb"):
+                    response: Dict[str, Any] = self.client.invoke_model(
+                        modelId=self.model_id,
+                        accept="application/json",
+                        contentType="application/json",
+                        body=body,
+                    )
+            except Exception as e:
+                logger.exception(e)
+                raise as_llm_exception(e) from e
 
-        story = None
+            story = None
 
-        try:
-            response_body = json.loads(response.get("body").read())
+            try:
+                with phase("upstream_body"):
+                    raw_body = response.get("body").read()
+                with phase("parse"):
+                    response_body = orjson.loads(raw_body)
 
-        except Exception as e:
-            logger.exception(f"Error reading LLM response {e}")
-            raise LlmException() from e
-
-        end_time = round((time.perf_counter_ns() / 1e9) - start_time, 3)
-        TIME_TO_FIRST_BYTE.labels(
-            provider="bedrock",
-            model=self.model_id,
-            mode="write",
-        ).observe(end_time)
-        TIME_TO_FULL_RESPONSE.labels(
-            provider="bedrock",
-            model=self.model_id,
-            mode="write",
-        ).observe(end_time)
+            except Exception as e:
+                logger.exception("Error reading LLM response %s", e)
+                raise as_llm_exception(e) from e
+
+        metrics.finish(output_tokens(response_body.get("usage")))
 
         story = response_body["content"][0]["text"]
 
         return {"topic": topic, "story": story}
 
     def stream_story(self, topic: str):
-        max_length = 2000
-        user_message = {"role": "user", "content": topic}
-        messages = [user_message]
-
-        body = json.dumps(
-            {
-                "messages": messages,
-                "system": self.system_prompt,
-                "max_tokens": max_length,
-                "temperature": 0.4,
-                "top_k": 250,
-                "top_p": 1,
-                "anthropic_version": "bedrock-2023-05-31",
-            }
-        )
+        with phase("payload_build"):
+            body = self.body_template.render(topic)
 
-        logger.debug(f"About to stream an story about: {topic}")
+        logger.debug("About to stream an story about: %s", topic)
 
-        start_time = time.perf_counter_ns() / 1e9
+        metrics = CallMetrics("bedrock", self.model_id, "streaming")
+        tokens = None
+        event_stream = None
+        self.pool_in_use.inc()
         try:
-            response = self.client.invoke_model_with_response_stream(
-                modelId=self.model_id, body=body
-            )
-            event_stream = response.get("body", {})
-
-            for i, event in enumerate(event_stream):
-                if i == 0:
-                    ttfb = round((time.perf_counter_ns() / 1e9) - start_time, 3)
-                    TIME_TO_FIRST_BYTE.labels(
-                        provider="bedrock",
-                        model=self.model_id,
-                        mode="streaming",
-                    ).observe(ttfb)
-
-                chunk = json.loads(event["chunk"]["bytes"])
+            with phase("upstream_ttfb"):
+                response = self.client.invoke_model_with_response_stream(
+                    modelId=self.model_id, body=body
+                )
+            event_stream = response["body"]
+
+            for event in event_stream:
+                chunk = orjson.loads(event["chunk"]["bytes"])
                 if chunk["type"] == "content_block_delta":
+                    metrics.delta()
                     yield chunk["delta"].get("text", "")
+                elif chunk["type"] == "message_delta":
+                    tokens = output_tokens(chunk.get("usage"))
 
         except Exception as e:
-            logger.exception(f"Error reading LLM response {e}")
-            raise LlmException() from e
+            logger.exception("Error reading LLM response %s", e)
+            raise as_llm_exception(e) from e
+        finally:
+            self.pool_in_use.dec()
+            if event_stream is not None:
+                # Releases the connection when the stream is closed early
+                event_stream.close()
 
-        end_time = round((time.perf_counter_ns() / 1e9) - start_time, 3)
-        TIME_TO_FULL_RESPONSE.labels(
-            provider="bedrock",
-            model=self.model_id,
-            mode="streaming",
-        ).observe(end_time)
+        metrics.finish(tokens)
 
     async def get_story_async(self, topic: str) -> Dict[str, Any]:
-        max_length = 2000
+        with phase("payload_build"):
+            body = self.body_template.render(topic)
 
-        user_message = {"role": "user", "content": topic}
+        logger.debug("About to write a story about: %s", topic)
 
-        messages = [user_message]
+        metrics = CallMetrics("bedrock", self.model_id, "write-async")
 
-        body = json.dumps(
-            {
-                "messages": messages,
-                "system": self.system_prompt,
-                "max_tokens": max_length,
-                "temperature": 0.4,
-                "top_k": 250,
-                "top_p": 1,
-                "anthropic_version": "bedrock-2023-05-31",
-            }
-        )
+        with self.pool_in_use.track_inprogress():
+            try:
+                response_body = await self.async_client.invoke_model(
+                    model_id=self.model_id, body=body
+                )
+            except Exception as e:
+                logger.exception(e)
+                raise as_llm_exception(e) from e
+
+        metrics.finish(output_tokens(response_body.get("usage")))
 
-        logger.debug(f"About to write a story about: {topic}")
+        story = response_body["content"][0]["text"]
 
-        start_time = time.perf_counter_ns() / 1e9
+        return {"topic": topic, "story": story}
 
-        try:
-            loop = asyncio.get_running_loop()
-            response: Dict[str, Any] = await loop.run_in_executor(
-                shared_executor,
-                lambda: self.client.invoke_model(
-                    modelId=self.model_id,
-                    accept="application/json",
-                    contentType="application/json",
-                    body=body,
-                ),
-            )
-        except Exception as e:
-            logger.exception(e)
-            raise LlmException() from e
+    async def astream_story(self, topic: str) -> AsyncIterator[str]:
+        with phase("payload_build"):
+            body = self.body_template.render(topic)
+
+        logger.debug("About to stream a story about: %s", topic)
 
+        metrics = CallMetrics("bedrock", self.model_id, "streaming-async")
+        tokens = None
+        self.pool_in_use.inc()
+        event_stream = self.async_client.invoke_model_with_response_stream(
+            model_id=self.model_id, body=body
+        )
         try:
-            response_body = json.loads(response["body"].read())
-        except Exception as e:
-            logger.exception(f"Error reading LLM response {e}")
-            raise LlmException() from e
-
-        end_time = round((time.perf_counter_ns() / 1e9) - start_time, 3)
-        TIME_TO_FIRST_BYTE.labels(
-            provider="bedrock",
-            model=self.model_id,
-            mode="write-async",
-        ).observe(end_time)
-        TIME_TO_FULL_RESPONSE.labels(
-            provider="bedrock",
-            model=self.model_id,
-            mode="write-async",
-        ).observe(end_time)
+            async for chunk in event_stream:
+                if chunk["type"] == "content_block_delta":
+                    metrics.delta()
+                    yield chunk["delta"].get("text", "")
+                elif chunk["type"] == "message_delta":
+                    tokens = output_tokens(chunk.get("usage"))
 
-        story = response_body["content"][0]["text"]
+        except Exception as e:
+            logger.exception("Error reading LLM response %s", e)
+            raise as_llm_exception(e) from e
+        finally:
+            self.pool_in_use.dec()
+            await event_stream.aclose()
 
-        return {"topic": topic, "story": story}
+        metrics.finish(tokens)
@@ -0,0 +1,350 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, Optional, Set, Tuple
+
+from anyio import to_thread
+
+from benchmark.core.config import Settings
+from benchmark.llms.base import BaseLlm
+from benchmark.utils import STORY_CACHE_REQUESTS
+
+
+logger = logging.getLogger(__name__)
+
+CACHE_HEADER = "X-Cache"
+
+HIT = "HIT"
+MISS = "MISS"
+COALESCED = "COALESCED"
+
+
+class CacheBackend(ABC):
+    blocking: bool = False
+    """Whether calls block on I/O, async callers then run them in a thread"""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Dict[str, str]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set(self, key: str, value: Dict[str, str]) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryCacheBackend(CacheBackend):
+    """Thread-safe in-memory LRU with a per-entry TTL
+
+    Parameters
+    ----------
+    ttl : float
+        Seconds an entry stays valid
+    max_entries : int
+        Max number of entries, the least recently used one is evicted first
+    """
+
+    def __init__(self, ttl: float, max_entries: int) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, str]]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Dict[str, str]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Dict[str, str]) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class DiskCacheBackend(CacheBackend):
+    """SQLite-backed cache that survives worker restarts and is shared by
+    every worker of the node
+
+    Parameters
+    ----------
+    path : str
+        Path of the SQLite database file
+    ttl : float
+        Seconds an entry stays valid
+    max_entries : int
+        Max number of entries, the least recently used ones are evicted first
+    access_batch : int
+        Hits whose access time is kept in memory before being written, they
+        are also written with the next `set`
+    """
+
+    blocking = True
+
+    def __init__(
+        self, path: str, ttl: float, max_entries: int, access_batch: int = 100
+    ) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.access_batch = access_batch
+        self._lock = threading.Lock()
+        self._accessed: Dict[str, float] = {}
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS stories ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS stories_expires_at ON stories (expires_at)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS stories_accessed_at ON stories (accessed_at)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Dict[str, str]]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM stories WHERE key = ? AND expires_at >= ?",
+                (key, now),
+            ).fetchone()
+            if row is None:
+                return None
+
+            self._accessed[key] = now
+            if len(self._accessed) >= self.access_batch:
+                self._write_accesses()
+                self._conn.commit()
+
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Dict[str, str]) -> None:
+        now = time.time()
+        with self._lock:
+            self._accessed.pop(key, None)
+            self._write_accesses()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO stories VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now + self.ttl, now),
+            )
+            self._conn.execute("DELETE FROM stories WHERE expires_at < ?", (now,))
+            # Walks the accessed_at index, nothing is deleted until the cache
+            # holds more than `max_entries`
+            self._conn.execute(
+                "DELETE FROM stories WHERE accessed_at < ("
+                "SELECT accessed_at FROM stories "
+                "ORDER BY accessed_at DESC LIMIT 1 OFFSET ?)",
+                (self.max_entries - 1,),
+            )
+            self._conn.commit()
+
+    def _write_accesses(self) -> None:
+        if self._accessed:
+            self._conn.executemany(
+                "UPDATE stories SET accessed_at = ? WHERE key = ?",
+                [(at, key) for key, at in self._accessed.items()],
+            )
+            self._accessed.clear()
+
+    def close(self) -> None:
+        with self._lock:
+            self._write_accesses()
+            self._conn.commit()
+            self._conn.close()
+
+
+class StoryCache:
+    """Cache in front of `BaseLlm.get_story` and `BaseLlm.get_story_async`.
+
+    Concurrent misses for the same (model, topic) are coalesced: the first
+    caller performs the upstream call and every other caller, sync or async,
+    waits for its result instead of issuing its own.
+
+    Parameters
+    ----------
+    backend : Optional[CacheBackend]
+        Where stories are stored, caching is disabled when None
+    """
+
+    def __init__(self, backend: Optional[CacheBackend]) -> None:
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._flights: Dict[str, Future] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    def get_story(
+        self, llm: BaseLlm, topic: str
+    ) -> Tuple[Dict[str, str], Optional[str]]:
+        """Returns the story and its cache status, None when caching is off"""
+        if self.backend is None:
+            return llm.get_story(topic=topic), None
+
+        key = self._key(llm, topic)
+        cached = self._lookup(llm, key)
+        if cached is not None:
+            return cached, HIT
+
+        flight, is_leader = self._join_flight(llm, key)
+        if not is_leader:
+            return flight.result(), COALESCED
+
+        try:
+            data = llm.get_story(topic=topic)
+        except BaseException as e:
+            self._land_flight(key, flight, exception=e)
+            raise
+
+        self._store(key, data)
+        self._land_flight(key, flight, result=data)
+        return data, MISS
+
+    async def get_story_async(
+        self, llm: BaseLlm, topic: str
+    ) -> Tuple[Dict[str, str], Optional[str]]:
+        """Async `get_story`. The upstream call runs in its own task, so a
+        cancelled leader doesn't fail the requests coalesced onto it.
+        Blocking backends are read and written in a thread."""
+        if self.backend is None:
+            return await llm.get_story_async(topic=topic), None
+
+        key = self._key(llm, topic)
+        cached = await self._alookup(llm, key)
+        if cached is not None:
+            return cached, HIT
+
+        flight, is_leader = self._join_flight(llm, key)
+        if is_leader:
+            task = asyncio.ensure_future(self._fill_async(llm, topic, key, flight))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        data = await asyncio.shield(asyncio.wrap_future(flight))
+        return data, MISS if is_leader else COALESCED
+
+    def close(self) -> None:
+        if self.backend is not None:
+            self.backend.close()
+
+    async def _fill_async(
+        self, llm: BaseLlm, topic: str, key: str, flight: Future
+    ) -> None:
+        try:
+            data = await llm.get_story_async(topic=topic)
+        except BaseException as e:
+            self._land_flight(key, flight, exception=e)
+            if not isinstance(e, Exception):
+                raise
+            return
+
+        await self._astore(key, data)
+        self._land_flight(key, flight, result=data)
+
+    async def _alookup(self, llm: BaseLlm, key: str) -> Optional[Dict[str, str]]:
+        if self.backend.blocking:
+            return await to_thread.run_sync(self._lookup, llm, key)
+        return self._lookup(llm, key)
+
+    async def _astore(self, key: str, data: Dict[str, str]) -> None:
+        if self.backend.blocking:
+            await to_thread.run_sync(self._store, key, data)
+        else:
+            self._store(key, data)
+
+    def _lookup(self, llm: BaseLlm, key: str) -> Optional[Dict[str, str]]:
+        try:
+            cached = self.backend.get(key)
+        except Exception as e:
+            logger.warning("Error reading from the story cache: %s", e)
+            cached = None
+
+        if cached is not None:
+            STORY_CACHE_REQUESTS.labels(model=llm.model_id, result="hit").inc()
+
+        return cached
+
+    def _store(self, key: str, data: Dict[str, str]) -> None:
+        try:
+            self.backend.set(key, data)
+        except Exception as e:
+            logger.warning("Error writing to the story cache: %s", e)
+
+    def _join_flight(self, llm: BaseLlm, key: str) -> Tuple[Future, bool]:
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                STORY_CACHE_REQUESTS.labels(
+                    model=llm.model_id, result="coalesced"
+                ).inc()
+                return flight, False
+
+            flight = Future()
+            self._flights[key] = flight
+
+        STORY_CACHE_REQUESTS.labels(model=llm.model_id, result="miss").inc()
+        return flight, True
+
+    def _land_flight(
+        self,
+        key: str,
+        flight: Future,
+        result: Optional[Dict[str, str]] = None,
+        exception: Optional[BaseException] = None,
+    ) -> None:
+        with self._lock:
+            self._flights.pop(key, None)
+
+        if exception is not None:
+            flight.set_exception(exception)
+        else:
+            flight.set_result(result)
+
+    @staticmethod
+    def _key(llm: BaseLlm, topic: str) -> str:
+        return hashlib.sha256(f"{llm.model_id}\n{topic}".encode()).hexdigest()
+
+
+def build_story_cache(settings: Settings) -> StoryCache:
+    """Creates the `StoryCache` configured by `settings`"""
+    backend: Optional[CacheBackend] = None
+
+    if settings.STORY_CACHE_BACKEND == "memory":
+        backend = MemoryCacheBackend(
+            ttl=settings.STORY_CACHE_TTL,
+            max_entries=settings.STORY_CACHE_MAX_ENTRIES,
+        )
+    elif settings.STORY_CACHE_BACKEND == "disk":
+        backend = DiskCacheBackend(
+            path=settings.STORY_CACHE_PATH,
+            ttl=settings.STORY_CACHE_TTL,
+            max_entries=settings.STORY_CACHE_MAX_ENTRIES,
+        )
+
+    return StoryCache(backend)
@@ -2,3 +2,43 @@ class LlmException(Exception):
     """Base class for exceptions raised from Llm implementations"""
 
     pass
+
+
+class LlmThrottledException(LlmException):
+    """Raised when the provider rejects a call because of rate limits"""
+
+    pass
+
+
+class LlmTimeoutException(LlmException):
+    """Raised when the provider doesn't answer in time"""
+
+    pass
+
+
+class LlmOverloadedException(LlmException):
+    """Raised when a call is shed by admission control before reaching the
+    provider
+
+    Parameters
+    ----------
+    retry_after : float
+        Seconds the client should wait before retrying
+    queue_full : bool
+        Whether the call was rejected because the wait queue was full, as
+        opposed to timing out while waiting in it
+    """
+
+    def __init__(self, retry_after: float, queue_full: bool) -> None:
+        super().__init__(
+            "Wait queue is full" if queue_full else "Timed out waiting for a slot"
+        )
+        self.retry_after = retry_after
+        self.queue_full = queue_full
+
+
+class LlmStreamLagException(LlmException):
+    """Raised when a subscriber of a shared stream falls too far behind the
+    other subscribers and is dropped"""
+
+    pass
@@ -0,0 +1,280 @@
+import itertools
+import logging
+import threading
+import time
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from benchmark.llms.base import BaseLlm
+from benchmark.llms.exceptions import LlmStreamLagException
+from benchmark.utils import STREAM_FANOUT_EVICTIONS, STREAM_FANOUT_SUBSCRIBERS
+
+
+logger = logging.getLogger(__name__)
+
+
+class Broadcast:
+    """One upstream story stream read by several subscribers.
+
+    Deltas are kept in a log that every subscriber reads with its own
+    cursor, so subscribers that join late replay the deltas they missed
+    first. There is no reader thread: whichever subscriber runs out of
+    deltas pulls the next one from upstream, so the stream keeps going when
+    the subscriber that opened it leaves. The upstream stream is closed
+    when the last subscriber leaves.
+
+    A subscriber may fall at most `max_lag` deltas behind the one reading
+    upstream. Past that, upstream reads wait for it to catch up, and after
+    `lag_timeout` seconds it is dropped with a `LlmStreamLagException`.
+    The log is trimmed to what the slowest subscriber still has to read
+    once the broadcast holds `replay_size` deltas, after which nobody can
+    join it anymore.
+
+    Parameters
+    ----------
+    upstream : Iterator[str]
+        The shared story stream
+    replay_size : int
+        Deltas kept for late subscribers
+    max_lag : int
+        Max deltas a subscriber can be behind before upstream reads wait
+    lag_timeout : float
+        Seconds upstream reads wait for lagging subscribers before dropping
+        them
+    """
+
+    def __init__(
+        self,
+        upstream: Iterator[str],
+        replay_size: int,
+        max_lag: int,
+        lag_timeout: float,
+    ) -> None:
+        self.upstream = upstream
+        self.replay_size = replay_size
+        self.max_lag = max_lag
+        self.lag_timeout = lag_timeout
+        self._cond = threading.Condition()
+        self._ids = itertools.count()
+        self._log: List[str] = []
+        self._base = 0
+        """Position of `_log[0]` in the stream, once the log was trimmed"""
+        self._cursors: Dict[int, int] = {}
+        self._evicted: set = set()
+        self._pulling = False
+        self._finished = False
+        self._closed = False
+        self._error: Optional[Exception] = None
+
+    @property
+    def joinable(self) -> bool:
+        with self._cond:
+            return self._joinable()
+
+    def _joinable(self) -> bool:
+        return not (self._closed or self._finished) and self._base == 0
+
+    def subscribe(self) -> Optional[Iterator[str]]:
+        """Registers a subscriber and returns its stream of every delta,
+        from the first one. None when the broadcast can't be joined."""
+        with self._cond:
+            if not self._joinable():
+                return None
+            subscriber = next(self._ids)
+            self._cursors[subscriber] = 0
+
+        return self._read(subscriber)
+
+    def _read(self, subscriber: int) -> Iterator[str]:
+        try:
+            while True:
+                delta = self._next(subscriber)
+                if delta is None:
+                    return
+                yield delta
+        finally:
+            self._leave(subscriber)
+
+    def _next(self, subscriber: int) -> Optional[str]:
+        """Next delta of `subscriber`, pulling it from upstream if needed.
+        None at the end of the stream."""
+        while True:
+            with self._cond:
+                while True:
+                    if subscriber in self._evicted:
+                        raise LlmStreamLagException(
+                            f"Fell over {self.max_lag} deltas behind the stream"
+                        )
+
+                    cursor = self._cursors[subscriber]
+                    if cursor < self._base + len(self._log):
+                        delta = self._log[cursor - self._base]
+                        self._cursors[subscriber] = cursor + 1
+                        self._trim()
+                        # Wakes up upstream reads waiting for laggards
+                        self._cond.notify_all()
+                        return delta
+
+                    if self._finished:
+                        if self._error is not None:
+                            raise self._error
+                        return None
+
+                    if not self._pulling:
+                        # Claimed first, so other subscribers don't pull too
+                        self._pulling = True
+                        self._wait_for_laggards(cursor)
+                        break
+
+                    self._cond.wait()
+
+            self._pull()
+
+    def _wait_for_laggards(self, position: int) -> None:
+        """Waits, holding the condition, until every subscriber is within
+        `max_lag` deltas of `position`, dropping those that don't catch up
+        in `lag_timeout` seconds"""
+        deadline = time.monotonic() + self.lag_timeout
+        while True:
+            laggards = [
+                s for s, c in self._cursors.items() if position - c >= self.max_lag
+            ]
+            if not laggards:
+                return
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                for laggard in laggards:
+                    del self._cursors[laggard]
+                    self._evicted.add(laggard)
+                self._cond.notify_all()
+                return
+
+            self._cond.wait(remaining)
+
+    def _pull(self) -> None:
+        delta: Optional[str] = None
+        finished, error = False, None
+        try:
+            delta = next(self.upstream)
+        except StopIteration:
+            finished = True
+        except Exception as e:
+            finished, error = True, e
+        finally:
+            with self._cond:
+                self._pulling = False
+                if delta is not None:
+                    self._log.append(delta)
+                self._finished = finished
+                self._error = error
+                self._cond.notify_all()
+
+    def _trim(self) -> None:
+        """Drops the deltas every subscriber read, once late subscribers
+        can't join anymore"""
+        if self._base + len(self._log) < self.replay_size or not self._cursors:
+            return
+
+        slowest = min(self._cursors.values())
+        if slowest > self._base:
+            del self._log[: slowest - self._base]
+            self._base = slowest
+
+    def _leave(self, subscriber: int) -> None:
+        with self._cond:
+            self._cursors.pop(subscriber, None)
+            self._evicted.discard(subscriber)
+            last = not self._cursors and not self._closed
+            if last:
+                self._closed = True
+            self._cond.notify_all()
+
+        if last:
+            # Nobody can be pulling, the last subscriber was not
+            self.upstream.close()
+
+
+class SharedStreamLlm(BaseLlm):
+    """Shares the upstream stream of concurrent identical story streams.
+
+    The first `stream_story` call for a topic opens the upstream stream and
+    later calls for the same topic subscribe to it through a `Broadcast`,
+    until it ends or stops accepting subscribers. Each shared stream saves
+    a provider connection and a full story worth of output tokens. Other
+    calls, async streams included, go straight to `llm`.
+
+    Parameters
+    ----------
+    llm : BaseLlm
+        The wrapped provider
+    replay_size : int
+        Deltas kept for late subscribers, see `Broadcast`
+    max_lag : int
+        Max deltas a subscriber can be behind, see `Broadcast`
+    lag_timeout : float
+        Seconds a lagging subscriber can hold the others back
+    """
+
+    def __init__(
+        self, llm: BaseLlm, replay_size: int, max_lag: int, lag_timeout: float
+    ) -> None:
+        super().__init__()
+        self.llm = llm
+        self.replay_size = replay_size
+        self.max_lag = max_lag
+        self.lag_timeout = lag_timeout
+        self.provider = llm.provider
+        self.model_id = llm.model_id
+        self.max_tokens = llm.max_tokens
+        self._lock = threading.Lock()
+        self._broadcasts: Dict[str, Broadcast] = {}
+
+    def get_story(self, topic: str) -> Dict[str, str]:
+        return self.llm.get_story(topic=topic)
+
+    def stream_story(self, topic: str) -> Iterator[str]:
+        broadcast, stream, owner = self._join(topic)
+        STREAM_FANOUT_SUBSCRIBERS.labels(
+            provider=self.provider,
+            model=self.model_id,
+            role="owner" if owner else "subscriber",
+        ).inc()
+
+        try:
+            yield from stream
+        except LlmStreamLagException:
+            STREAM_FANOUT_EVICTIONS.labels(
+                provider=self.provider, model=self.model_id
+            ).inc()
+            raise
+        finally:
+            with self._lock:
+                if self._broadcasts.get(topic) is broadcast and not broadcast.joinable:
+                    del self._broadcasts[topic]
+
+    async def get_story_async(self, topic: str) -> Dict[str, str]:
+        return await self.llm.get_story_async(topic=topic)
+
+    def astream_story(self, topic: str) -> AsyncIterator[str]:
+        return self.llm.astream_story(topic=topic)
+
+    def _join(self, topic: str) -> Tuple[Broadcast, Iterator[str], bool]:
+        """Subscribes to the broadcast of `topic`, opening a new one when
+        there's none that can be joined. Returns it, the subscription, and
+        whether it was opened."""
+        with self._lock:
+            broadcast = self._broadcasts.get(topic)
+            stream = broadcast.subscribe() if broadcast is not None else None
+            if broadcast is not None and stream is not None:
+                return broadcast, stream, False
+
+            logger.debug("Opening shared stream of %s for %s", self.model_id, topic)
+            broadcast = Broadcast(
+                self.llm.stream_story(topic=topic),
+                replay_size=self.replay_size,
+                max_lag=self.max_lag,
+                lag_timeout=self.lag_timeout,
+            )
+            self._broadcasts[topic] = broadcast
+            # A new broadcast is always joinable
+            return broadcast, broadcast.subscribe(), True
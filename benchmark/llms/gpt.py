@@ -1,19 +1,49 @@
-import time
 import logging
-from typing import Any, Dict
-from openai import OpenAI
+from typing import Any, AsyncIterator, Dict, List, Optional
+from openai import APITimeoutError, AsyncOpenAI, OpenAI, RateLimitError
+from openai.types import CompletionUsage
+from benchmark.core.timing import phase
 from benchmark.llms.base import BaseLlm
-from benchmark.llms.exceptions import LlmException
-from benchmark.utils import TIME_TO_FIRST_BYTE, TIME_TO_FULL_RESPONSE
+from benchmark.llms.exceptions import (
+    LlmException,
+    LlmThrottledException,
+    LlmTimeoutException,
+)
+from benchmark.llms.telemetry import CallMetrics
+from benchmark.utils import LLM_CLIENT_POOL_IN_USE
 
 
-logger = logging.getLogger()
+logger = logging.getLogger(__name__)
+
+
+def output_tokens(usage: Optional[CompletionUsage]) -> Optional[int]:
+    """Reads the output tokens of a completion or of the last stream chunk"""
+    if usage is None:
+        return None
+    return usage.completion_tokens
+
+
+def as_llm_exception(e: Exception) -> LlmException:
+    """Maps an OpenAI SDK error to the matching `LlmException`"""
+    if isinstance(e, APITimeoutError):
+        return LlmTimeoutException()
+    if isinstance(e, RateLimitError):
+        return LlmThrottledException()
+    return LlmException()
 
 
 class OpenAILlm(BaseLlm):
-    def __init__(self, model_id: str) -> None:
+    provider = "openai"
+
+    def __init__(
+        self,
+        model_id: str,
+        client: Optional[OpenAI] = None,
+        async_client: Optional[AsyncOpenAI] = None,
+    ) -> None:
         super().__init__()
-        self.client = OpenAI()
+        self.client = client if client is not None else OpenAI()
+        self.async_client = async_client if async_client is not None else AsyncOpenAI()
         self.system_prompt = {
             "role": "system",
             "content": [
@@ -27,87 +57,133 @@ class OpenAILlm(BaseLlm):
             ],
         }
         self.model_id = model_id
+        self.pool_in_use = LLM_CLIENT_POOL_IN_USE.labels(
+            provider="openai", model=model_id
+        )
+        self.request_params = {
+            "model": model_id,
+            "temperature": 1,
+            "max_tokens": self.max_tokens,
+            "top_p": 1,
+            "frequency_penalty": 0,
+            "presence_penalty": 0,
+        }
+        """Parameters shared by every completion request"""
+        self.stream_params = {
+            **self.request_params,
+            "stream": True,
+            "stream_options": {"include_usage": True},
+        }
+        """Parameters of streamed completions, which end with a usage chunk"""
+
+    def _messages(self, topic: str) -> List[Dict[str, Any]]:
+        with phase("payload_build"):
+            return [self.system_prompt, {"role": "user", "content": topic}]
 
     def get_story(self, topic: str) -> Dict[str, Any]:
-        max_length = 2000
+        logger.debug("About to write an story about: %s", topic)
+
+        metrics = CallMetrics("openai", self.model_id, "write")
 
-        user_message = {"role": "user", "content": topic}
-        messages = [self.system_prompt, user_message]
+        with self.pool_in_use.track_inprogress():
+            try:
+                response = self.client.chat.completions.create(
+                    messages=self._messages(topic),
+                    **self.request_params,
+                )
+            except Exception as e:
+                logger.exception(e)
+                raise as_llm_exception(e) from e
 
-        logger.debug(f"About to write an story about: {topic}")
+        metrics.finish(output_tokens(response.usage))
 
-        start_time = time.perf_counter_ns() / 1e9
+        story = response.choices[0].message.content
+
+        return {"topic": topic, "story": story}
+
+    def stream_story(self, topic: str):
+        logger.debug("About to stream an story about: %s", topic)
+
+        metrics = CallMetrics("openai", self.model_id, "streaming")
+        tokens = None
+        self.pool_in_use.inc()
 
         try:
-            response = self.client.chat.completions.create(
-                model=self.model_id,
-                messages=messages,
-                temperature=1,
-                max_tokens=max_length,
-                top_p=1,
-                frequency_penalty=0,
-                presence_penalty=0,
+            stream = self.client.chat.completions.create(
+                messages=self._messages(topic), **self.stream_params
             )
+
         except Exception as e:
-            logger.exception(e)
-            raise LlmException() from e
-
-        end_time = round((time.perf_counter_ns() / 1e9) - start_time, 3)
-        TIME_TO_FIRST_BYTE.labels(
-            provider="openai",
-            model=self.model_id,
-            mode="write",
-        ).observe(end_time)
-        TIME_TO_FULL_RESPONSE.labels(
-            provider="openai",
-            model=self.model_id,
-            mode="write",
-        ).observe(end_time)
+            self.pool_in_use.dec()
+            logger.exception("Error reading LLM response %s", e)
+            raise as_llm_exception(e) from e
 
-        story = response.choices[0].message.content
+        try:
+            for chunk in stream:
+                if chunk.usage is not None:
+                    tokens = output_tokens(chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content is not None:
+                    metrics.delta()
+                    yield chunk.choices[0].delta.content
+        except Exception as e:
+            logger.exception("Error reading LLM response %s", e)
+            raise as_llm_exception(e) from e
+        finally:
+            self.pool_in_use.dec()
+            stream.close()
 
-        return {"topic": topic, "story": story}
+        metrics.finish(tokens)
 
-    def stream_story(self, topic: str):
-        max_length = 2000
+    async def get_story_async(self, topic: str) -> Dict[str, Any]:
+        logger.debug("About to write a story about: %s", topic)
+
+        metrics = CallMetrics("openai", self.model_id, "write-async")
+
+        with self.pool_in_use.track_inprogress():
+            try:
+                response = await self.async_client.chat.completions.create(
+                    messages=self._messages(topic),
+                    **self.request_params,
+                )
+            except Exception as e:
+                logger.exception(e)
+                raise as_llm_exception(e) from e
+
+        metrics.finish(output_tokens(response.usage))
 
-        user_message = {"role": "user", "content": topic}
-        messages = [self.system_prompt, user_message]
+        story = response.choices[0].message.content
+
+        return {"topic": topic, "story": story}
 
-        logger.debug(f"About to stream an story about: {topic}")
+    async def astream_story(self, topic: str) -> AsyncIterator[str]:
+        logger.debug("About to stream a story about: %s", topic)
 
-        start_time = time.perf_counter_ns() / 1e9
+        metrics = CallMetrics("openai", self.model_id, "streaming-async")
+        tokens = None
+        self.pool_in_use.inc()
 
         try:
-            stream = self.client.chat.completions.create(
-                model=self.model_id,
-                messages=messages,
-                temperature=1,
-                max_tokens=max_length,
-                top_p=1,
-                frequency_penalty=0,
-                presence_penalty=0,
-                stream=True,
+            stream = await self.async_client.chat.completions.create(
+                messages=self._messages(topic), **self.stream_params
             )
 
         except Exception as e:
-            logger.exception(f"Error reading LLM response {e}")
-            raise LlmException() from e
-
-        for i, chunk in enumerate(stream):
-            if i == 0:
-                ttfb = round((time.perf_counter_ns() / 1e9) - start_time, 3)
-                TIME_TO_FIRST_BYTE.labels(
-                    provider="openai",
-                    model=self.model_id,
-                    mode="streaming",
-                ).observe(ttfb)
-            if chunk.choices[0].delta.content is not None:
-                yield chunk.choices[0].delta.content
-
-        end_time = round((time.perf_counter_ns() / 1e9) - start_time, 3)
-        TIME_TO_FULL_RESPONSE.labels(
-            provider="openai",
-            model=self.model_id,
-            mode="streaming",
-        ).observe(end_time)
+            self.pool_in_use.dec()
+            logger.exception("Error reading LLM response %s", e)
+            raise as_llm_exception(e) from e
+
+        try:
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    tokens = output_tokens(chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content is not None:
+                    metrics.delta()
+                    yield chunk.choices[0].delta.content
+        except Exception as e:
+            logger.exception("Error reading LLM response %s", e)
+            raise as_llm_exception(e) from e
+        finally:
+            self.pool_in_use.dec()
+            await stream.close()
+
+        metrics.finish(tokens)
@@ -0,0 +1,268 @@
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import AsyncIterator, Deque, Dict, Iterator, List, Optional
+
+from benchmark.core.config import Settings
+from benchmark.llms.base import BaseLlm
+from benchmark.utils import HEDGES_FIRED, HEDGES_WON
+
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyWindow:
+    """Rolling window of the latest successful call durations of one model
+
+    Parameters
+    ----------
+    size : int
+        Number of durations kept
+    percentile : float
+        Percentile of the window used as the hedging threshold, 0-100
+    min_samples : int
+        Durations needed before a threshold is reported
+    """
+
+    def __init__(self, size: int, percentile: float, min_samples: int) -> None:
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self._samples: Deque[float] = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self._threshold: Optional[float] = None
+        self._dirty = False
+
+    def record(self, duration: float) -> None:
+        with self._lock:
+            self._samples.append(duration)
+            self._dirty = True
+
+    def threshold(self) -> Optional[float]:
+        """Returns the configured percentile of the window, None while the
+        window has fewer than `min_samples` durations"""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+
+            if self._dirty:
+                samples = sorted(self._samples)
+                rank = math.ceil(self.percentile / 100 * len(samples)) - 1
+                self._threshold = samples[min(max(rank, 0), len(samples) - 1)]
+                self._dirty = False
+
+            return self._threshold
+
+
+class HedgeBudget:
+    """Caps hedges to a percentage of the calls.
+
+    Every call deposits ``percent / 100`` tokens and every hedge spends one,
+    so over time at most `percent` % of the calls are hedged. Tokens are
+    capped at `burst` so an idle period doesn't allow a storm of hedges.
+
+    Parameters
+    ----------
+    percent : float
+        Max extra upstream calls, as a percentage of the calls
+    burst : float
+        Max tokens that can be accumulated
+    """
+
+    def __init__(self, percent: float, burst: float = 10.0) -> None:
+        self.rate = percent / 100
+        self.burst = burst
+        self._tokens = 0.0
+        self._lock = threading.Lock()
+
+    def deposit(self) -> None:
+        with self._lock:
+            self._tokens = min(self._tokens + self.rate, self.burst)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._tokens < 1:
+                return False
+
+            self._tokens -= 1
+            return True
+
+
+def _consume_result(task: asyncio.Task) -> None:
+    # Losers are cancelled or fail after the winner returned, their outcome
+    # is not interesting but must be retrieved to avoid asyncio warnings
+    if not task.cancelled():
+        task.exception()
+
+
+class HedgedLlm(BaseLlm):
+    """Hedges the non-streaming calls of `llm` to cut its latency tail.
+
+    When a call runs past the hedging threshold, the live percentile of the
+    model's latency, a second identical call is started and the first one to
+    succeed wins. The async loser is cancelled, which closes its upstream
+    connection. Sync calls block a worker thread, so the sync loser can't be
+    interrupted and its result is just dropped. Streams aren't hedged.
+
+    Sync calls run in `executor` while the calling thread waits for them,
+    since the thread making a blocking call couldn't return the hedge's
+    result first. Their threshold counts from when the call starts running
+    in `executor`, not from when it was queued.
+
+    Parameters
+    ----------
+    llm : BaseLlm
+        The wrapped provider
+    executor : Executor
+        Runs the sync calls, so they can be waited on with a timeout
+    window : LatencyWindow
+        Latencies of the model, provides the hedging threshold
+    budget : HedgeBudget
+        Limits the extra upstream load
+    """
+
+    def __init__(
+        self,
+        llm: BaseLlm,
+        executor: Executor,
+        window: LatencyWindow,
+        budget: HedgeBudget,
+    ) -> None:
+        super().__init__()
+        self.llm = llm
+        self.executor = executor
+        self.window = window
+        self.budget = budget
+        self.provider = llm.provider
+        self.model_id = llm.model_id
+        self.max_tokens = llm.max_tokens
+
+        labels = {"provider": llm.provider, "model": llm.model_id}
+        self._fired = HEDGES_FIRED.labels(**labels)
+        self._won = HEDGES_WON.labels(**labels)
+
+    def get_story(self, topic: str) -> Dict[str, str]:
+        self.budget.deposit()
+        threshold = self.window.threshold()
+        if threshold is None:
+            return self._timed_call(topic)
+
+        # The threshold counts from when the primary starts running, so
+        # calls queued in a busy executor aren't hedged for waiting there
+        started = threading.Event()
+
+        def primary_call() -> Dict[str, str]:
+            started.set()
+            return self._timed_call(topic)
+
+        primary = self.executor.submit(primary_call)
+        # Also set when the call is cancelled before it ran
+        primary.add_done_callback(lambda _: started.set())
+        started.wait()
+        try:
+            return primary.result(timeout=threshold)
+        except FutureTimeoutError:
+            pass
+
+        if not self.budget.try_spend():
+            return primary.result()
+
+        self._fired.inc()
+        logger.debug("Hedging %s call after %.3fs", self.model_id, threshold)
+        hedge = self.executor.submit(self._timed_call, topic)
+
+        return self._first_success([primary, hedge])
+
+    def stream_story(self, topic: str) -> Iterator[str]:
+        return self.llm.stream_story(topic=topic)
+
+    async def get_story_async(self, topic: str) -> Dict[str, str]:
+        self.budget.deposit()
+        threshold = self.window.threshold()
+        if threshold is None:
+            return await self._timed_call_async(topic)
+
+        primary = asyncio.ensure_future(self._timed_call_async(topic))
+        primary.add_done_callback(_consume_result)
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=threshold)
+            if done or not self.budget.try_spend():
+                return await primary
+
+            self._fired.inc()
+            logger.debug("Hedging %s call after %.3fs", self.model_id, threshold)
+            hedge = asyncio.ensure_future(self._timed_call_async(topic))
+            hedge.add_done_callback(_consume_result)
+            tasks.append(hedge)
+
+            return await self._first_success_async(tasks)
+
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def astream_story(self, topic: str) -> AsyncIterator[str]:
+        return self.llm.astream_story(topic=topic)
+
+    def _timed_call(self, topic: str) -> Dict[str, str]:
+        start_time = time.perf_counter()
+        data = self.llm.get_story(topic=topic)
+        self.window.record(time.perf_counter() - start_time)
+        return data
+
+    async def _timed_call_async(self, topic: str) -> Dict[str, str]:
+        start_time = time.perf_counter()
+        data = await self.llm.get_story_async(topic=topic)
+        self.window.record(time.perf_counter() - start_time)
+        return data
+
+    def _first_success(self, futures: List[Future]) -> Dict[str, str]:
+        """Returns the first successful result, raising the primary call's
+        error if every call failed"""
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending:
+                        loser.cancel()
+                    if future is not futures[0]:
+                        self._won.inc()
+                    return future.result()
+
+        return futures[0].result()
+
+    async def _first_success_async(self, tasks: List[asyncio.Task]) -> Dict[str, str]:
+        """Async equivalent of `_first_success`"""
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    if task is not tasks[0]:
+                        self._won.inc()
+                    return task.result()
+
+        return tasks[0].result()
+
+
+def build_hedged_llm(settings: Settings, llm: BaseLlm, executor: Executor) -> HedgedLlm:
+    """Wraps `llm` in a `HedgedLlm` configured by `settings`"""
+    return HedgedLlm(
+        llm,
+        executor=executor,
+        window=LatencyWindow(
+            size=settings.HEDGING_WINDOW,
+            percentile=settings.HEDGING_PERCENTILE,
+            min_samples=settings.HEDGING_MIN_SAMPLES,
+        ),
+        budget=HedgeBudget(settings.HEDGING_BUDGET_PERCENT),
+    )
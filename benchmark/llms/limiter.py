@@ -0,0 +1,318 @@
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import deque
+from typing import AsyncIterator, Callable, Deque, Dict, Iterator, Optional
+
+from benchmark.core.config import Settings
+from benchmark.llms.base import BaseLlm
+from benchmark.llms.exceptions import (
+    LlmOverloadedException,
+    LlmThrottledException,
+    LlmTimeoutException,
+)
+from benchmark.utils import (
+    LIMITER_IN_FLIGHT,
+    LIMITER_LIMIT,
+    LIMITER_QUEUE_DEPTH,
+    LIMITER_REJECTIONS,
+)
+
+
+logger = logging.getLogger(__name__)
+
+DECREASE_COOLDOWN = 1.0
+"""Min seconds between two multiplicative decreases of the limit, so a burst
+of concurrent failures counts as a single congestion signal"""
+
+
+class _Waiter:
+    def __init__(self, wake: Callable[[], None]) -> None:
+        self.wake = wake
+        self.granted = False
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class AdaptiveLimiter:
+    """Adaptive concurrency limit with a bounded wait queue, shared by the
+    sync (threadpool) and async (event loop) callers of one provider model.
+
+    The limit follows AIMD: it grows by ``1 / limit`` on every healthy call
+    and is multiplied by `backoff` when the provider throttles or times out,
+    or when the short-term latency average drifts past `latency_tolerance`
+    times the long-term one. Calls over the limit wait in a FIFO queue;
+    they are rejected right away when the queue is full and after
+    `queue_timeout` seconds otherwise.
+
+    Parameters
+    ----------
+    provider : str
+        Provider name, used as a metric label
+    model : str
+        Model id, used as a metric label
+    initial_limit : int
+        Concurrency limit to start with
+    min_limit : int
+        Floor of the concurrency limit
+    max_limit : int
+        Ceiling of the concurrency limit
+    max_queue : int
+        Max number of calls waiting for a slot
+    queue_timeout : float
+        Max seconds a call waits for a slot
+    backoff : float
+        Factor applied to the limit on congestion
+    latency_tolerance : float
+        Short/long-term latency ratio considered congestion
+    """
+
+    def __init__(
+        self,
+        provider: str,
+        model: str,
+        initial_limit: int,
+        min_limit: int,
+        max_limit: int,
+        max_queue: int,
+        queue_timeout: float,
+        backoff: float,
+        latency_tolerance: float,
+    ) -> None:
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+
+        self.limit = float(initial_limit)
+        self.in_flight = 0
+        self._short_latency: Optional[float] = None
+        self._long_latency: Optional[float] = None
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self._waiters: Deque[_Waiter] = deque()
+
+        labels = {"provider": provider, "model": model}
+        self._limit_gauge = LIMITER_LIMIT.labels(**labels)
+        self._in_flight_gauge = LIMITER_IN_FLIGHT.labels(**labels)
+        self._queue_gauge = LIMITER_QUEUE_DEPTH.labels(**labels)
+        self._queue_full = LIMITER_REJECTIONS.labels(reason="queue_full", **labels)
+        self._queue_timeout = LIMITER_REJECTIONS.labels(
+            reason="queue_timeout", **labels
+        )
+        self._limit_gauge.set(self.limit)
+
+    @property
+    def retry_after(self) -> float:
+        """Rough time until a slot frees up, sent as `Retry-After`"""
+        return max(self._short_latency or 1.0, 1.0)
+
+    def acquire(self) -> None:
+        """Blocks the calling thread until a slot is granted"""
+        event = threading.Event()
+        waiter = self._enqueue(event.set)
+        if waiter is None:
+            return
+
+        if not event.wait(self.queue_timeout):
+            self._abandon(waiter)
+
+    async def acquire_async(self) -> None:
+        """Waits on the event loop until a slot is granted"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = self._enqueue(lambda: loop.call_soon_threadsafe(_resolve, future))
+        if waiter is None:
+            return
+
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter.granted:
+                    self._release_slot()
+                else:
+                    self._waiters.remove(waiter)
+                    self._queue_gauge.set(len(self._waiters))
+            raise
+
+    def release(self, latency: Optional[float], congested: bool) -> None:
+        """Frees a slot and adapts the limit to the outcome of the call
+
+        Parameters
+        ----------
+        latency : Optional[float]
+            Duration of the call, None when it failed or isn't comparable
+        congested : bool
+            Whether the provider throttled or timed out
+        """
+        with self._lock:
+            now = time.monotonic()
+            if latency is not None:
+                self._observe_latency(latency)
+                if self._long_latency and (
+                    self._short_latency > self._long_latency * self.latency_tolerance
+                ):
+                    congested = True
+
+            if congested:
+                if now - self._last_decrease >= DECREASE_COOLDOWN:
+                    self.limit = max(self.limit * self.backoff, self.min_limit)
+                    self._last_decrease = now
+                    logger.info("Concurrency limit decreased to %.1f", self.limit)
+            elif latency is not None and self.in_flight >= self.limit / 2:
+                # Only grow when the limit is actually being used
+                self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+
+            self._limit_gauge.set(self.limit)
+            self._release_slot()
+
+    def _enqueue(self, wake: Callable[[], None]) -> Optional[_Waiter]:
+        """Takes a slot if there is one, else queues a waiter. Returns None
+        when the slot was taken right away."""
+        with self._lock:
+            if not self._waiters and self.in_flight < math.floor(self.limit):
+                self.in_flight += 1
+                self._in_flight_gauge.set(self.in_flight)
+                return None
+
+            if len(self._waiters) >= self.max_queue:
+                self._queue_full.inc()
+                raise LlmOverloadedException(self.retry_after, queue_full=True)
+
+            waiter = _Waiter(wake)
+            self._waiters.append(waiter)
+            self._queue_gauge.set(len(self._waiters))
+            return waiter
+
+    def _abandon(self, waiter: _Waiter) -> None:
+        """Gives up waiting, unless the slot was granted in the meantime"""
+        with self._lock:
+            if waiter.granted:
+                return
+
+            self._waiters.remove(waiter)
+            self._queue_gauge.set(len(self._waiters))
+
+        self._queue_timeout.inc()
+        raise LlmOverloadedException(self.retry_after, queue_full=False)
+
+    def _release_slot(self) -> None:
+        self.in_flight -= 1
+        while self._waiters and self.in_flight < math.floor(self.limit):
+            waiter = self._waiters.popleft()
+            waiter.granted = True
+            self.in_flight += 1
+            waiter.wake()
+
+        self._in_flight_gauge.set(self.in_flight)
+        self._queue_gauge.set(len(self._waiters))
+
+    def _observe_latency(self, latency: float) -> None:
+        if self._short_latency is None:
+            self._short_latency = self._long_latency = latency
+            return
+
+        self._short_latency += 0.1 * (latency - self._short_latency)
+        self._long_latency += 0.01 * (latency - self._long_latency)
+
+
+class LimitedLlm(BaseLlm):
+    """Puts an `AdaptiveLimiter` in front of every call of `llm`.
+
+    Streams hold their slot until they are exhausted or closed; only
+    throttles and timeouts feed back into the limit, as stream durations
+    depend on the story length.
+
+    Parameters
+    ----------
+    llm : BaseLlm
+        The wrapped provider
+    limiter : AdaptiveLimiter
+        Limiter of the provider model
+    """
+
+    def __init__(self, llm: BaseLlm, limiter: AdaptiveLimiter) -> None:
+        super().__init__()
+        self.llm = llm
+        self.limiter = limiter
+        self.provider = llm.provider
+        self.model_id = llm.model_id
+        self.max_tokens = llm.max_tokens
+
+    def get_story(self, topic: str) -> Dict[str, str]:
+        self.limiter.acquire()
+        start_time = time.perf_counter()
+        latency, congested = None, False
+        try:
+            data = self.llm.get_story(topic=topic)
+            latency = time.perf_counter() - start_time
+            return data
+        except (LlmThrottledException, LlmTimeoutException):
+            congested = True
+            raise
+        finally:
+            self.limiter.release(latency, congested)
+
+    def stream_story(self, topic: str) -> Iterator[str]:
+        self.limiter.acquire()
+        congested = False
+        try:
+            yield from self.llm.stream_story(topic=topic)
+        except (LlmThrottledException, LlmTimeoutException):
+            congested = True
+            raise
+        finally:
+            self.limiter.release(None, congested)
+
+    async def get_story_async(self, topic: str) -> Dict[str, str]:
+        await self.limiter.acquire_async()
+        start_time = time.perf_counter()
+        latency, congested = None, False
+        try:
+            data = await self.llm.get_story_async(topic=topic)
+            latency = time.perf_counter() - start_time
+            return data
+        except (LlmThrottledException, LlmTimeoutException):
+            congested = True
+            raise
+        finally:
+            self.limiter.release(latency, congested)
+
+    async def astream_story(self, topic: str) -> AsyncIterator[str]:
+        await self.limiter.acquire_async()
+        congested = False
+        stream = self.llm.astream_story(topic=topic)
+        try:
+            async for delta in stream:
+                yield delta
+        except (LlmThrottledException, LlmTimeoutException):
+            congested = True
+            raise
+        finally:
+            self.limiter.release(None, congested)
+            await stream.aclose()
+
+
+def build_limiter(settings: Settings, llm: BaseLlm) -> AdaptiveLimiter:
+    """Creates the `AdaptiveLimiter` of `llm` configured by `settings`"""
+    return AdaptiveLimiter(
+        provider=llm.provider,
+        model=llm.model_id,
+        initial_limit=settings.LIMITER_INITIAL_LIMIT,
+        min_limit=settings.LIMITER_MIN_LIMIT,
+        max_limit=settings.LIMITER_MAX_LIMIT,
+        max_queue=settings.LIMITER_MAX_QUEUE,
+        queue_timeout=settings.LIMITER_QUEUE_TIMEOUT,
+        backoff=settings.LIMITER_BACKOFF,
+        latency_tolerance=settings.LIMITER_LATENCY_TOLERANCE,
+    )
@@ -0,0 +1,280 @@
+import asyncio
+import logging
+import math
+import random
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import Any, AsyncIterator, Dict, Iterator, List, Literal
+
+from benchmark.core.timing import phase
+from benchmark.llms.base import BaseLlm
+from benchmark.llms.exceptions import LlmException, LlmThrottledException
+from benchmark.llms.telemetry import CallMetrics
+
+
+logger = logging.getLogger(__name__)
+
+WORDS = (
+    "the ship drifted past the rings of Saturn while Buenos Aires slept and "
+    "a robot tango dancer counted stars above the pampas dreaming of rain on "
+    "red dust as the last colony radioed home through static and silence"
+).split()
+
+
+@dataclass(frozen=True)
+class MockProfile:
+    """Latency, length and failure behaviour of a `MockLlm`
+
+    All durations are in seconds.
+    """
+
+    ttft: float
+    """Mean time to first token"""
+    ttft_jitter: float
+    """Standard deviation of the time to first token, as a fraction of `ttft`"""
+    inter_token: float
+    """Mean delay between consecutive tokens"""
+    inter_token_distribution: Literal["constant", "exponential", "lognormal"]
+    """Distribution of the delay between consecutive tokens"""
+    inter_token_sigma: float
+    """Shape of the lognormal inter-token distribution"""
+    tokens: int
+    """Mean number of output tokens"""
+    tokens_jitter: float
+    """Standard deviation of the output length, as a fraction of `tokens`"""
+    error_rate: float
+    """Probability of failing with `LlmException`"""
+    throttle_rate: float
+    """Probability of failing with `LlmThrottledException`"""
+
+
+PROFILES: Dict[str, MockProfile] = {
+    "mock-instant": MockProfile(
+        ttft=0.0,
+        ttft_jitter=0.0,
+        inter_token=0.0,
+        inter_token_distribution="constant",
+        inter_token_sigma=0.0,
+        tokens=200,
+        tokens_jitter=0.0,
+        error_rate=0.0,
+        throttle_rate=0.0,
+    ),
+    "mock-fast": MockProfile(
+        ttft=0.2,
+        ttft_jitter=0.1,
+        inter_token=0.005,
+        inter_token_distribution="exponential",
+        inter_token_sigma=0.0,
+        tokens=300,
+        tokens_jitter=0.2,
+        error_rate=0.0,
+        throttle_rate=0.0,
+    ),
+    "mock-realistic": MockProfile(
+        ttft=0.6,
+        ttft_jitter=0.3,
+        inter_token=0.02,
+        inter_token_distribution="lognormal",
+        inter_token_sigma=0.5,
+        tokens=400,
+        tokens_jitter=0.3,
+        error_rate=0.005,
+        throttle_rate=0.01,
+    ),
+    "mock-slow": MockProfile(
+        ttft=2.0,
+        ttft_jitter=0.5,
+        inter_token=0.05,
+        inter_token_distribution="lognormal",
+        inter_token_sigma=0.8,
+        tokens=600,
+        tokens_jitter=0.3,
+        error_rate=0.01,
+        throttle_rate=0.02,
+    ),
+    "mock-flaky": MockProfile(
+        ttft=0.6,
+        ttft_jitter=0.5,
+        inter_token=0.02,
+        inter_token_distribution="lognormal",
+        inter_token_sigma=1.0,
+        tokens=400,
+        tokens_jitter=0.3,
+        error_rate=0.05,
+        throttle_rate=0.15,
+    ),
+}
+
+
+def resolve_profile(model_id: str, overrides: Dict[str, Dict[str, Any]]) -> MockProfile:
+    """Returns the built-in profile for `model_id` with `overrides` applied"""
+    return replace(PROFILES[model_id], **overrides.get(model_id, {}))
+
+
+@dataclass
+class _Plan:
+    """Everything a single mock call will do, drawn up front"""
+
+    ttft: float
+    delays: List[float]
+    tokens: List[str]
+    failure: Literal[None, "error", "throttle"]
+    fail_at: int
+
+
+class MockLlm(BaseLlm):
+    """Offline `BaseLlm` that simulates an upstream provider.
+
+    Every call draws its timings, length and failures from a profile using a
+    RNG seeded with the seed, the topic and the number of previous calls for
+    that topic, so a replayed workload behaves the same way on every run.
+    Sync methods block the calling thread with `time.sleep` and async methods
+    yield to the event loop with `asyncio.sleep`, like real providers would.
+
+    Parameters
+    ----------
+    model_id : str
+        Name of the profile, one of `PROFILES`
+    profile : MockProfile
+        Behaviour of the simulated provider
+    seed : int
+        Seed of the per-call RNG
+    max_topics : int
+        Topics whose calls are counted, the least recently used one is then
+        forgotten and restarts from its first call
+    """
+
+    provider = "mock"
+
+    def __init__(
+        self,
+        model_id: str,
+        profile: MockProfile,
+        seed: int = 0,
+        max_topics: int = 10_000,
+    ) -> None:
+        super().__init__()
+        self.model_id = model_id
+        self.profile = profile
+        self.seed = seed
+        self.max_tokens = max(self.max_tokens, profile.tokens * 2)
+        self._lock = threading.Lock()
+        self.max_topics = max_topics
+        self._calls: "OrderedDict[str, int]" = OrderedDict()
+
+    def get_story(self, topic: str) -> Dict[str, Any]:
+        plan = self._plan(topic)
+        metrics = CallMetrics("mock", self.model_id, "write")
+
+        self._raise_throttle(plan)
+        with phase("upstream_ttfb"):
+            time.sleep(plan.ttft + sum(plan.delays))
+        self._raise_failure(plan)
+
+        metrics.finish(len(plan.tokens))
+        return {"topic": topic, "story": "".join(plan.tokens)}
+
+    def stream_story(self, topic: str) -> Iterator[str]:
+        plan = self._plan(topic)
+        metrics = CallMetrics("mock", self.model_id, "streaming")
+
+        self._raise_throttle(plan)
+        with phase("upstream_ttfb"):
+            time.sleep(plan.ttft)
+        for i, (delay, token) in enumerate(zip(plan.delays, plan.tokens)):
+            if i == plan.fail_at:
+                self._raise_failure(plan)
+            time.sleep(delay)
+            metrics.delta()
+            yield token
+
+        metrics.finish(len(plan.tokens))
+
+    async def get_story_async(self, topic: str) -> Dict[str, Any]:
+        plan = self._plan(topic)
+        metrics = CallMetrics("mock", self.model_id, "write-async")
+
+        self._raise_throttle(plan)
+        with phase("upstream_ttfb"):
+            await asyncio.sleep(plan.ttft + sum(plan.delays))
+        self._raise_failure(plan)
+
+        metrics.finish(len(plan.tokens))
+        return {"topic": topic, "story": "".join(plan.tokens)}
+
+    async def astream_story(self, topic: str) -> AsyncIterator[str]:
+        plan = self._plan(topic)
+        metrics = CallMetrics("mock", self.model_id, "streaming-async")
+
+        self._raise_throttle(plan)
+        with phase("upstream_ttfb"):
+            await asyncio.sleep(plan.ttft)
+        for i, (delay, token) in enumerate(zip(plan.delays, plan.tokens)):
+            if i == plan.fail_at:
+                self._raise_failure(plan)
+            await asyncio.sleep(delay)
+            metrics.delta()
+            yield token
+
+        metrics.finish(len(plan.tokens))
+
+    def _plan(self, topic: str) -> _Plan:
+        with self._lock:
+            call = self._calls.pop(topic, 0)
+            self._calls[topic] = call + 1
+            if len(self._calls) > self.max_topics:
+                self._calls.popitem(last=False)
+
+        rng = random.Random(f"{self.seed}:{self.model_id}:{topic}:{call}")
+        profile = self.profile
+
+        ttft = max(rng.gauss(profile.ttft, profile.ttft * profile.ttft_jitter), 0.0)
+        n_tokens = max(
+            int(rng.gauss(profile.tokens, profile.tokens * profile.tokens_jitter)), 1
+        )
+        n_tokens = min(n_tokens, self.max_tokens)
+        delays = [self._inter_token_delay(rng) for _ in range(n_tokens)]
+        tokens = [
+            (" " if i else "") + WORDS[rng.randrange(len(WORDS))]
+            for i in range(n_tokens)
+        ]
+
+        failure = None
+        draw = rng.random()
+        if draw < profile.throttle_rate:
+            failure = "throttle"
+        elif draw < profile.throttle_rate + profile.error_rate:
+            failure = "error"
+
+        # Throttles happen before any token, errors may happen mid-stream
+        fail_at = 0 if failure != "error" else rng.randrange(n_tokens)
+
+        return _Plan(ttft, delays, tokens, failure, fail_at)
+
+    def _inter_token_delay(self, rng: random.Random) -> float:
+        profile = self.profile
+        if profile.inter_token <= 0:
+            return 0.0
+        if profile.inter_token_distribution == "exponential":
+            return rng.expovariate(1 / profile.inter_token)
+        if profile.inter_token_distribution == "lognormal":
+            sigma = profile.inter_token_sigma
+            mu = math.log(profile.inter_token) - sigma**2 / 2
+            return rng.lognormvariate(mu, sigma)
+        return profile.inter_token
+
+    def _raise_throttle(self, plan: _Plan) -> None:
+        """Throttles are answered right away, like a provider's 429"""
+        if plan.failure == "throttle":
+            self._raise_failure(plan)
+
+    def _raise_failure(self, plan: _Plan) -> None:
+        if plan.failure == "throttle":
+            logger.warning("Mock %s throttled the request", self.model_id)
+            raise LlmThrottledException()
+        if plan.failure == "error":
+            logger.warning("Mock %s failed the request", self.model_id)
+            raise LlmException()
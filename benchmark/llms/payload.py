@@ -0,0 +1,31 @@
+from typing import Any, Dict
+
+import orjson
+
+TOPIC_PLACEHOLDER = "__TOPIC__"
+
+
+class PayloadTemplate:
+    """Pre-serialized request body where only the topic changes per call.
+
+    The payload is serialized once with `TOPIC_PLACEHOLDER` in place of the
+    topic, and every call concatenates the bytes around it with the JSON
+    encoded topic, instead of building and dumping the whole dict again.
+
+    Parameters
+    ----------
+    payload : Dict[str, Any]
+        Request body, with `TOPIC_PLACEHOLDER` as the value that holds the
+        topic. The placeholder must appear exactly once.
+    """
+
+    def __init__(self, payload: Dict[str, Any]) -> None:
+        serialized = orjson.dumps(payload)
+        placeholder = orjson.dumps(TOPIC_PLACEHOLDER)
+        if serialized.count(placeholder) != 1:
+            raise ValueError("The payload must hold the topic placeholder once")
+
+        self.prefix, self.suffix = serialized.split(placeholder)
+
+    def render(self, topic: str) -> bytes:
+        return self.prefix + orjson.dumps(topic) + self.suffix
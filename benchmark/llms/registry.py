@@ -0,0 +1,380 @@
+import asyncio
+import logging
+import threading
+from functools import partial
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+import anyio
+
+from benchmark.api.schemas import StorytellerModel
+from benchmark.core.config import Settings
+from benchmark.core.executors import InstrumentedThreadPoolExecutor
+from benchmark.core.timing import atrace_upstream, trace_upstream
+from benchmark.llms.base import BaseLlm
+from benchmark.llms.fanout import SharedStreamLlm
+from benchmark.llms.hedging import build_hedged_llm
+from benchmark.llms.limiter import LimitedLlm, build_limiter
+from benchmark.llms.mock import MockLlm, resolve_profile
+from benchmark.llms.routing import Backend, RoutedLlm, build_backend
+from benchmark.utils import LLM_CLIENT_POOL_SIZE
+
+if TYPE_CHECKING:
+    import httpx
+    from openai import AsyncOpenAI, OpenAI
+
+    from benchmark.llms.aws import AsyncBedrockRuntime
+
+
+logger = logging.getLogger(__name__)
+
+BEDROCK_MODELS = {
+    StorytellerModel.BEDROCK_CLAUDE_SONNET,
+    StorytellerModel.BEDROCK_CLAUDE_HAIKU,
+}
+MOCK_MODELS = {
+    StorytellerModel.MOCK_INSTANT,
+    StorytellerModel.MOCK_FAST,
+    StorytellerModel.MOCK_REALISTIC,
+    StorytellerModel.MOCK_SLOW,
+    StorytellerModel.MOCK_FLAKY,
+}
+
+
+class LlmRegistry:
+    """Holds long-lived, pooled provider clients for a single worker.
+
+    Clients are created the first time a model is requested and then
+    shared by every request, so credential resolution, endpoint loading
+    and TLS handshakes are paid once per worker instead of once per request.
+    Each provider gets a sync client and an async client, each with its own
+    connection pool. With `LIMITER_ENABLED` every model is wrapped in a
+    `LimitedLlm` with its own adaptive concurrency limit, with
+    `HEDGING_ENABLED` in a `HedgedLlm`, and with `STREAM_FANOUT_ENABLED` in
+    a `SharedStreamLlm`. With `ROUTING_ENABLED` a model is served by a
+    `RoutedLlm` over every region of its equivalent models.
+
+    The provider modules, and with them boto3 and openai, are imported when
+    the first client of their provider is created.
+
+    Parameters
+    ----------
+    settings : Settings
+        Application settings with the pool configuration
+    """
+
+    def __init__(self, settings: Settings) -> None:
+        self.settings = settings
+        self._lock = threading.Lock()
+        self._clients: Dict[str, Any] = {}
+        self._async_clients: Dict[str, Any] = {}
+        self._llms: Dict[StorytellerModel, BaseLlm] = {}
+        self._backends: Dict[Tuple[StorytellerModel, Optional[str]], Backend] = {}
+        self._executor: Optional[InstrumentedThreadPoolExecutor] = None
+        self._warm_targets: Dict[str, Tuple[Any, str]] = {}
+
+    def get(self, model: StorytellerModel) -> BaseLlm:
+        """Returns the shared `BaseLlm` for `model`, creating it if needed"""
+        llm = self._llms.get(model)
+        if llm is not None:
+            return llm
+
+        with self._lock:
+            llm = self._llms.get(model)
+            if llm is None:
+                if self.settings.ROUTING_ENABLED:
+                    llm = self._build_routed(model)
+                else:
+                    llm = self._build(model)
+                if self.settings.LIMITER_ENABLED:
+                    llm = LimitedLlm(llm, build_limiter(self.settings, llm))
+                if self.settings.HEDGING_ENABLED:
+                    # Outside the limiter, so hedges count against the limit
+                    llm = build_hedged_llm(self.settings, llm, self._hedge_executor())
+                if self.settings.STREAM_FANOUT_ENABLED:
+                    # Outside the limiter, so subscribers don't take a slot
+                    llm = SharedStreamLlm(
+                        llm,
+                        replay_size=self.settings.STREAM_FANOUT_REPLAY_SIZE,
+                        max_lag=self.settings.STREAM_FANOUT_MAX_LAG,
+                        lag_timeout=self.settings.STREAM_FANOUT_LAG_TIMEOUT,
+                    )
+                self._llms[model] = llm
+
+        return llm
+
+    async def aget(self, model: StorytellerModel) -> BaseLlm:
+        """`get` for the event loop. The first call for a model creates its
+        clients, which imports the provider SDK and loads credentials and
+        endpoints, so it runs in a thread instead of stalling the worker."""
+        llm = self._llms.get(model)
+        if llm is not None:
+            return llm
+
+        return await anyio.to_thread.run_sync(self.get, model)
+
+    async def aclose(self) -> None:
+        """Closes every pooled client. Called on application shutdown."""
+        with self._lock:
+            clients = list(self._clients.items())
+            async_clients = list(self._async_clients.items())
+            self._clients.clear()
+            self._async_clients.clear()
+            self._llms.clear()
+            self._backends.clear()
+            self._warm_targets.clear()
+            executor, self._executor = self._executor, None
+
+        if executor is not None:
+            # Queued calls are dropped, running ones are waited for off the loop
+            await anyio.to_thread.run_sync(
+                partial(executor.shutdown, wait=True, cancel_futures=True)
+            )
+
+        for name, client in clients:
+            try:
+                client.close()
+            except Exception as e:
+                logger.warning("Error closing %s client: %s", name, e)
+
+        for name, client in async_clients:
+            try:
+                # AsyncOpenAI names it `close`, httpx and AsyncBedrockRuntime `aclose`
+                close = getattr(client, "aclose", None) or client.close
+                await close()
+            except Exception as e:
+                logger.warning("Error closing async %s client: %s", name, e)
+
+    async def prewarm(
+        self, models: List[StorytellerModel], connections: int, timeout: float
+    ) -> None:
+        """Creates the clients of `models` and opens `connections` pooled
+        connections of each HTTP client, so the first requests don't pay for
+        DNS, TCP and TLS. Called on startup, before the worker reports ready.
+
+        Connections are opened with concurrent HEAD requests to the provider
+        endpoint, whatever their status. Failures and timeouts are logged
+        and don't prevent the worker from starting.
+
+        Parameters
+        ----------
+        models : List[StorytellerModel]
+            Models to pre-warm
+        connections : int
+            Connections opened by each HTTP client
+        timeout : float
+            Seconds to wait for the connections
+        """
+        for model in models:
+            await self.aget(model)
+
+        if not self._warm_targets:
+            return
+
+        logger.info(
+            "Pre-warming %s connections of %s",
+            connections,
+            ", ".join(self._warm_targets),
+        )
+        warmups = [
+            self._warm(name, client, url, connections)
+            for name, (client, url) in self._warm_targets.items()
+        ]
+        try:
+            await asyncio.wait_for(asyncio.gather(*warmups), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Pre-warming timed out after %.1fs", timeout)
+
+    async def _warm(self, name: str, client: Any, url: str, connections: int) -> None:
+        import httpx
+
+        if isinstance(client, httpx.AsyncClient):
+            requests = [client.head(url) for _ in range(connections)]
+        else:
+            requests = [
+                anyio.to_thread.run_sync(client.head, url) for _ in range(connections)
+            ]
+
+        results = await asyncio.gather(*requests, return_exceptions=True)
+        errors = [r for r in results if isinstance(r, Exception)]
+        if errors:
+            logger.warning(
+                "Error pre-warming %s/%s connections of %s client: %s",
+                len(errors),
+                connections,
+                name,
+                errors[0],
+            )
+
+    def _build_routed(self, model: StorytellerModel) -> RoutedLlm:
+        """Routes `model` over every region of its equivalent models"""
+        candidates = [model] + [
+            StorytellerModel(m)
+            for m in self.settings.MODEL_GROUPS.get(model.value, [])
+            if m != model.value
+        ]
+        backends = [
+            self._backend(candidate, region)
+            for candidate in candidates
+            for region in self._regions(candidate)
+        ]
+        logger.info(
+            "Routing %s over %s", model.value, ", ".join(b.name for b in backends)
+        )
+
+        return RoutedLlm(
+            model.value, backends, explore_rate=self.settings.ROUTING_EXPLORE_RATE
+        )
+
+    def _regions(self, model: StorytellerModel) -> List[Optional[str]]:
+        if model not in BEDROCK_MODELS:
+            return [None]
+
+        regions = [self.settings.BEDROCK_REGION]
+        regions += [r for r in self.settings.BEDROCK_REGIONS if r not in regions]
+        return regions
+
+    def _backend(self, model: StorytellerModel, region: Optional[str]) -> Backend:
+        """Backends are shared by every group they are part of, so they all
+        see the same health stats"""
+        key = (model, region)
+        if key not in self._backends:
+            llm = self._build(model, region)
+            name = "/".join(p for p in (llm.provider, region, model.value) if p)
+            self._backends[key] = build_backend(self.settings, name, llm)
+
+        return self._backends[key]
+
+    def _build(self, model: StorytellerModel, region: Optional[str] = None) -> BaseLlm:
+        if model in MOCK_MODELS:
+            return MockLlm(
+                model.value,
+                profile=resolve_profile(
+                    model.value, self.settings.MOCK_LLM_PROFILE_OVERRIDES
+                ),
+                seed=self.settings.MOCK_LLM_SEED,
+            )
+
+        if model in BEDROCK_MODELS:
+            from benchmark.llms.bedrock import ClaudeBedrockLlm
+
+            region = region or self.settings.BEDROCK_REGION
+            return ClaudeBedrockLlm(
+                model.value,
+                region=region,
+                client=self._bedrock_client(region),
+                async_client=self._async_bedrock_client(region),
+            )
+
+        from benchmark.llms.gpt import OpenAILlm
+
+        return OpenAILlm(
+            model.value,
+            client=self._openai_client(),
+            async_client=self._async_openai_client(),
+        )
+
+    def _hedge_executor(self) -> InstrumentedThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = InstrumentedThreadPoolExecutor(
+                "hedge", max_workers=self.settings.HEDGING_EXECUTOR_WORKERS
+            )
+
+        return self._executor
+
+    def _limits(self) -> "httpx.Limits":
+        import httpx
+
+        return httpx.Limits(
+            max_connections=self.settings.LLM_MAX_POOL_CONNECTIONS,
+            max_keepalive_connections=self.settings.LLM_MAX_POOL_CONNECTIONS,
+            keepalive_expiry=self.settings.LLM_KEEPALIVE_EXPIRY,
+        )
+
+    def _event_hooks(self, hook: Any) -> Optional[Dict[str, List[Any]]]:
+        """Request hooks of the httpx clients, timing upstream phases when
+        `PHASE_TIMING_ENABLED`"""
+        if not self.settings.PHASE_TIMING_ENABLED:
+            return None
+        return {"request": [hook]}
+
+    def _bedrock_client(self, region: str) -> Any:
+        name = f"bedrock/{region}"
+        if name not in self._clients:
+            import boto3
+            from botocore.config import Config
+
+            logger.info("Creating Bedrock client for region %s", region)
+            self._clients[name] = boto3.client(
+                service_name="bedrock-runtime",
+                region_name=region,
+                config=Config(
+                    max_pool_connections=self.settings.LLM_MAX_POOL_CONNECTIONS,
+                    tcp_keepalive=True,
+                ),
+            )
+            LLM_CLIENT_POOL_SIZE.labels(provider="bedrock").set(
+                self.settings.LLM_MAX_POOL_CONNECTIONS
+            )
+
+        return self._clients[name]
+
+    def _async_bedrock_client(self, region: str) -> "AsyncBedrockRuntime":
+        name = f"bedrock/{region}"
+        if name not in self._async_clients:
+            import boto3
+            import httpx
+
+            from benchmark.llms.aws import AsyncBedrockRuntime
+
+            runtime = AsyncBedrockRuntime(
+                region=region,
+                session=boto3.Session(),
+                http_client=httpx.AsyncClient(
+                    limits=self._limits(),
+                    timeout=httpx.Timeout(self.settings.LLM_TIMEOUT),
+                    event_hooks=self._event_hooks(atrace_upstream),
+                ),
+            )
+            self._async_clients[name] = runtime
+            self._warm_targets[f"async {name}"] = (
+                runtime.http_client,
+                runtime.endpoint_url,
+            )
+
+        return self._async_clients[name]
+
+    def _openai_client(self) -> "OpenAI":
+        if "openai" not in self._clients:
+            import httpx
+            from openai import OpenAI
+
+            logger.info("Creating OpenAI client")
+            http_client = httpx.Client(
+                limits=self._limits(), event_hooks=self._event_hooks(trace_upstream)
+            )
+            self._clients["openai"] = OpenAI(http_client=http_client)
+            self._warm_targets["openai"] = (
+                http_client,
+                str(self._clients["openai"].base_url),
+            )
+            LLM_CLIENT_POOL_SIZE.labels(provider="openai").set(
+                self.settings.LLM_MAX_POOL_CONNECTIONS
+            )
+
+        return self._clients["openai"]
+
+    def _async_openai_client(self) -> "AsyncOpenAI":
+        if "openai" not in self._async_clients:
+            import httpx
+            from openai import AsyncOpenAI
+
+            http_client = httpx.AsyncClient(
+                limits=self._limits(), event_hooks=self._event_hooks(atrace_upstream)
+            )
+            self._async_clients["openai"] = AsyncOpenAI(http_client=http_client)
+            self._warm_targets["async openai"] = (
+                http_client,
+                str(self._async_clients["openai"].base_url),
+            )
+
+        return self._async_clients["openai"]
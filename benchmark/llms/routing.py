@@ -0,0 +1,322 @@
+import logging
+import random
+import threading
+import time
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from opentelemetry import trace
+
+from benchmark.core.config import Settings
+from benchmark.llms.base import BaseLlm
+from benchmark.llms.exceptions import LlmException
+from benchmark.utils import LLM_BACKEND_CIRCUIT_STATE, LLM_ROUTING_DECISIONS
+
+
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = 0, 1, 2
+"""Circuit breaker states, also the values of `LLM_BACKEND_CIRCUIT_STATE`"""
+
+
+class Backend:
+    """One provider, model and region a story can be routed to, with its
+    rolling health stats and circuit breaker.
+
+    Latency and error rate are exponentially weighted moving averages. The
+    circuit opens when the error rate reaches `failure_threshold` after at
+    least `min_calls` calls, and stays open for `open_seconds`. Then a
+    single probe call is let through: the circuit closes if it succeeds and
+    opens again otherwise. A probe abandoned by the client says nothing
+    about the backend and lets the next call probe again.
+
+    Parameters
+    ----------
+    name : str
+        Unique name, used as a metric label, e.g. bedrock/us-west-2/<model>
+    llm : BaseLlm
+        Provider serving this backend
+    alpha : float
+        Weight of the latest call in the moving averages
+    failure_threshold : float
+        Error rate that opens the circuit
+    min_calls : int
+        Calls observed before the circuit can open
+    open_seconds : float
+        Seconds the circuit stays open before a probe
+    """
+
+    def __init__(
+        self,
+        name: str,
+        llm: BaseLlm,
+        alpha: float,
+        failure_threshold: float,
+        min_calls: int,
+        open_seconds: float,
+    ) -> None:
+        self.name = name
+        self.llm = llm
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.calls = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+        self._state_gauge = LLM_BACKEND_CIRCUIT_STATE.labels(backend=name)
+        self._state_gauge.set(CLOSED)
+
+    def try_acquire(self) -> bool:
+        """Whether a call can be sent, turning an expired open circuit into
+        a half-open one that lets this single call through"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and (
+                time.monotonic() - self.opened_at >= self.open_seconds
+            ):
+                self._set_state(HALF_OPEN)
+                return True
+            return False
+
+    def record_success(self, latency: Optional[float]) -> None:
+        with self._lock:
+            if latency is not None:
+                self.latency = (
+                    latency
+                    if self.latency is None
+                    else self.latency + self.alpha * (latency - self.latency)
+                )
+            self._record(failed=False)
+
+            if self.state == HALF_OPEN:
+                logger.info("Closing circuit of %s", self.name)
+                self.error_rate, self.calls = 0.0, 0
+                self._set_state(CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._record(failed=True)
+
+            if self.state == HALF_OPEN or (
+                self.state == CLOSED
+                and self.calls >= self.min_calls
+                and self.error_rate >= self.failure_threshold
+            ):
+                logger.warning(
+                    "Opening circuit of %s, error rate %.2f",
+                    self.name,
+                    self.error_rate,
+                )
+                self.opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+    def record_abandoned(self) -> None:
+        """Records a call interrupted by the client, e.g. a cancelled request
+        or an abandoned stream, which doesn't count in the stats"""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                # Back to open since `opened_at`, the next call probes again
+                self._set_state(OPEN)
+
+    def _record(self, failed: bool) -> None:
+        self.calls += 1
+        self.error_rate += self.alpha * (float(failed) - self.error_rate)
+
+    def _set_state(self, state: int) -> None:
+        self.state = state
+        self._state_gauge.set(state)
+
+
+class RoutedLlm(BaseLlm):
+    """Routes the stories of a model to the fastest healthy backend among a
+    group of equivalent ones (other regions or other models), and fails over
+    to the next one when a call fails.
+
+    Streams only fail over while nothing has been sent to the client yet.
+    The chosen backend and the reason are counted in `LLM_ROUTING_DECISIONS`
+    and set as attributes of the current span.
+
+    Parameters
+    ----------
+    model_id : str
+        The requested model
+    backends : List[Backend]
+        Equivalent backends, the ones serving `model_id` first
+    explore_rate : float
+        Probability of routing to a random healthy backend instead of the
+        fastest one, so the latency of the others stays fresh
+    """
+
+    def __init__(
+        self, model_id: str, backends: List[Backend], explore_rate: float
+    ) -> None:
+        super().__init__()
+        self.backends = backends
+        self.explore_rate = explore_rate
+        self.model_id = model_id
+        self.provider = backends[0].llm.provider
+        self.max_tokens = backends[0].llm.max_tokens
+
+    def get_story(self, topic: str) -> Dict[str, str]:
+        error: Optional[LlmException] = None
+        for backend in self._route():
+            start_time = time.perf_counter()
+            try:
+                data = backend.llm.get_story(topic=topic)
+            except LlmException as e:
+                backend.record_failure()
+                error = e
+                continue
+            except Exception:
+                backend.record_failure()
+                raise
+            except BaseException:
+                backend.record_abandoned()
+                raise
+
+            backend.record_success(time.perf_counter() - start_time)
+            return data
+
+        raise error
+
+    def stream_story(self, topic: str) -> Iterator[str]:
+        error: Optional[LlmException] = None
+        for backend in self._route():
+            stream = backend.llm.stream_story(topic=topic)
+            started = False
+            try:
+                for delta in stream:
+                    started = True
+                    yield delta
+            except LlmException as e:
+                backend.record_failure()
+                if started:
+                    raise
+                error = e
+                continue
+            except Exception:
+                backend.record_failure()
+                raise
+            except BaseException:
+                backend.record_abandoned()
+                raise
+            finally:
+                stream.close()
+
+            backend.record_success(None)
+            return
+
+        raise error
+
+    async def get_story_async(self, topic: str) -> Dict[str, str]:
+        error: Optional[LlmException] = None
+        for backend in self._route():
+            start_time = time.perf_counter()
+            try:
+                data = await backend.llm.get_story_async(topic=topic)
+            except LlmException as e:
+                backend.record_failure()
+                error = e
+                continue
+            except Exception:
+                backend.record_failure()
+                raise
+            except BaseException:
+                backend.record_abandoned()
+                raise
+
+            backend.record_success(time.perf_counter() - start_time)
+            return data
+
+        raise error
+
+    async def astream_story(self, topic: str) -> AsyncIterator[str]:
+        error: Optional[LlmException] = None
+        for backend in self._route():
+            stream = backend.llm.astream_story(topic=topic)
+            started = False
+            try:
+                async for delta in stream:
+                    started = True
+                    yield delta
+            except LlmException as e:
+                backend.record_failure()
+                if started:
+                    raise
+                error = e
+                continue
+            except Exception:
+                backend.record_failure()
+                raise
+            except BaseException:
+                backend.record_abandoned()
+                raise
+            finally:
+                await stream.aclose()
+
+            backend.record_success(None)
+            return
+
+        raise error
+
+    def _route(self) -> Iterator[Backend]:
+        """Yields the backends to try, in order, recording each decision"""
+        span = trace.get_current_span()
+        attempts = 0
+        for backend, reason in self._candidates():
+            if attempts and not backend.try_acquire():
+                continue
+
+            attempts += 1
+            LLM_ROUTING_DECISIONS.labels(
+                model=self.model_id, backend=backend.name, reason=reason
+            ).inc()
+            span.set_attribute("llm.routing.backend", backend.name)
+            span.set_attribute("llm.routing.reason", reason)
+            span.set_attribute("llm.routing.attempts", attempts)
+            if attempts > 1:
+                logger.warning("Failing over %s to %s", self.model_id, backend.name)
+
+            yield backend
+
+    def _candidates(self) -> Iterator[Tuple[Backend, str]]:
+        """Picks the first backend, acquiring it, then the failover order"""
+        by_latency = sorted(
+            self.backends, key=lambda b: -1.0 if b.latency is None else b.latency
+        )
+
+        first, reason = None, "fastest"
+        if random.random() < self.explore_rate:
+            healthy = [b for b in self.backends if b.state == CLOSED]
+            if healthy:
+                first, reason = random.choice(healthy), "explore"
+        if first is None:
+            first = next((b for b in by_latency if b.try_acquire()), None)
+        elif not first.try_acquire():
+            first = None
+        if first is None:
+            # Every circuit is open, try the one that has been open the longest
+            first = min(self.backends, key=lambda b: b.opened_at)
+            reason = "all_open"
+
+        yield first, reason
+        for backend in by_latency:
+            if backend is not first:
+                yield backend, "failover"
+
+
+def build_backend(settings: Settings, name: str, llm: BaseLlm) -> Backend:
+    """Creates the `Backend` named `name` configured by `settings`"""
+    return Backend(
+        name,
+        llm,
+        alpha=settings.ROUTING_EWMA_ALPHA,
+        failure_threshold=settings.ROUTING_FAILURE_THRESHOLD,
+        min_calls=settings.ROUTING_MIN_CALLS,
+        open_seconds=settings.ROUTING_OPEN_SECONDS,
+    )
@@ -0,0 +1,75 @@
+import time
+from typing import Any, Optional
+
+from benchmark.utils import (
+    INTER_TOKEN_LATENCY,
+    LLM_OUTPUT_TOKENS,
+    LLM_TOKENS_PER_SECOND,
+    TIME_TO_FIRST_BYTE,
+    TIME_TO_FULL_RESPONSE,
+    trace_exemplar,
+)
+
+
+class CallMetrics:
+    """Observes the latency and throughput metrics of one provider call.
+
+    Created right before the upstream request. Streams call `delta` for
+    every delta they yield, which observes the time to first byte and then
+    the inter-token latency. `finish` observes the time to full response
+    and, when the provider reported them, the output tokens and tokens per
+    second. The tokens per second of a stream only count the time after
+    its first delta, so they measure generation speed apart from queueing
+    and prompt processing.
+
+    Parameters
+    ----------
+    provider : str
+        Provider label
+    model : str
+        Model label
+    mode : str
+        Mode label, e.g. `write` or `streaming-async`
+    """
+
+    def __init__(self, provider: str, model: str, mode: str) -> None:
+        self.provider = provider
+        self.model = model
+        self.mode = mode
+        self.start_time = time.perf_counter()
+        self.first_delta_time: Optional[float] = None
+        self.last_delta_time = 0.0
+
+    def delta(self) -> None:
+        now = time.perf_counter()
+        if self.first_delta_time is None:
+            self.first_delta_time = now
+            self._labels(TIME_TO_FIRST_BYTE).observe(
+                now - self.start_time, trace_exemplar()
+            )
+        else:
+            self._labels(INTER_TOKEN_LATENCY).observe(
+                now - self.last_delta_time, trace_exemplar()
+            )
+        self.last_delta_time = now
+
+    def finish(self, output_tokens: Optional[int] = None) -> None:
+        now = time.perf_counter()
+        exemplar = trace_exemplar()
+
+        generation_start = self.first_delta_time
+        if generation_start is None:
+            # Not streamed, the first byte comes with the full response
+            generation_start = self.start_time
+            self._labels(TIME_TO_FIRST_BYTE).observe(now - self.start_time, exemplar)
+        self._labels(TIME_TO_FULL_RESPONSE).observe(now - self.start_time, exemplar)
+
+        if output_tokens:
+            self._labels(LLM_OUTPUT_TOKENS).inc(output_tokens)
+            if now > generation_start:
+                self._labels(LLM_TOKENS_PER_SECOND).observe(
+                    output_tokens / (now - generation_start), exemplar
+                )
+
+    def _labels(self, metric: Any) -> Any:
+        return metric.labels(provider=self.provider, model=self.model, mode=self.mode)
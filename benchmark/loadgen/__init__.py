@@ -0,0 +1,4 @@
+"""Load generator that replays a JSONL workload against the story endpoints.
+
+Run it with ``python -m benchmark.loadgen --help``.
+"""
@@ -0,0 +1,176 @@
+import argparse
+import asyncio
+import json
+import sys
+from typing import Any, Dict, List, Optional
+
+from benchmark.api.schemas import StorytellerModel
+from benchmark.loadgen.overhead import OVERHEAD_CONFIGS, process_cpu_seconds, serve
+from benchmark.loadgen.report import (
+    format_overhead,
+    format_server_timing,
+    format_table,
+    summarize,
+)
+from benchmark.loadgen.runner import LoadRunner, PhaseResult
+from benchmark.loadgen.workload import WorkItem, load_workload
+
+DEFAULT_ENDPOINTS = ["/write-story", "/write-story-async", "/stream-story"]
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmark.loadgen",
+        description="Replays a JSONL workload against the story endpoints.",
+    )
+    parser.add_argument("workload", help="JSONL file, one {'topic': ...} per line")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument(
+        "--endpoint",
+        dest="endpoints",
+        action="append",
+        help="Endpoint to load, repeatable (default: %s)"
+        % ", ".join(DEFAULT_ENDPOINTS),
+    )
+    parser.add_argument(
+        "--model",
+        dest="models",
+        action="append",
+        choices=[m.value for m in StorytellerModel],
+        help="Model for requests that don't pin one, repeatable (round-robin)",
+    )
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--concurrency",
+        type=int,
+        default=10,
+        help="Closed loop: requests kept in flight (default: 10)",
+    )
+    mode.add_argument(
+        "--rate",
+        type=float,
+        help="Open loop: requests started per second, regardless of responses",
+    )
+    parser.add_argument(
+        "--requests",
+        type=int,
+        default=100,
+        help="Requests sent to each endpoint (default: 100)",
+    )
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--json", dest="json_path", help="Also write results here")
+    parser.add_argument(
+        "--overhead",
+        action="store_true",
+        help="Start the API locally with tracing and metrics on and off, load "
+        "each setup the same way and report what they add per request",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8100,
+        help="Port of the API started by --overhead (default: 8100)",
+    )
+    return parser.parse_args(argv)
+
+
+async def run_phase(
+    runner: LoadRunner,
+    args: argparse.Namespace,
+    endpoint: str,
+    items: List[WorkItem],
+) -> Optional[PhaseResult]:
+    """Loads `endpoint` with the items that target it, None if there's none"""
+    endpoint_items = [i for i in items if i.endpoint in (None, endpoint)]
+    if not endpoint_items:
+        print(f"Skipping {endpoint}, no requests target it", file=sys.stderr)
+        return None
+
+    print(f"Loading {endpoint}...", file=sys.stderr)
+    if args.rate is not None:
+        return await runner.run_open_loop(
+            endpoint, endpoint_items, args.rate, args.requests
+        )
+    return await runner.run_closed_loop(
+        endpoint, endpoint_items, args.concurrency, args.requests
+    )
+
+
+def build_runner(args: argparse.Namespace, base_url: str) -> LoadRunner:
+    models = args.models or [StorytellerModel.GPT_4O_MINI.value]
+    return LoadRunner(base_url, models, args.timeout)
+
+
+async def run(args: argparse.Namespace) -> List[PhaseResult]:
+    items = load_workload(args.workload)
+    runner = build_runner(args, args.base_url)
+
+    phases = []
+    for endpoint in args.endpoints or DEFAULT_ENDPOINTS:
+        phase = await run_phase(runner, args, endpoint, items)
+        if phase is not None:
+            phases.append(phase)
+
+    return phases
+
+
+async def run_overhead_config(
+    args: argparse.Namespace, config: str, pid: int
+) -> List[Dict[str, Any]]:
+    """Loads the API started for `config`, measuring its CPU time per request"""
+    items = load_workload(args.workload)
+    runner = build_runner(args, f"http://127.0.0.1:{args.port}")
+
+    rows = []
+    for endpoint in args.endpoints or DEFAULT_ENDPOINTS:
+        cpu_before = process_cpu_seconds(pid)
+        phase = await run_phase(runner, args, endpoint, items)
+        cpu_after = process_cpu_seconds(pid)
+        if phase is None:
+            continue
+
+        cpu_per_request = None
+        if cpu_before is not None and cpu_after is not None:
+            cpu_per_request = (cpu_after - cpu_before) / len(phase.samples)
+        for row in summarize([phase]):
+            rows.append({"config": config, "cpu_per_request": cpu_per_request, **row})
+
+    return rows
+
+
+def run_overhead(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    rows = []
+    for config, env in OVERHEAD_CONFIGS.items():
+        print(f"Starting the API with {config}...", file=sys.stderr)
+        with serve(env, args.port) as process:
+            rows.extend(asyncio.run(run_overhead_config(args, config, process.pid)))
+
+    return rows
+
+
+def main(argv: List[str]) -> None:
+    args = parse_args(argv)
+    if args.overhead:
+        rows = run_overhead(args)
+        print(format_overhead(rows))
+        if args.json_path:
+            with open(args.json_path, "w", encoding="utf8") as f:
+                json.dump({"config": vars(args), "results": rows}, f, indent=2)
+        return
+
+    rows = summarize(asyncio.run(run(args)))
+
+    print(format_table(rows))
+
+    server_timing = format_server_timing(rows)
+    if server_timing is not None:
+        print("\nServer-Timing, mean ms per phase")
+        print(server_timing)
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf8") as f:
+            json.dump({"config": vars(args), "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
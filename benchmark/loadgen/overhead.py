@@ -0,0 +1,80 @@
+import os
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+import httpx
+
+OVERHEAD_CONFIGS: Dict[str, Dict[str, str]] = {
+    "baseline": {"TRACING_ENABLED": "false", "METRICS_ENABLED": "false"},
+    "metrics": {"TRACING_ENABLED": "false", "METRICS_ENABLED": "true"},
+    "tracing": {"TRACING_ENABLED": "true", "METRICS_ENABLED": "false"},
+    "tracing+metrics": {"TRACING_ENABLED": "true", "METRICS_ENABLED": "true"},
+}
+"""Server settings of each overhead run, the first one is the baseline"""
+
+
+def process_cpu_seconds(pid: int) -> Optional[float]:
+    """User and system CPU time used so far by process `pid`, None where
+    /proc isn't available"""
+    try:
+        with open(f"/proc/{pid}/stat", encoding="utf8") as f:
+            # The command name may hold spaces, the fields after it don't
+            fields = f.read().rpartition(")")[2].split()
+    except OSError:
+        return None
+
+    # utime and stime, fields 14 and 15 of the whole line
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+@contextmanager
+def serve(
+    env: Dict[str, str], port: int, startup_timeout: float = 60.0
+) -> Iterator[subprocess.Popen]:
+    """Runs the API in a single uvicorn process with `env` on top of the
+    current environment, until the `with` block exits
+
+    Raises
+    ------
+    RuntimeError
+        If the API doesn't answer /health within `startup_timeout` seconds
+    """
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "benchmark.main:app",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ],
+        env={**os.environ, **env},
+    )
+    try:
+        deadline = time.monotonic() + startup_timeout
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"API exited with {process.returncode}")
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/health").status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"API not ready after {startup_timeout}s")
+            time.sleep(0.2)
+
+        yield process
+
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
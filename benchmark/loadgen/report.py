@@ -0,0 +1,184 @@
+import math
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Sequence
+
+from benchmark.loadgen.runner import PhaseResult
+
+
+def percentile(values: Sequence[float], q: float) -> Optional[float]:
+    """Linear-interpolated percentile, `q` between 0 and 100"""
+    if not values:
+        return None
+
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(phases: List[PhaseResult]) -> List[Dict[str, Any]]:
+    """Aggregates samples per (endpoint, model)
+
+    Returns
+    -------
+    List[Dict[str, Any]]
+        One row per (endpoint, model) with latency and TTFB percentiles,
+        throughput, error rate and the mean and p99 milliseconds of every
+        phase reported in `Server-Timing`
+    """
+    rows = []
+    for phase in phases:
+        by_model = defaultdict(list)
+        for sample in phase.samples:
+            by_model[sample.model].append(sample)
+
+        for model, samples in sorted(by_model.items()):
+            ok = [s for s in samples if s.ok]
+            latencies = [s.latency for s in ok]
+            ttfbs = [s.ttfb for s in ok if s.ttfb is not None]
+            timings = defaultdict(list)
+            for s in ok:
+                for name, duration in (s.server_timing or {}).items():
+                    timings[name].append(duration)
+            errors = defaultdict(int)
+            for s in samples:
+                if not s.ok:
+                    errors[s.error or str(s.status_code)] += 1
+
+            rows.append(
+                {
+                    "endpoint": phase.endpoint,
+                    "model": model,
+                    "mode": phase.mode,
+                    "requests": len(samples),
+                    "errors": len(samples) - len(ok),
+                    "error_rate": (len(samples) - len(ok)) / len(samples),
+                    "error_types": dict(errors),
+                    "throughput_rps": len(ok) / phase.duration,
+                    "latency_mean": sum(latencies) / len(latencies) if ok else None,
+                    "latency_p50": percentile(latencies, 50),
+                    "latency_p90": percentile(latencies, 90),
+                    "latency_p99": percentile(latencies, 99),
+                    "ttfb_p50": percentile(ttfbs, 50),
+                    "ttfb_p90": percentile(ttfbs, 90),
+                    "ttfb_p99": percentile(ttfbs, 99),
+                    "server_timing": {
+                        name: {
+                            "mean": sum(values) / len(values),
+                            "p99": percentile(values, 99),
+                        }
+                        for name, values in timings.items()
+                    },
+                }
+            )
+
+    return rows
+
+
+COLUMNS = [
+    ("endpoint", "endpoint", "{}"),
+    ("model", "model", "{}"),
+    ("requests", "reqs", "{}"),
+    ("error_rate", "err%", "{:.1%}"),
+    ("throughput_rps", "rps", "{:.2f}"),
+    ("latency_p50", "p50", "{:.3f}"),
+    ("latency_p90", "p90", "{:.3f}"),
+    ("latency_p99", "p99", "{:.3f}"),
+    ("ttfb_p50", "ttfb p50", "{:.3f}"),
+    ("ttfb_p99", "ttfb p99", "{:.3f}"),
+]
+
+
+def _render(cells: List[List[str]]) -> str:
+    widths = [max(len(line[i]) for line in cells) for i in range(len(cells[0]))]
+    lines = ["  ".join(c.ljust(w) for c, w in zip(line, widths)) for line in cells]
+    lines.insert(1, "  ".join("-" * w for w in widths))
+    return "\n".join(lines)
+
+
+def format_table(rows: List[Dict[str, Any]]) -> str:
+    """Renders summary rows as a plain-text table, latencies in seconds"""
+    cells = [[title for _, title, _ in COLUMNS]]
+    for row in rows:
+        cells.append(
+            [
+                "-" if row[key] is None else fmt.format(row[key])
+                for key, _, fmt in COLUMNS
+            ]
+        )
+
+    return _render(cells)
+
+
+def format_server_timing(rows: List[Dict[str, Any]]) -> Optional[str]:
+    """Renders the mean milliseconds of each `Server-Timing` phase per row,
+    or None when the server didn't send any"""
+    names: List[str] = []
+    for row in rows:
+        names.extend(n for n in row["server_timing"] if n not in names)
+    if not names:
+        return None
+
+    cells = [["endpoint", "model"] + names]
+    for row in rows:
+        timings = row["server_timing"]
+        cells.append(
+            [row["endpoint"], row["model"]]
+            + [f"{timings[n]['mean']:.1f}" if n in timings else "-" for n in names]
+        )
+
+    return _render(cells)
+
+
+def _ms(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value * 1000:.2f}"
+
+
+def format_overhead(rows: List[Dict[str, Any]]) -> str:
+    """Renders the rows of an overhead run, each tagged with its `config`
+    and server `cpu_per_request`, next to what they add per request over
+    the rows of the first config"""
+    baseline = {
+        (r["endpoint"], r["model"]): r for r in rows if r["config"] == rows[0]["config"]
+    }
+
+    cells = [
+        [
+            "config",
+            "endpoint",
+            "model",
+            "rps",
+            "mean ms",
+            "p99 ms",
+            "cpu ms/req",
+            "+mean ms",
+            "+cpu ms/req",
+        ]
+    ]
+    for row in rows:
+        base = baseline.get((row["endpoint"], row["model"]))
+        added_latency = added_cpu = None
+        if base is not None and row is not base:
+            if row["latency_mean"] is not None and base["latency_mean"] is not None:
+                added_latency = row["latency_mean"] - base["latency_mean"]
+            if (
+                row["cpu_per_request"] is not None
+                and base["cpu_per_request"] is not None
+            ):
+                added_cpu = row["cpu_per_request"] - base["cpu_per_request"]
+
+        cells.append(
+            [
+                row["config"],
+                row["endpoint"],
+                row["model"],
+                f"{row['throughput_rps']:.2f}",
+                _ms(row["latency_mean"]),
+                _ms(row["latency_p99"]),
+                _ms(row["cpu_per_request"]),
+                _ms(added_latency),
+                _ms(added_cpu),
+            ]
+        )
+
+    return _render(cells)
@@ -0,0 +1,218 @@
+import asyncio
+import itertools
+import json
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional
+
+import httpx
+
+from benchmark.loadgen.workload import WorkItem
+
+STREAMING_ENDPOINTS = {"/stream-story", "/stream-story-async"}
+
+
+def parse_server_timing(value: str) -> Dict[str, float]:
+    """Parses a `Server-Timing` header into milliseconds per metric"""
+    timings = {}
+    for metric in value.split(","):
+        name, *params = (p.strip() for p in metric.split(";"))
+        for param in params:
+            key, _, duration = param.partition("=")
+            if name and key == "dur":
+                try:
+                    timings[name] = float(duration)
+                except ValueError:
+                    pass
+
+    return timings
+
+
+def parse_sse_error(frame: str) -> Optional[str]:
+    """Returns the error name of a server-sent `error` event, None for other
+    events. Streams fail with such an event once their response started."""
+    event, data = None, []
+    for line in frame.splitlines():
+        field, _, value = line.partition(":")
+        value = value[1:] if value.startswith(" ") else value
+        if field == "event":
+            event = value
+        elif field == "data":
+            data.append(value)
+
+    if event != "error":
+        return None
+    try:
+        return json.loads("\n".join(data))["error"]
+    except (ValueError, KeyError, TypeError):
+        return "StreamError"
+
+
+@dataclass
+class Sample:
+    """Outcome of a single request as seen by the client"""
+
+    endpoint: str
+    model: str
+    started_at: float
+    latency: float
+    ttfb: Optional[float]
+    status_code: Optional[int]
+    error: Optional[str] = None
+    server_timing: Optional[Dict[str, float]] = None
+    """Milliseconds per phase sent by the server, if it times requests"""
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.status_code == 200
+
+
+@dataclass
+class PhaseResult:
+    """All samples collected while loading one endpoint"""
+
+    endpoint: str
+    mode: str
+    duration: float
+    samples: List[Sample]
+
+
+class LoadRunner:
+    """Replays work items against one endpoint at a time.
+
+    Parameters
+    ----------
+    base_url : str
+        Base URL of the API under test
+    models : List[str]
+        Models assigned round-robin to work items that don't pin one
+    timeout : float
+        Per-request timeout, in seconds
+    """
+
+    def __init__(self, base_url: str, models: List[str], timeout: float) -> None:
+        self.base_url = base_url
+        self.models = models
+        self.timeout = timeout
+
+    async def run_closed_loop(
+        self,
+        endpoint: str,
+        items: List[WorkItem],
+        concurrency: int,
+        total: int,
+    ) -> PhaseResult:
+        """Keeps `concurrency` requests in flight until `total` are done"""
+        work = self._assign(endpoint, items)
+        remaining = itertools.count()
+        samples: List[Sample] = []
+
+        async with self._client(concurrency) as client:
+
+            async def user() -> None:
+                while next(remaining) < total:
+                    samples.append(await self._send(client, *next(work)))
+
+            start = time.perf_counter()
+            await asyncio.gather(*(user() for _ in range(concurrency)))
+            duration = time.perf_counter() - start
+
+        return PhaseResult(endpoint, "closed", duration, samples)
+
+    async def run_open_loop(
+        self,
+        endpoint: str,
+        items: List[WorkItem],
+        rate: float,
+        total: int,
+    ) -> PhaseResult:
+        """Starts requests at a fixed arrival rate, regardless of how many
+        are still in flight, until `total` were sent"""
+        work = self._assign(endpoint, items)
+        samples: List[Sample] = []
+        tasks = []
+
+        async with self._client(None) as client:
+
+            async def request(endpoint: str, model: str, topic: str) -> None:
+                samples.append(await self._send(client, endpoint, model, topic))
+
+            start = time.perf_counter()
+            for i in range(total):
+                delay = start + i / rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tasks.append(asyncio.ensure_future(request(*next(work))))
+
+            await asyncio.gather(*tasks)
+            duration = time.perf_counter() - start
+
+        return PhaseResult(endpoint, "open", duration, samples)
+
+    def _assign(self, endpoint: str, items: List[WorkItem]) -> Iterator[tuple]:
+        models = itertools.cycle(self.models)
+        for item in itertools.cycle(items):
+            yield endpoint, item.model or next(models), item.topic
+
+    def _client(self, concurrency: Optional[int]) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=self.timeout,
+            limits=httpx.Limits(
+                max_connections=concurrency, max_keepalive_connections=concurrency
+            ),
+        )
+
+    async def _send(
+        self, client: httpx.AsyncClient, endpoint: str, model: str, topic: str
+    ) -> Sample:
+        params = {"model": model, "topic": topic}
+        started_at = time.time()
+        start = time.perf_counter()
+        ttfb = None
+        status_code = None
+        server_timing = None
+        error = None
+
+        try:
+            async with client.stream("POST", endpoint, params=params) as response:
+                status_code = response.status_code
+                if "server-timing" in response.headers:
+                    server_timing = parse_server_timing(
+                        response.headers["server-timing"]
+                    )
+                if endpoint not in STREAMING_ENDPOINTS:
+                    ttfb = time.perf_counter() - start
+
+                buffer = ""
+                async for chunk in response.aiter_text():
+                    if ttfb is None and chunk:
+                        ttfb = time.perf_counter() - start
+                    if endpoint not in STREAMING_ENDPOINTS:
+                        continue
+
+                    *frames, buffer = (buffer + chunk).split("\n\n")
+                    for frame in frames:
+                        error = error or parse_sse_error(frame)
+
+        except httpx.HTTPError as e:
+            return Sample(
+                endpoint,
+                model,
+                started_at,
+                time.perf_counter() - start,
+                ttfb,
+                status_code,
+                error=type(e).__name__,
+            )
+
+        return Sample(
+            endpoint,
+            model,
+            started_at,
+            time.perf_counter() - start,
+            ttfb,
+            status_code,
+            error=error,
+            server_timing=server_timing,
+        )
@@ -0,0 +1,53 @@
+import json
+from dataclasses import dataclass
+from typing import List, Optional
+
+
+@dataclass(frozen=True)
+class WorkItem:
+    topic: str
+    model: Optional[str] = None
+    endpoint: Optional[str] = None
+
+
+def load_workload(path: str) -> List[WorkItem]:
+    """Reads a JSONL workload, one request per line.
+
+    Every line needs a `topic` (`title` is accepted as a fallback) and may pin
+    a `model` and an `endpoint`; unpinned fields are filled in from the
+    command line.
+
+    Parameters
+    ----------
+    path : str
+        Path of the JSONL file
+
+    Returns
+    -------
+    List[WorkItem]
+        The parsed requests, in file order
+    """
+    items = []
+    with open(path, encoding="utf8") as f:
+        for lineno, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+
+            record = json.loads(line)
+            topic = record.get("topic") or record.get("title")
+            if not topic:
+                raise ValueError(f"{path}:{lineno} has no 'topic' field")
+
+            items.append(
+                WorkItem(
+                    topic=topic,
+                    model=record.get("model"),
+                    endpoint=record.get("endpoint"),
+                )
+            )
+
+    if not items:
+        raise ValueError(f"{path} has no requests")
+
+    return items
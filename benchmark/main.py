@@ -1,19 +1,36 @@
-import boto3
+# First, so the startup breakdown includes the import of the application
+from benchmark.core.startup import import_providers, startup_timer
+
+import asyncio
 import logging
-import logging.config
 
 from importlib.metadata import version
 from contextlib import asynccontextmanager
 
+import anyio
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 
+from benchmark.api.data import router as data_router
+from benchmark.api.jobs import router as jobs_router
 from benchmark.api.endpoints import router
+from benchmark.api.errors import add_exception_handlers
 from benchmark.core.config import settings
 from benchmark.core.constants import PROJECT_NAME
-from benchmark.core.logging.dict_config import LOGGING_CONFIG
+from benchmark.core.executors import configure_default_thread_limiter
+from benchmark.core.logging.dict_config import configure_logging
+from benchmark.core.loop_monitor import LoopMonitor, TaskSpanMiddleware
+from benchmark.core.timing import ServerTimingMiddleware
+from benchmark.core.tracing import configure_tracing, instrument_app
+from benchmark.jobs.worker import build_job_queue
+from benchmark.llms.cache import build_story_cache
+from benchmark.api.schemas import StorytellerModel
+from benchmark.llms.registry import LlmRegistry
+from benchmark.storage.archive import build_story_archiver
+from benchmark.storage.dataset import build_dataset_cache
 from benchmark.utils import PrometheusMiddleware, metrics
 
-logging.config.dictConfig(LOGGING_CONFIG)
+configure_logging(settings)
 logger = logging.getLogger("benchmark")
 
 app_version = version("fastapi-async-benchmark")
@@ -33,17 +50,24 @@ async def lifespan(app: FastAPI):  # pylint: disable=redefined-outer-name
     -----
     More about lifespan events: [Lifespan](https://www.starlette.io/lifespan/)
     """
-    logger.info(f"Initializing API v{app_version}")
+    logger.info("Initializing API v%s", app_version)
+
+    # In the worker, the export thread and channel don't survive a fork.
+    # The provider flushes its spans at exit.
+    configure_tracing(settings)
 
-    logger.info(f"Connecting to S3 bucket: {settings.AWS_S3_BUCKET_NAME}")
+    logger.info("Connecting to S3 bucket: %s", settings.AWS_S3_BUCKET_NAME)
 
     try:
-        s3_client = boto3.client(
-            "s3",
-            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-            endpoint_url=settings.AWS_S3_ENDPOINT_URL,
-        )
+        with startup_timer.step("s3_client"):
+            import boto3
+
+            s3_client = boto3.client(
+                "s3",
+                aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+                aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+                endpoint_url=settings.AWS_S3_ENDPOINT_URL,
+            )
 
         # aioboto3_session = aioboto3.Session(
         #     aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
@@ -56,17 +80,97 @@ async def lifespan(app: FastAPI):  # pylint: disable=redefined-outer-name
     app.state.s3_client = s3_client
     # app.state.aioboto3_session = aioboto3_session
 
+    configure_default_thread_limiter(settings.ANYIO_THREADPOOL_SIZE)
+
+    if not settings.LAZY_PROVIDER_IMPORTS:
+        with startup_timer.step("provider_import"):
+            import_providers()
+
+    app.state.llm_registry = LlmRegistry(settings)
+    app.state.story_cache = build_story_cache(settings)
+    app.state.story_archiver = build_story_archiver(settings, s3_client)
+    if app.state.story_archiver is not None:
+        app.state.story_archiver.start()
+    app.state.job_queue = build_job_queue(
+        settings,
+        app.state.llm_registry,
+        app.state.story_cache,
+        app.state.story_archiver,
+    )
+    if app.state.job_queue is not None:
+        await app.state.job_queue.start()
+    app.state.dataset = build_dataset_cache(settings, s3_client)
+    if app.state.dataset is not None:
+        with startup_timer.step("dataset"):
+            await app.state.dataset.start()
+    app.state.batch_semaphore = asyncio.Semaphore(
+        settings.BATCH_PROCESS_MAX_CONCURRENCY
+    )
+
+    loop_monitor = None
+    if settings.LOOP_MONITOR_ENABLED:
+        loop_monitor = LoopMonitor(
+            settings.LOOP_MONITOR_INTERVAL, settings.LOOP_BLOCK_THRESHOLD
+        )
+        loop_monitor.start()
+
+    if settings.PREWARM_MODELS:
+        with startup_timer.step("prewarm"):
+            await app.state.llm_registry.prewarm(
+                [StorytellerModel(m) for m in settings.PREWARM_MODELS],
+                connections=settings.PREWARM_CONNECTIONS,
+                timeout=settings.PREWARM_TIMEOUT,
+            )
+
+    startup_timer.report(logger)
     logger.info("Done! App ready to accept requests...")
 
     yield
 
     logger.info("Shutting down application...")
 
+    if loop_monitor is not None:
+        await loop_monitor.stop()
 
-app = FastAPI(title=PROJECT_NAME, lifespan=lifespan, version=app_version)
+    if app.state.job_queue is not None:
+        await app.state.job_queue.aclose(settings.JOBS_SHUTDOWN_TIMEOUT)
+    await app.state.llm_registry.aclose()
+    app.state.story_cache.close()
+    if app.state.story_archiver is not None:
+        await anyio.to_thread.run_sync(
+            app.state.story_archiver.close, settings.ARCHIVE_CLOSE_TIMEOUT
+        )
+    if app.state.dataset is not None:
+        await app.state.dataset.aclose()
 
-app.add_middleware(PrometheusMiddleware, app_name="fastapi-service-sync")
 
-app.add_route("/metrics", metrics)
+app = FastAPI(
+    title=PROJECT_NAME,
+    lifespan=lifespan,
+    version=app_version,
+    default_response_class=ORJSONResponse,
+)
+
+if settings.METRICS_ENABLED:
+    app.add_middleware(PrometheusMiddleware, app_name="fastapi-service-sync")
+
+if settings.LOOP_MONITOR_ENABLED:
+    app.add_middleware(TaskSpanMiddleware)
+
+if settings.PHASE_TIMING_ENABLED:
+    app.add_middleware(
+        ServerTimingMiddleware, histograms=settings.PHASE_METRICS_ENABLED
+    )
+
+if settings.METRICS_ENABLED:
+    app.add_route("/metrics", metrics)
+
+instrument_app(app, settings)
+
+add_exception_handlers(app)
 
 app.include_router(router)
+app.include_router(data_router)
+app.include_router(jobs_router)
+
+startup_timer.record_unattributed("app_import")
@@ -0,0 +1,242 @@
+"""CPU cost of the request/response serialization paths, before and after the
+fast path (orjson responses, single validation and payload templates), and
+cost of logging on the request path, before and after queued logging.
+
+Run with ``python -m benchmark.microbench [--iterations N]``. Everything runs
+in-process with no network: story requests are driven straight through the
+ASGI interface of two minimal apps that only differ in the response path.
+Log calls are timed on the calling thread with wall time, as queued logging
+moves the work to another thread rather than removing it.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import tempfile
+import time
+from logging.handlers import QueueListener, RotatingFileHandler
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
+
+from benchmark.api.endpoints import story_response
+from benchmark.api.schemas import StoryResponse
+from benchmark.core.logging.dict_config import LOGGING_CONFIG
+from benchmark.core.logging.handlers import install_queue_handler
+from benchmark.llms.payload import TOPIC_PLACEHOLDER, PayloadTemplate
+
+TOPIC = "A tango dancing robot stranded on Mars"
+STORY = {"topic": TOPIC, "story": "Once upon a time on the red dust... " * 60}
+SYSTEM_PROMPT = (
+    "You are a sci-fi writer born in Argentina. Your goal is to write "
+    "a short story in no more than 3 paragraphs about a topic defined by the user"
+)
+
+
+def legacy_bedrock_body(topic: str) -> str:
+    return json.dumps(
+        {
+            "messages": [{"role": "user", "content": topic}],
+            "system": SYSTEM_PROMPT,
+            "max_tokens": 2000,
+            "temperature": 0.4,
+            "top_k": 250,
+            "top_p": 1,
+            "anthropic_version": "bedrock-2023-05-31",
+        }
+    )
+
+
+BEDROCK_TEMPLATE = PayloadTemplate(
+    {
+        "messages": [{"role": "user", "content": TOPIC_PLACEHOLDER}],
+        "system": SYSTEM_PROMPT,
+        "max_tokens": 2000,
+        "temperature": 0.4,
+        "top_k": 250,
+        "top_p": 1,
+        "anthropic_version": "bedrock-2023-05-31",
+    }
+)
+
+
+def build_apps() -> Dict[str, FastAPI]:
+    legacy = FastAPI()
+
+    @legacy.post("/write-story", response_model=StoryResponse)
+    async def legacy_write_story(topic: str):
+        return StoryResponse.model_validate(dict(STORY))
+
+    fast = FastAPI(default_response_class=ORJSONResponse)
+
+    @fast.post("/write-story", response_model=StoryResponse)
+    async def fast_write_story(topic: str):
+        return story_response(dict(STORY), None)
+
+    return {"before": legacy, "after": fast}
+
+
+async def call_asgi(app: FastAPI) -> None:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/write-story",
+        "raw_path": b"/write-story",
+        "query_string": b"topic=mars",
+        "headers": [(b"host", b"bench")],
+        "client": ("127.0.0.1", 1234),
+        "server": ("bench", 80),
+    }
+
+    async def receive() -> Dict[str, Any]:
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message: Dict[str, Any]) -> None:
+        pass
+
+    await app(scope, receive, send)
+
+
+def build_logger(
+    name: str, directory: Path, queue_size: Optional[int]
+) -> Tuple[logging.Logger, Optional[QueueListener]]:
+    """Returns a logger writing to a rotating file like the API's, behind a
+    queue when `queue_size` is set"""
+    handler = RotatingFileHandler(
+        directory / f"{name}.log", maxBytes=1024 * 1024 * 10, backupCount=1
+    )
+    handler.setLevel(logging.INFO)
+    handler.setFormatter(
+        logging.Formatter(LOGGING_CONFIG["formatters"]["basic"]["format"], style="{")
+    )
+
+    logger = logging.getLogger(f"microbench.{name}")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    logger.addHandler(handler)
+
+    listener = None
+    if queue_size is not None:
+        listener = install_queue_handler(logger, queue_size, filters=[])
+    return logger, listener
+
+
+def cpu_per_call(
+    fn: Callable[[], Any],
+    iterations: int,
+    clock: Callable[[], int] = time.process_time_ns,
+) -> float:
+    """Returns the CPU, or `clock`, microseconds per call of `fn`, after a
+    warm up"""
+    for _ in range(min(iterations // 10, 1000)):
+        fn()
+
+    start = clock()
+    for _ in range(iterations):
+        fn()
+    return (clock() - start) / iterations / 1e3
+
+
+def async_cpu_per_call(app: FastAPI, iterations: int) -> float:
+    async def run(n: int) -> None:
+        for _ in range(n):
+            await call_asgi(app)
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(run(min(iterations // 10, 1000)))
+        start = time.process_time_ns()
+        loop.run_until_complete(run(iterations))
+        return (time.process_time_ns() - start) / iterations / 1e3
+    finally:
+        loop.close()
+
+
+def logging_cases(iterations: int) -> List[Dict[str, Any]]:
+    with tempfile.TemporaryDirectory() as directory:
+        # Large enough for every record, so none is dropped
+        queue_size = iterations + 1000
+        sync_logger, _ = build_logger("sync", Path(directory), None)
+        queued_logger, listener = build_logger("queued", Path(directory), queue_size)
+
+        try:
+            # Before the queued case, whose listener writes in the background
+            return [
+                {
+                    "case": "disabled debug call",
+                    "before": cpu_per_call(
+                        lambda: sync_logger.debug(f"About to write: {TOPIC}"),
+                        iterations,
+                        clock=time.perf_counter_ns,
+                    ),
+                    "after": cpu_per_call(
+                        lambda: sync_logger.debug("About to write: %s", TOPIC),
+                        iterations,
+                        clock=time.perf_counter_ns,
+                    ),
+                },
+                {
+                    "case": "log record (file)",
+                    "before": cpu_per_call(
+                        lambda: sync_logger.info("Topic: %s", TOPIC),
+                        iterations,
+                        clock=time.perf_counter_ns,
+                    ),
+                    "after": cpu_per_call(
+                        lambda: queued_logger.info("Topic: %s", TOPIC),
+                        iterations,
+                        clock=time.perf_counter_ns,
+                    ),
+                },
+            ]
+        finally:
+            if listener is not None:
+                listener.stop()
+            for logger in (sync_logger, queued_logger):
+                for handler in list(logger.handlers):
+                    handler.close()
+                    logger.removeHandler(handler)
+
+
+def run(iterations: int) -> List[Dict[str, Any]]:
+    apps = build_apps()
+    return [
+        {
+            "case": "bedrock request body",
+            "before": cpu_per_call(lambda: legacy_bedrock_body(TOPIC), iterations),
+            "after": cpu_per_call(lambda: BEDROCK_TEMPLATE.render(TOPIC), iterations),
+        },
+        {
+            "case": "story response (ASGI)",
+            "before": async_cpu_per_call(apps["before"], iterations // 10),
+            "after": async_cpu_per_call(apps["after"], iterations // 10),
+        },
+        *logging_cases(iterations // 10),
+    ]
+
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmark.microbench",
+        description="Measures the cost per request of serialization and logging.",
+    )
+    parser.add_argument("--iterations", type=int, default=100_000)
+    args = parser.parse_args(argv)
+
+    print(f"{'case':<24}{'before (us)':>14}{'after (us)':>14}{'speedup':>10}")
+    for row in run(args.iterations):
+        print(
+            f"{row['case']:<24}{row['before']:>14.2f}{row['after']:>14.2f}"
+            f"{row['before'] / row['after']:>9.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
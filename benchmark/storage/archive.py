@@ -0,0 +1,402 @@
+import gzip
+import io
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timezone
+from queue import Empty, Full, Queue
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+import orjson
+from opentelemetry import trace
+
+from benchmark.core.config import Settings
+from benchmark.llms.base import BaseLlm
+from benchmark.utils import ARCHIVE_QUEUE_DEPTH, ARCHIVE_RECORDS, ARCHIVE_UPLOADS
+
+
+logger = logging.getLogger(__name__)
+
+MIN_PART_SIZE = 5 * 1024 * 1024
+"""Smallest part S3 accepts in a multipart upload, but for the last one"""
+
+_STOP = object()
+
+
+class _Batch:
+    """Records gzipped into memory as they arrive, and the multipart upload
+    of the batch once it outgrew a single part"""
+
+    def __init__(self, key: str) -> None:
+        self.key = key
+        self.started_at = time.monotonic()
+        self.records = 0
+        self.raw_bytes = 0
+        self.buffer = io.BytesIO()
+        self.gzip = gzip.GzipFile(fileobj=self.buffer, mode="wb")
+        self.upload_id: Optional[str] = None
+        self.parts: List[Dict[str, Any]] = []
+
+    def write(self, line: bytes) -> None:
+        self.gzip.write(line)
+        self.records += 1
+        self.raw_bytes += len(line)
+
+    def take(self) -> bytes:
+        """Returns the compressed bytes written so far and empties the buffer"""
+        data = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data
+
+
+class StoryArchiver:
+    """Write-behind archive of generated stories as gzipped JSON Lines on S3.
+
+    `submit` only puts the record on a bounded queue, so requests never wait
+    for S3. A background thread compresses records into a batch that is
+    uploaded once it holds `batch_bytes` of JSON or is `flush_interval`
+    seconds old. Batches that outgrow `part_size` once compressed are sent
+    as a multipart upload, part by part while they fill up, so memory stays
+    bounded by one part. Records are dropped, and counted, when the queue is
+    full or their upload fails.
+
+    Parameters
+    ----------
+    s3_client : Any
+        boto3 S3 client
+    bucket : str
+        Bucket of the archive
+    prefix : str
+        Key prefix of the archived batches
+    queue_size : int
+        Records waiting for the archive thread before new ones are dropped
+    batch_bytes : int
+        Uncompressed bytes that trigger an upload
+    flush_interval : float
+        Max seconds a record waits in a batch
+    part_size : int
+        Compressed bytes of each part of a multipart upload, at least 5 MiB
+    """
+
+    def __init__(
+        self,
+        s3_client: Any,
+        bucket: str,
+        prefix: str,
+        queue_size: int,
+        batch_bytes: int,
+        flush_interval: float,
+        part_size: int,
+    ) -> None:
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.batch_bytes = batch_bytes
+        self.flush_interval = flush_interval
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self._queue: Queue = Queue(maxsize=queue_size)
+        self._sequence = 0
+        self._source = f"{socket.gethostname()}-{os.getpid()}"
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._run, name="story-archiver", daemon=True
+        )
+        self._thread.start()
+        logger.info("Archiving stories to s3://%s/%s", self.bucket, self.prefix)
+
+    def submit(self, record: Dict[str, Any]) -> None:
+        """Queues `record` for the archive, never blocks"""
+        # Counted first, the archive thread may take it before put_nowait returns
+        ARCHIVE_QUEUE_DEPTH.inc()
+        try:
+            self._queue.put_nowait(record)
+        except Full:
+            ARCHIVE_QUEUE_DEPTH.dec()
+            ARCHIVE_RECORDS.labels(result="queue_full").inc()
+
+    def close(self, timeout: float) -> None:
+        """Uploads the queued records and stops the thread. Blocking, run it
+        in a thread.
+
+        Parameters
+        ----------
+        timeout : float
+            Max seconds to wait for the last uploads
+        """
+        if self._thread is None:
+            return
+
+        deadline = time.monotonic() + timeout
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except Full:
+            logger.warning("Archive queue still full on shutdown, records are lost")
+            return
+
+        self._thread.join(max(deadline - time.monotonic(), 0.0))
+        if self._thread.is_alive():
+            logger.warning("Archive uploads didn't finish in %.1fs", timeout)
+
+    def _run(self) -> None:
+        batch: Optional[_Batch] = None
+        while True:
+            timeout = None
+            if batch is not None:
+                timeout = max(
+                    batch.started_at + self.flush_interval - time.monotonic(), 0.0
+                )
+
+            try:
+                record = self._queue.get(timeout=timeout)
+            except Empty:
+                record = None
+
+            if record is _STOP:
+                if batch is not None:
+                    self._finish(batch)
+                return
+
+            if record is not None:
+                ARCHIVE_QUEUE_DEPTH.dec()
+                if batch is None:
+                    batch = _Batch(self._next_key())
+                batch.write(orjson.dumps(record) + b"\n")
+                if batch.buffer.tell() >= self.part_size and not self._upload_part(
+                    batch
+                ):
+                    batch = None
+
+            if batch is not None and (
+                batch.raw_bytes >= self.batch_bytes
+                or time.monotonic() - batch.started_at >= self.flush_interval
+            ):
+                self._finish(batch)
+                batch = None
+
+    def _next_key(self) -> str:
+        now = datetime.now(timezone.utc)
+        self._sequence += 1
+        return (
+            f"{self.prefix}/{now:%Y/%m/%d}/"
+            f"{now:%H%M%S}-{self._source}-{self._sequence:06d}.jsonl.gz"
+        )
+
+    def _upload_part(self, batch: _Batch) -> bool:
+        """Uploads the compressed bytes of `batch` as its next part. A failed
+        part loses the whole batch, as it can't be completed anymore."""
+        try:
+            if batch.upload_id is None:
+                batch.upload_id = self.s3_client.create_multipart_upload(
+                    Bucket=self.bucket, Key=batch.key, ContentType="application/gzip"
+                )["UploadId"]
+
+            number = len(batch.parts) + 1
+            response = self.s3_client.upload_part(
+                Bucket=self.bucket,
+                Key=batch.key,
+                UploadId=batch.upload_id,
+                PartNumber=number,
+                Body=batch.take(),
+            )
+            batch.parts.append({"PartNumber": number, "ETag": response["ETag"]})
+        except Exception:
+            self._fail(batch, "multipart")
+            return False
+
+        return True
+
+    def _finish(self, batch: _Batch) -> None:
+        """Uploads the rest of `batch`, completing its multipart upload"""
+        batch.gzip.close()
+        if batch.records == 0:
+            return
+
+        method = "put" if batch.upload_id is None else "multipart"
+        try:
+            if batch.upload_id is None:
+                self.s3_client.put_object(
+                    Bucket=self.bucket,
+                    Key=batch.key,
+                    Body=batch.take(),
+                    ContentType="application/gzip",
+                )
+            else:
+                if not self._upload_part(batch):
+                    return
+                self.s3_client.complete_multipart_upload(
+                    Bucket=self.bucket,
+                    Key=batch.key,
+                    UploadId=batch.upload_id,
+                    MultipartUpload={"Parts": batch.parts},
+                )
+        except Exception:
+            self._fail(batch, method)
+            return
+
+        ARCHIVE_UPLOADS.labels(method=method, result="success").inc()
+        ARCHIVE_RECORDS.labels(result="archived").inc(batch.records)
+        logger.debug(
+            "Archived %s stories to s3://%s/%s", batch.records, self.bucket, batch.key
+        )
+
+    def _fail(self, batch: _Batch, method: str) -> None:
+        logger.exception(
+            "Error archiving %s stories to s3://%s/%s",
+            batch.records,
+            self.bucket,
+            batch.key,
+        )
+        ARCHIVE_UPLOADS.labels(method=method, result="error").inc()
+        ARCHIVE_RECORDS.labels(result="upload_failed").inc(batch.records)
+        if batch.upload_id is not None:
+            try:
+                self.s3_client.abort_multipart_upload(
+                    Bucket=self.bucket, Key=batch.key, UploadId=batch.upload_id
+                )
+            except Exception as e:
+                logger.warning("Error aborting upload of %s: %s", batch.key, e)
+
+
+def story_record(
+    endpoint: str,
+    llm: BaseLlm,
+    story: Dict[str, str],
+    started_at: float,
+    cache_status: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Archive record of a story generated by `llm`, with its latency
+
+    Parameters
+    ----------
+    endpoint : str
+        Endpoint that served the story
+    llm : BaseLlm
+        Provider of the story
+    story : Dict[str, str]
+        The topic and story
+    started_at : float
+        `time.perf_counter` when the request started
+    cache_status : Optional[str]
+        Whether the story came from the cache, when caching is enabled
+    """
+    record: Dict[str, Any] = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+        "endpoint": endpoint,
+        "provider": llm.provider,
+        "model": llm.model_id,
+        "topic": story["topic"],
+        "story": story["story"],
+        "duration_ms": round((time.perf_counter() - started_at) * 1000, 3),
+        "cache_status": cache_status,
+    }
+
+    context = trace.get_current_span().get_span_context()
+    if context.is_valid:
+        record["trace_id"] = trace.format_trace_id(context.trace_id)
+    return record
+
+
+def archive_story(
+    archiver: Optional[StoryArchiver],
+    endpoint: str,
+    llm: BaseLlm,
+    story: Dict[str, str],
+    started_at: float,
+    cache_status: Optional[str] = None,
+) -> None:
+    """Submits the `story_record` of a story, when archiving is enabled"""
+    if archiver is not None:
+        archiver.submit(story_record(endpoint, llm, story, started_at, cache_status))
+
+
+def archived_stream(
+    stream: Iterator[str],
+    archiver: Optional[StoryArchiver],
+    endpoint: str,
+    llm: BaseLlm,
+    topic: str,
+    started_at: float,
+) -> Iterator[str]:
+    """Relays a story stream and archives the story once fully streamed.
+    Failed and abandoned streams aren't archived."""
+    if archiver is None:
+        return stream
+
+    return _archived_stream(stream, archiver, endpoint, llm, topic, started_at)
+
+
+def _archived_stream(
+    stream: Iterator[str],
+    archiver: StoryArchiver,
+    endpoint: str,
+    llm: BaseLlm,
+    topic: str,
+    started_at: float,
+) -> Iterator[str]:
+    deltas: List[str] = []
+    try:
+        for delta in stream:
+            deltas.append(delta)
+            yield delta
+    finally:
+        stream.close()
+
+    story = {"topic": topic, "story": "".join(deltas)}
+    archiver.submit(story_record(endpoint, llm, story, started_at))
+
+
+def aarchived_stream(
+    stream: AsyncIterator[str],
+    archiver: Optional[StoryArchiver],
+    endpoint: str,
+    llm: BaseLlm,
+    topic: str,
+    started_at: float,
+) -> AsyncIterator[str]:
+    """Async equivalent of `archived_stream`"""
+    if archiver is None:
+        return stream
+
+    return _aarchived_stream(stream, archiver, endpoint, llm, topic, started_at)
+
+
+async def _aarchived_stream(
+    stream: AsyncIterator[str],
+    archiver: StoryArchiver,
+    endpoint: str,
+    llm: BaseLlm,
+    topic: str,
+    started_at: float,
+) -> AsyncIterator[str]:
+    deltas: List[str] = []
+    try:
+        async for delta in stream:
+            deltas.append(delta)
+            yield delta
+    finally:
+        await stream.aclose()
+
+    story = {"topic": topic, "story": "".join(deltas)}
+    archiver.submit(story_record(endpoint, llm, story, started_at))
+
+
+def build_story_archiver(settings: Settings, s3_client: Any) -> Optional[StoryArchiver]:
+    """Creates the `StoryArchiver` configured by `settings`, None when
+    `ARCHIVE_ENABLED` is off"""
+    if not settings.ARCHIVE_ENABLED:
+        return None
+
+    return StoryArchiver(
+        s3_client,
+        bucket=settings.ARCHIVE_BUCKET_NAME or settings.AWS_S3_BUCKET_NAME,
+        prefix=settings.ARCHIVE_PREFIX,
+        queue_size=settings.ARCHIVE_QUEUE_SIZE,
+        batch_bytes=settings.ARCHIVE_BATCH_BYTES,
+        flush_interval=settings.ARCHIVE_FLUSH_INTERVAL,
+        part_size=settings.ARCHIVE_PART_SIZE,
+    )
@@ -0,0 +1,309 @@
+import asyncio
+import logging
+import mmap
+import os
+import re
+from array import array
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+import anyio
+import orjson
+
+from benchmark.core.config import Settings
+from benchmark.core.constants import S3_DATA_KEY
+from benchmark.utils import DATASET_REFRESHES, DATASET_SIZE
+
+
+logger = logging.getLogger(__name__)
+
+_JSON_TOKENS = re.compile(rb'[\[\]{}",\\]')
+"""Bytes that open or close strings and containers, or split array items"""
+
+NOT_MODIFIED_CODES = {"304", "NotModified"}
+"""Error codes of a conditional GET whose ETag still matches"""
+
+
+def index_records(data: Any) -> array:
+    """Returns the start and end offsets of every record in `data`.
+
+    Records are the items of a top-level JSON array or, when `data` doesn't
+    start with `[`, its non-empty lines, i.e. JSON Lines. Only the structure
+    is scanned, records are parsed when they are read.
+
+    Parameters
+    ----------
+    data : Any
+        Buffer with the dataset, e.g. a `mmap.mmap`
+
+    Returns
+    -------
+    array
+        Flat array of `start, end` offsets
+    """
+    offsets = array("Q")
+    size = len(data)
+    first = re.compile(rb"\S").search(data)
+    if first is None:
+        return offsets
+
+    if data[first.start() : first.start() + 1] != b"[":
+        start = 0
+        while start < size:
+            end = data.find(b"\n", start)
+            if end == -1:
+                end = size
+            if data[start:end].strip():
+                offsets.extend((start, end))
+            start = end + 1
+        return offsets
+
+    depth = 0
+    in_string = False
+    escaped = -1
+    boundary = 0
+    for match in _JSON_TOKENS.finditer(data, first.start()):
+        pos = match.start()
+        token = match.group()
+        if in_string:
+            if pos == escaped:
+                continue
+            if token == b"\\":
+                escaped = pos + 1
+            elif token == b'"':
+                in_string = False
+        elif token == b'"':
+            in_string = True
+        elif token in (b"[", b"{"):
+            depth += 1
+            if depth == 1:
+                boundary = pos + 1
+        elif token in (b"]", b"}"):
+            depth -= 1
+            if depth == 0:
+                if data[boundary:pos].strip():
+                    offsets.extend((boundary, pos))
+                break
+        elif token == b"," and depth == 1:
+            offsets.extend((boundary, pos))
+            boundary = pos + 1
+
+    return offsets
+
+
+def _field(record: Any, path: str) -> Any:
+    for name in path.split("."):
+        if not isinstance(record, dict):
+            return None
+        record = record.get(name)
+    return record
+
+
+def matches(record: Any, filters: Dict[str, str]) -> bool:
+    """Whether every `field=value` filter matches `record`. Fields can be
+    nested with dots, non-string values are compared in their JSON form."""
+    for path, expected in filters.items():
+        value = _field(record, path)
+        if isinstance(value, str):
+            if value != expected:
+                return False
+        elif value is None or orjson.dumps(value).decode("utf-8") != expected:
+            return False
+    return True
+
+
+class DatasetSnapshot:
+    """One version of the dataset, memory-mapped from the local cache.
+
+    Requests read slices of the mapping, so the file is paged in by the OS
+    as needed and never copied whole. A snapshot stays readable after a
+    newer version replaces its file, until the last request holding it is
+    done.
+
+    Parameters
+    ----------
+    path : str
+        Path of the cached file
+    etag : str
+        ETag of the S3 object
+    last_modified : Optional[str]
+        Last-Modified of the S3 object, as an HTTP date
+    """
+
+    def __init__(self, path: str, etag: str, last_modified: Optional[str]) -> None:
+        self.etag = etag
+        self.last_modified = last_modified
+        with open(path, "rb") as f:
+            self.size = os.fstat(f.fileno()).st_size
+            # Empty files can't be mapped
+            self.data: Any = (
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b""
+            )
+        self.offsets = index_records(self.data)
+
+    def __len__(self) -> int:
+        return len(self.offsets) // 2
+
+    def chunks(self, start: int, end: int, chunk_size: int) -> Iterator[bytes]:
+        """Yields the bytes from `start` to `end`, excluded, in chunks"""
+        for pos in range(start, end, chunk_size):
+            yield self.data[pos : min(pos + chunk_size, end)]
+
+    def record(self, index: int) -> bytes:
+        """Raw JSON of record `index`"""
+        return self.data[self.offsets[2 * index] : self.offsets[2 * index + 1]].strip()
+
+    def query(
+        self, filters: Dict[str, str], offset: int, limit: int
+    ) -> Iterator[bytes]:
+        """Yields the raw JSON of the records matching `filters`, skipping
+        the first `offset` matches and stopping after `limit`"""
+        if limit <= 0:
+            return
+
+        for index in range(len(self)):
+            raw = self.record(index)
+            if filters and not matches(orjson.loads(raw), filters):
+                continue
+            if offset > 0:
+                offset -= 1
+                continue
+
+            yield raw
+            limit -= 1
+            if limit == 0:
+                return
+
+
+class DatasetCache:
+    """Per-worker local copy of the S3 dataset, kept fresh in the background.
+
+    The object is downloaded once into `cache_dir` and memory-mapped, then
+    re-checked every `refresh_interval` seconds with a conditional GET on
+    its ETag, so an unchanged object costs a 304 and no transfer. Readers
+    take the current `DatasetSnapshot` and are never blocked by a refresh.
+    Failed refreshes are logged and the last version keeps being served.
+
+    Parameters
+    ----------
+    s3_client : Any
+        boto3 S3 client
+    bucket : str
+        Bucket holding the dataset
+    key : str
+        Key of the dataset object
+    cache_dir : str
+        Directory of the local copies, one file per worker
+    refresh_interval : float
+        Seconds between two freshness checks, 0 disables them
+    """
+
+    def __init__(
+        self,
+        s3_client: Any,
+        bucket: str,
+        key: str,
+        cache_dir: str,
+        refresh_interval: float,
+    ) -> None:
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.refresh_interval = refresh_interval
+        self.path = os.path.join(cache_dir, f"{key}.{os.getpid()}")
+        self.snapshot: Optional[DatasetSnapshot] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def refresh(self) -> bool:
+        """Downloads the object if it changed. Blocking, run it in a thread.
+
+        Returns
+        -------
+        bool
+            Whether a new version was loaded
+        """
+        from botocore.exceptions import ClientError
+
+        kwargs: Dict[str, Any] = {"Bucket": self.bucket, "Key": self.key}
+        if self.snapshot is not None:
+            kwargs["IfNoneMatch"] = self.snapshot.etag
+
+        try:
+            response = self.s3_client.get_object(**kwargs)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in NOT_MODIFIED_CODES:
+                DATASET_REFRESHES.labels(result="not_modified").inc()
+                return False
+            raise
+
+        etag, last_modified = self._download(response)
+        self.snapshot = DatasetSnapshot(self.path, etag, last_modified)
+        DATASET_REFRESHES.labels(result="updated").inc()
+        DATASET_SIZE.set(self.snapshot.size)
+        logger.info(
+            "Loaded s3://%s/%s (%s bytes, %s records, ETag %s)",
+            self.bucket,
+            self.key,
+            self.snapshot.size,
+            len(self.snapshot),
+            etag,
+        )
+        return True
+
+    async def start(self) -> None:
+        """Loads the dataset and starts the background refreshes"""
+        await self._refresh()
+        if self.refresh_interval > 0:
+            self._task = asyncio.get_running_loop().create_task(self._refresh_loop())
+
+    async def aclose(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+        # Open snapshots keep their mapping after the file is gone
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    async def _refresh(self) -> None:
+        try:
+            await anyio.to_thread.run_sync(self.refresh)
+        except Exception:
+            DATASET_REFRESHES.labels(result="error").inc()
+            logger.exception("Error refreshing s3://%s/%s", self.bucket, self.key)
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await self._refresh()
+
+    def _download(self, response: Dict[str, Any]) -> Tuple[str, Optional[str]]:
+        """Streams the body into a temporary file that replaces the cached
+        one, so mapped snapshots keep reading the previous version"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            for chunk in response["Body"].iter_chunks(1024 * 1024):
+                f.write(chunk)
+        os.replace(tmp_path, self.path)
+
+        last_modified = response.get("LastModified")
+        if last_modified is not None:
+            last_modified = last_modified.strftime("%a, %d %b %Y %H:%M:%S GMT")
+        return response["ETag"], last_modified
+
+
+def build_dataset_cache(settings: Settings, s3_client: Any) -> Optional[DatasetCache]:
+    """Creates the `DatasetCache` configured by `settings`, None when
+    `DATASET_ENABLED` is off"""
+    if not settings.DATASET_ENABLED:
+        return None
+
+    return DatasetCache(
+        s3_client,
+        bucket=settings.AWS_S3_BUCKET_NAME,
+        key=S3_DATA_KEY,
+        cache_dir=settings.DATASET_CACHE_DIR,
+        refresh_interval=settings.DATASET_REFRESH_INTERVAL,
+    )
@@ -1,26 +1,33 @@
 import threading
 import time
-from typing import Tuple
+from typing import Any, Callable, Dict, Optional, Tuple
 
+from opentelemetry import trace
 from prometheus_client import (
     REGISTRY,
     CONTENT_TYPE_LATEST,
     generate_latest,
+    CollectorRegistry,
     Counter,
     Gauge,
     Histogram,
 )
-from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
+from prometheus_client.multiprocess import MultiProcessCollector
+from prometheus_client.openmetrics import exposition as openmetrics
 from starlette.requests import Request
 from starlette.responses import Response
 from starlette.routing import Match
 from starlette.status import HTTP_500_INTERNAL_SERVER_ERROR
-from starlette.types import ASGIApp
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from benchmark.core.config import settings
+from benchmark.core.multiprocess import directory_lock
 
 INFO = Gauge(
     name="fastapi_app_info",
     documentation="FastAPI application information.",
     labelnames=["app_name"],
+    multiprocess_mode="livemax",
 )
 REQUESTS = Counter(
     name="fastapi_requests_total",
@@ -46,48 +53,351 @@ REQUESTS_IN_PROGRESS = Gauge(
     name="fastapi_requests_in_progress",
     documentation="Gauge of requests by method and path currently being processed",
     labelnames=["method", "path", "app_name"],
+    multiprocess_mode="livesum",
 )
 
 ACTIVE_THREADS = Gauge(
     name="fastapi_active_threads",
     documentation="Number of active threads in the FastAPI application.",
+    multiprocess_mode="livesum",
+)
+THREADPOOL_SIZE = Gauge(
+    name="threadpool_size",
+    documentation="Max worker threads of each pool",
+    labelnames=["pool"],
+    multiprocess_mode="livesum",
+)
+THREADPOOL_QUEUE_DEPTH = Gauge(
+    name="threadpool_queue_depth",
+    documentation="Tasks waiting for a worker thread of each pool",
+    labelnames=["pool"],
+    multiprocess_mode="livesum",
+)
+THREADPOOL_BUSY_WORKERS = Gauge(
+    name="threadpool_busy_workers",
+    documentation="Worker threads of each pool currently running a task",
+    labelnames=["pool"],
+    multiprocess_mode="livesum",
+)
+THREADPOOL_QUEUE_WAIT = Histogram(
+    name="threadpool_queue_wait_seconds",
+    documentation="Time tasks waited for a worker thread, excluding run time",
+    labelnames=["pool"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+THREADPOOL_RUN_TIME = Histogram(
+    name="threadpool_run_time_seconds",
+    documentation="Time tasks held a worker thread",
+    labelnames=["pool"],
+)
+EVENT_LOOP_LAG = Histogram(
+    name="event_loop_lag_seconds",
+    documentation="How late the event loop ran a task woken up by a timer",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+EVENT_LOOP_BLOCKS = Counter(
+    name="event_loop_blocks_total",
+    documentation="Times the event loop was blocked past the reporting threshold",
+)
+REQUEST_PHASE_DURATION = Histogram(
+    name="request_phase_duration_seconds",
+    documentation="Time requests spent in each phase, as sent in Server-Timing",
+    labelnames=["phase"],
+    buckets=(
+        0.0001,
+        0.0005,
+        0.001,
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1,
+        2.5,
+        5,
+        10,
+        30,
+    ),
+)
+DATASET_REFRESHES = Counter(
+    name="dataset_refreshes_total",
+    documentation="Freshness checks of the S3 dataset by result",
+    labelnames=["result"],
+)
+DATASET_SIZE = Gauge(
+    name="dataset_size_bytes",
+    documentation="Size of the locally cached S3 dataset",
+    multiprocess_mode="livemax",
+)
+ARCHIVE_QUEUE_DEPTH = Gauge(
+    name="story_archive_queue_depth",
+    documentation="Stories waiting to be archived",
+    multiprocess_mode="livesum",
+)
+ARCHIVE_RECORDS = Counter(
+    name="story_archive_records_total",
+    documentation="Stories archived, or dropped because the queue was full or the upload failed",
+    labelnames=["result"],
+)
+ARCHIVE_UPLOADS = Counter(
+    name="story_archive_uploads_total",
+    documentation="Archive batch uploads by method and result",
+    labelnames=["method", "result"],
+)
+JOBS = Counter(
+    name="story_jobs_total",
+    documentation="Story jobs finished by model and status (succeeded or failed)",
+    labelnames=["model", "status"],
+)
+JOBS_QUEUE_DEPTH = Gauge(
+    name="story_jobs_queue_depth",
+    documentation="Story jobs waiting for a job worker",
+    multiprocess_mode="livesum",
+)
+JOBS_QUEUE_WAIT = Histogram(
+    name="story_jobs_queue_wait_seconds",
+    documentation="Time story jobs waited for a job worker",
+)
+STARTUP_DURATION = Gauge(
+    name="startup_duration_seconds",
+    documentation="Time the worker spent in each startup step until it was ready",
+    labelnames=["step"],
+    multiprocess_mode="livemax",
+)
+LOG_RECORDS_DROPPED = Counter(
+    name="log_records_dropped_total",
+    documentation="Log records dropped by sampling, rate limiting or a full queue",
+    labelnames=["reason"],
 )
 TIME_TO_FULL_RESPONSE = Histogram(
     name="time_to_full_response_seconds",
     documentation="Time to get the full response",
     labelnames=["provider", "model", "mode"],
+    buckets=settings.FULL_RESPONSE_BUCKETS,
 )
 TIME_TO_FIRST_BYTE = Histogram(
     name="time_to_first_byte_seconds",
     documentation="Time to first byte for the response",
     labelnames=["provider", "model", "mode"],
+    buckets=settings.TTFB_BUCKETS,
+)
+INTER_TOKEN_LATENCY = Histogram(
+    name="llm_inter_token_latency_seconds",
+    documentation="Time between two deltas of a streamed response",
+    labelnames=["provider", "model", "mode"],
+    buckets=settings.INTER_TOKEN_BUCKETS,
+)
+LLM_OUTPUT_TOKENS = Counter(
+    name="llm_output_tokens_total",
+    documentation="Output tokens generated, as reported by the provider",
+    labelnames=["provider", "model", "mode"],
+)
+LLM_TOKENS_PER_SECOND = Histogram(
+    name="llm_output_tokens_per_second",
+    documentation=(
+        "Output tokens per second of generation, after the first delta for streams"
+    ),
+    labelnames=["provider", "model", "mode"],
+    buckets=settings.TOKENS_PER_SECOND_BUCKETS,
+)
+STORY_CACHE_REQUESTS = Counter(
+    name="story_cache_requests_total",
+    documentation="Story cache lookups by result (hit, miss or coalesced)",
+    labelnames=["model", "result"],
+)
+STREAMS_ABORTED = Counter(
+    name="llm_streams_aborted_total",
+    documentation="Streams whose client disconnected before the story was complete",
+    labelnames=["provider", "model"],
+)
+STREAM_TOKENS_SAVED = Counter(
+    name="llm_stream_tokens_saved_total",
+    documentation=(
+        "Estimated output tokens not generated because an aborted stream was "
+        "closed upstream (requested max tokens minus streamed deltas)"
+    ),
+    labelnames=["provider", "model"],
+)
+STREAM_FANOUT_SUBSCRIBERS = Counter(
+    name="llm_stream_fanout_subscribers_total",
+    documentation="Story streams that opened an upstream stream (owner) or joined one (subscriber)",
+    labelnames=["provider", "model", "role"],
+)
+STREAM_FANOUT_EVICTIONS = Counter(
+    name="llm_stream_fanout_evictions_total",
+    documentation="Subscribers dropped from a shared stream for falling too far behind",
+    labelnames=["provider", "model"],
+)
+LLM_CLIENT_POOL_SIZE = Gauge(
+    name="llm_client_pool_size",
+    documentation="Max connections of the pooled LLM provider clients.",
+    labelnames=["provider"],
+    multiprocess_mode="livesum",
+)
+LLM_CLIENT_POOL_IN_USE = Gauge(
+    name="llm_client_pool_in_use",
+    documentation="Upstream LLM calls currently holding a pooled connection.",
+    labelnames=["provider", "model"],
+    multiprocess_mode="livesum",
+)
+LIMITER_LIMIT = Gauge(
+    name="llm_limiter_limit",
+    documentation="Current adaptive concurrency limit of each provider model",
+    labelnames=["provider", "model"],
+    multiprocess_mode="livesum",
+)
+LIMITER_IN_FLIGHT = Gauge(
+    name="llm_limiter_in_flight",
+    documentation="Upstream LLM calls currently admitted by the limiter",
+    labelnames=["provider", "model"],
+    multiprocess_mode="livesum",
+)
+LIMITER_QUEUE_DEPTH = Gauge(
+    name="llm_limiter_queue_depth",
+    documentation="Calls waiting for a slot of the limiter",
+    labelnames=["provider", "model"],
+    multiprocess_mode="livesum",
+)
+LIMITER_REJECTIONS = Counter(
+    name="llm_limiter_rejections_total",
+    documentation="Calls shed by the limiter (queue_full or queue_timeout)",
+    labelnames=["provider", "model", "reason"],
+)
+HEDGES_FIRED = Counter(
+    name="llm_hedges_fired_total",
+    documentation="Extra upstream calls started because a call ran past the threshold",
+    labelnames=["provider", "model"],
+)
+HEDGES_WON = Counter(
+    name="llm_hedges_won_total",
+    documentation="Hedged calls whose hedge answered before the original call",
+    labelnames=["provider", "model"],
+)
+LLM_ROUTING_DECISIONS = Counter(
+    name="llm_routing_decisions_total",
+    documentation=(
+        "Backends chosen for a requested model, by reason "
+        "(fastest, explore, failover or all_open)"
+    ),
+    labelnames=["model", "backend", "reason"],
 )
+LLM_BACKEND_CIRCUIT_STATE = Gauge(
+    name="llm_backend_circuit_state",
+    documentation="Circuit breaker state of each backend (0 closed, 1 open, 2 half-open)",
+    labelnames=["backend"],
+    multiprocess_mode="livemax",
+)
+
+
+def trace_exemplar() -> Optional[Dict[str, str]]:
+    """Returns the ids of the current span as an exemplar, when
+    `METRICS_EXEMPLARS_ENABLED` and the span is sampled"""
+    if not settings.METRICS_EXEMPLARS_ENABLED:
+        return None
+
+    context = trace.get_current_span().get_span_context()
+    if not context.is_valid or not context.trace_flags.sampled:
+        return None
+
+    return {
+        "trace_id": trace.format_trace_id(context.trace_id),
+        "span_id": trace.format_span_id(context.span_id),
+    }
 
 
-class PrometheusMiddleware(BaseHTTPMiddleware):
+class _RouteMetrics:
+    """Labelled metric children for one (method, path template) pair, bound
+    once and reused by every request to that route"""
+
+    def __init__(self, method: str, path: str, app_name: str) -> None:
+        self.method = method
+        self.path = path
+        self.app_name = app_name
+        self.requests = REQUESTS.labels(method=method, path=path, app_name=app_name)
+        self.in_progress = REQUESTS_IN_PROGRESS.labels(
+            method=method, path=path, app_name=app_name
+        )
+        self.processing_time = REQUESTS_PROCESSING_TIME.labels(
+            method=method, path=path, app_name=app_name
+        )
+        self._responses: Dict[int, Any] = {}
+
+    def responses(self, status_code: int) -> Any:
+        child = self._responses.get(status_code)
+        if child is None:
+            child = RESPONSES.labels(
+                method=self.method,
+                path=self.path,
+                status_code=status_code,
+                app_name=self.app_name,
+            )
+            self._responses[status_code] = child
+
+        return child
+
+
+class PrometheusMiddleware:
+    """Pure ASGI middleware that exports request metrics.
+
+    Requests are labelled with the path template of the route that handles
+    them, the one the router then stores as `scope["route"]`, and requests
+    no route handles aren't tracked. The labelled metric children are bound
+    once per (method, path template). Processing time is measured until the
+    last body chunk is sent, so it covers the whole stream for streaming
+    responses.
+    """
+
     def __init__(self, app: ASGIApp, app_name: str) -> None:
-        super().__init__(app)
+        self.app = app
         self.app_name = app_name
         INFO.labels(app_name=self.app_name).inc()
+        self._static_paths: Dict[Tuple[str, str], str] = {}
+        self._metrics: Dict[Tuple[str, str], _RouteMetrics] = {}
 
-    async def dispatch(
-        self, request: Request, call_next: RequestResponseEndpoint
-    ) -> Response:
-        method = request.method
-        path, is_handled_path = self.get_path(request)
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
 
-        if not is_handled_path:
-            return await call_next(request)
+        method = scope["method"]
+        path = self.get_path(scope)
 
-        REQUESTS_IN_PROGRESS.labels(
-            method=method, path=path, app_name=self.app_name
-        ).inc()
-        REQUESTS.labels(method=method, path=path, app_name=self.app_name).inc()
+        if path is None:
+            await self.app(scope, receive, send)
+            return
+
+        metrics = self._metrics.get((method, path))
+        if metrics is None:
+            metrics = _RouteMetrics(method, path, self.app_name)
+            self._metrics[(method, path)] = metrics
+
+        metrics.in_progress.inc()
+        metrics.requests.inc()
+        status_code = HTTP_500_INTERNAL_SERVER_ERROR
+        response_started = False
+        observed = False
         before_time = time.perf_counter()
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code, response_started, observed
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                response_started = True
+            elif message["type"] == "http.response.body" and not message.get(
+                "more_body", False
+            ):
+                metrics.processing_time.observe(time.perf_counter() - before_time)
+                observed = True
+
+            await send(message)
+
         try:
-            response = await call_next(request)
+            await self.app(scope, receive, send_wrapper)
         except BaseException as e:
-            status_code = HTTP_500_INTERNAL_SERVER_ERROR
+            if not response_started:
+                status_code = HTTP_500_INTERNAL_SERVER_ERROR
             EXCEPTIONS.labels(
                 method=method,
                 path=path,
@@ -96,37 +406,86 @@ class PrometheusMiddleware(BaseHTTPMiddleware):
             ).inc()
             raise e from None
         else:
-            status_code = response.status_code
-            after_time = time.perf_counter()
-
-            REQUESTS_PROCESSING_TIME.labels(
-                method=method, path=path, app_name=self.app_name
-            ).observe(after_time - before_time)
+            if not observed:
+                # The client went away before the last body chunk
+                metrics.processing_time.observe(time.perf_counter() - before_time)
         finally:
-            RESPONSES.labels(
-                method=method,
-                path=path,
-                status_code=status_code,
-                app_name=self.app_name,
-            ).inc()
-            REQUESTS_IN_PROGRESS.labels(
-                method=method, path=path, app_name=self.app_name
-            ).dec()
+            metrics.responses(status_code).inc()
+            metrics.in_progress.dec()
+
+    def get_path(self, scope: Scope) -> Optional[str]:
+        """Returns the path template of the route that will handle the
+        request, None when no route fully matches it.
 
-        return response
+        The router only sets `scope["route"]` once the app is running, after
+        the in-progress gauge needs its labels, so routes are matched here
+        the same way. Paths of routes without parameters are cached, which
+        keeps the cache as small as the app.
+        """
+        key = (scope["method"], scope["path"])
+        path = self._static_paths.get(key)
+        if path is not None:
+            return path
 
-    @staticmethod
-    def get_path(request: Request) -> Tuple[str, bool]:
-        for route in request.app.routes:
-            match, _ = route.matches(request.scope)
+        for route in scope["app"].routes:
+            match, child_scope = route.matches(scope)
             if match == Match.FULL:
-                return route.path, True
+                if not child_scope.get("path_params"):
+                    self._static_paths[key] = route.path
+                return route.path
+
+        return None
+
 
-        return request.url.path, False
+class _ScrapeCache:
+    """Aggregates the metrics of every gunicorn worker and caches the output
+    for a short time, so concurrent or repeated scrapes read the mmap files
+    at most once per `ttl` seconds"""
+
+    def __init__(self, path: str, ttl: float) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.registry = CollectorRegistry()
+        MultiProcessCollector(self.registry, path=path)
+        self._lock = threading.Lock()
+        self._payloads: Dict[Callable, Tuple[float, bytes]] = {}
+
+    def get(self, generate: Callable[[CollectorRegistry], bytes]) -> bytes:
+        """Returns the cached output of `generate`, one of the exposition
+        formats' `generate_latest`"""
+        with self._lock:
+            now = time.monotonic()
+            expires_at, payload = self._payloads.get(generate, (0.0, b""))
+            if now >= expires_at:
+                with directory_lock(self.path, shared=True):
+                    payload = generate(self.registry)
+                self._payloads[generate] = (now + self.ttl, payload)
+
+            return payload
+
+
+_scrape_cache: Optional[_ScrapeCache] = None
 
 
 def metrics(request: Request) -> Response:
+    global _scrape_cache
+
     ACTIVE_THREADS.set(threading.active_count())
-    return Response(
-        generate_latest(REGISTRY), headers={"Content-Type": CONTENT_TYPE_LATEST}
-    )
+
+    # Exemplars are only part of the OpenMetrics format
+    generate, content_type = generate_latest, CONTENT_TYPE_LATEST
+    if "application/openmetrics-text" in request.headers.get("accept", ""):
+        generate = openmetrics.generate_latest
+        content_type = openmetrics.CONTENT_TYPE_LATEST
+
+    if settings.PROMETHEUS_MULTIPROC_DIR is None:
+        payload = generate(REGISTRY)
+    else:
+        if _scrape_cache is None:
+            _scrape_cache = _ScrapeCache(
+                settings.PROMETHEUS_MULTIPROC_DIR,
+                settings.METRICS_SCRAPE_CACHE_SECONDS,
+            )
+        payload = _scrape_cache.get(generate)
+
+    return Response(payload, headers={"Content-Type": content_type})
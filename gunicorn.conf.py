@@ -1,6 +1,35 @@
 import os
 import signal
 
+from benchmark.core.multiprocess import compact_dead_worker, reset_directory
+from benchmark.core.startup import import_providers, startup_timer
+
+prometheus_multiproc_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+# Reset as soon as the config is read, not in `on_starting`: a preloaded app
+# creates its metric files in the directory before that hook runs.
+if prometheus_multiproc_dir:
+    reset_directory(prometheus_multiproc_dir)
+
+# Imports the app, and with it the provider SDKs, once in the master so
+# workers start from a copy-on-write copy instead of importing it themselves.
+# Clients are still created by each worker, in the lifespan.
+preload_app = os.environ.get("GUNICORN_PRELOAD_APP", "false").lower() == "true"
+
+
+def when_ready(server):
+    if server.cfg.preload_app:
+        import_providers()
+
+
+def post_fork(server, worker):
+    startup_timer.reset()
+
+
+def child_exit(server, worker):
+    if prometheus_multiproc_dir:
+        compact_dead_worker(prometheus_multiproc_dir, worker.pid)
+
 
 def worker_int(worker):
     os.kill(worker.pid, signal.SIGINT)
@@ -0,0 +1,11 @@
+import os
+
+# Required settings, so the modules under test can be imported without a
+# configured environment
+for name in (
+    "AWS_ACCESS_KEY_ID",
+    "AWS_SECRET_ACCESS_KEY",
+    "AWS_DEFAULT_REGION",
+    "AWS_S3_BUCKET_NAME",
+):
+    os.environ.setdefault(name, "test")
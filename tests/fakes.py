@@ -0,0 +1,46 @@
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+
+from benchmark.llms.base import BaseLlm
+
+
+class FakeLlm(BaseLlm):
+    """Returns `deltas` as the story, or raises `error` after `fail_after`
+    deltas when set"""
+
+    def __init__(
+        self,
+        model_id: str = "fake",
+        deltas: Optional[List[str]] = None,
+        error: Optional[Exception] = None,
+        fail_after: int = 0,
+    ) -> None:
+        self.provider = "fake"
+        self.model_id = model_id
+        self.deltas = deltas if deltas is not None else ["once ", "upon ", "a time"]
+        self.error = error
+        self.fail_after = fail_after
+        self.calls = 0
+        self.closed = 0
+
+    def get_story(self, topic: str) -> Dict[str, str]:
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return {"topic": topic, "story": "".join(self.deltas)}
+
+    def stream_story(self, topic: str) -> Iterator[str]:
+        self.calls += 1
+        try:
+            for i, delta in enumerate(self.deltas):
+                if self.error is not None and i == self.fail_after:
+                    raise self.error
+                yield delta
+        finally:
+            self.closed += 1
+
+    async def get_story_async(self, topic: str) -> Dict[str, str]:
+        return self.get_story(topic)
+
+    async def astream_story(self, topic: str) -> AsyncIterator[str]:
+        for delta in self.stream_story(topic):
+            yield delta
@@ -0,0 +1,171 @@
+import asyncio
+import gzip
+import json
+import os
+import time
+
+from benchmark.storage import archive
+from benchmark.storage.archive import StoryArchiver, aarchived_stream, archived_stream
+from tests.fakes import FakeLlm
+
+
+class FakeS3:
+    def __init__(self, fail_parts: bool = False) -> None:
+        self.fail_parts = fail_parts
+        self.objects = {}
+        self.parts = {}
+        self.aborted = []
+        self.completed = []
+
+    def put_object(self, Bucket, Key, Body, ContentType):
+        self.objects[Key] = Body
+
+    def create_multipart_upload(self, Bucket, Key, ContentType):
+        self.parts[Key] = []
+        return {"UploadId": Key}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        if self.fail_parts:
+            raise RuntimeError("S3 is down")
+        self.parts[Key].append(Body)
+        return {"ETag": str(PartNumber)}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        assert len(MultipartUpload["Parts"]) == len(self.parts[Key])
+        self.objects[Key] = b"".join(self.parts.pop(Key))
+        self.completed.append(Key)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.aborted.append(Key)
+
+
+def make_archiver(s3, **kwargs) -> StoryArchiver:
+    options = dict(
+        bucket="bucket",
+        prefix="/stories/",
+        queue_size=100,
+        batch_bytes=1024 * 1024,
+        flush_interval=60,
+        part_size=0,
+    )
+    options.update(kwargs)
+    return StoryArchiver(s3, **options)
+
+
+def archived_records(s3):
+    return [
+        json.loads(line)
+        for body in s3.objects.values()
+        for line in gzip.decompress(body).splitlines()
+    ]
+
+
+def test_records_are_uploaded_on_close():
+    s3 = FakeS3()
+    archiver = make_archiver(s3)
+    archiver.start()
+    for i in range(3):
+        archiver.submit({"index": i})
+
+    archiver.close(timeout=5)
+
+    assert [r["index"] for r in archived_records(s3)] == [0, 1, 2]
+    (key,) = s3.objects
+    assert key.startswith("stories/") and key.endswith(".jsonl.gz")
+
+
+def test_batches_are_uploaded_once_full():
+    s3 = FakeS3()
+    archiver = make_archiver(s3, batch_bytes=20)
+    archiver.start()
+    for i in range(4):
+        archiver.submit({"story": "x" * 10})
+
+    deadline = time.monotonic() + 5
+    while len(s3.objects) < 4 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    archiver.close(timeout=5)
+
+    assert len(s3.objects) == 4
+
+
+def submit_random_stories(archiver: StoryArchiver, count: int) -> None:
+    # Random, so they don't compress below a part
+    for i in range(count):
+        archiver.submit({"index": i, "story": os.urandom(1024).hex()})
+
+
+def test_large_batches_use_multipart_uploads(monkeypatch):
+    monkeypatch.setattr(archive, "MIN_PART_SIZE", 4096)
+    s3 = FakeS3()
+    archiver = make_archiver(s3, part_size=4096)
+    archiver.start()
+    submit_random_stories(archiver, 50)
+
+    archiver.close(timeout=5)
+
+    assert [r["index"] for r in archived_records(s3)] == list(range(50))
+    assert len(s3.completed) == 1
+    assert not s3.parts
+
+
+def test_failed_part_aborts_the_upload(monkeypatch):
+    monkeypatch.setattr(archive, "MIN_PART_SIZE", 4096)
+    s3 = FakeS3(fail_parts=True)
+    archiver = make_archiver(s3, part_size=4096)
+    archiver.start()
+    submit_random_stories(archiver, 50)
+
+    archiver.close(timeout=5)
+
+    # Failed batches are lost, the last one was small enough for a put
+    assert s3.aborted
+    indexes = [r["index"] for r in archived_records(s3)]
+    assert len(indexes) < 50
+    assert indexes == list(range(50 - len(indexes), 50))
+
+
+def test_full_queue_drops_records():
+    archiver = make_archiver(FakeS3(), queue_size=1)
+
+    archiver.submit({"index": 0})
+    archiver.submit({"index": 1})
+
+    assert archiver._queue.qsize() == 1
+
+
+def test_streams_are_archived_once_complete():
+    s3 = FakeS3()
+    archiver = make_archiver(s3)
+    archiver.start()
+    llm = FakeLlm()
+
+    story = list(
+        archived_stream(
+            llm.stream_story("cats"), archiver, "stream-story", llm, "cats", 0.0
+        )
+    )
+
+    async def consume():
+        stream = aarchived_stream(
+            llm.astream_story("dogs"), archiver, "stream-story-async", llm, "dogs", 0.0
+        )
+        return [delta async for delta in stream]
+
+    assert asyncio.run(consume()) == story
+
+    # Abandoned streams aren't archived
+    abandoned = archived_stream(
+        llm.stream_story("owls"), archiver, "stream-story", llm, "owls", 0.0
+    )
+    next(abandoned)
+    abandoned.close()
+
+    archiver.close(timeout=5)
+
+    records = archived_records(s3)
+    assert [(r["endpoint"], r["topic"]) for r in records] == [
+        ("stream-story", "cats"),
+        ("stream-story-async", "dogs"),
+    ]
+    assert all(r["story"] == "once upon a time" for r in records)
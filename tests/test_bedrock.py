@@ -0,0 +1,53 @@
+import orjson
+
+from benchmark.llms.bedrock import ClaudeBedrockLlm
+
+
+def event(chunk):
+    return {"chunk": {"bytes": orjson.dumps(chunk)}}
+
+
+class FakeEventStream:
+    def __init__(self, deltas) -> None:
+        self.closed = False
+        self._events = [
+            event({"type": "content_block_delta", "delta": {"text": delta}})
+            for delta in deltas
+        ]
+
+    def __iter__(self):
+        return iter(self._events)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeClient:
+    def __init__(self, stream: FakeEventStream) -> None:
+        self.stream = stream
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        return {"body": self.stream}
+
+
+def make_llm(stream: FakeEventStream) -> ClaudeBedrockLlm:
+    return ClaudeBedrockLlm(
+        "anthropic.claude-3-haiku", client=FakeClient(stream), async_client=object()
+    )
+
+
+def test_stream_is_closed_when_done():
+    stream = FakeEventStream(["once ", "upon ", "a time"])
+
+    assert "".join(make_llm(stream).stream_story("cats")) == "once upon a time"
+    assert stream.closed
+
+
+def test_stream_is_closed_when_abandoned():
+    stream = FakeEventStream(["once ", "upon ", "a time"])
+    deltas = make_llm(stream).stream_story("cats")
+    assert next(deltas) == "once "
+
+    deltas.close()
+
+    assert stream.closed
@@ -0,0 +1,76 @@
+import asyncio
+
+from benchmark.llms.cache import (
+    COALESCED,
+    HIT,
+    MISS,
+    DiskCacheBackend,
+    MemoryCacheBackend,
+    StoryCache,
+)
+from tests.fakes import FakeLlm
+
+
+def story(text: str):
+    return {"topic": "t", "story": text}
+
+
+def keys(backend: DiskCacheBackend):
+    return [k for (k,) in backend._conn.execute("SELECT key FROM stories ORDER BY key")]
+
+
+def test_disk_backend_evicts_least_recently_used(tmp_path):
+    backend = DiskCacheBackend(str(tmp_path / "c.sqlite3"), ttl=60, max_entries=3)
+    for key in ("a", "b", "c"):
+        backend.set(key, story(key))
+    assert backend.get("a") == story("a")
+
+    backend.set("d", story("d"))
+
+    assert keys(backend) == ["a", "c", "d"]
+    backend.close()
+
+
+def test_disk_backend_expires_entries(tmp_path):
+    backend = DiskCacheBackend(str(tmp_path / "c.sqlite3"), ttl=-1, max_entries=3)
+    backend.set("a", story("a"))
+
+    assert backend.get("a") is None
+    backend.close()
+
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryCacheBackend(ttl=60, max_entries=2)
+    backend.set("a", story("a"))
+    backend.set("b", story("b"))
+    backend.get("a")
+    backend.set("c", story("c"))
+
+    assert backend.get("b") is None
+    assert backend.get("a") == story("a")
+
+
+def test_async_misses_are_coalesced(tmp_path):
+    cache = StoryCache(
+        DiskCacheBackend(str(tmp_path / "c.sqlite3"), ttl=60, max_entries=10)
+    )
+
+    class SlowLlm(FakeLlm):
+        async def get_story_async(self, topic):
+            await asyncio.sleep(0.1)
+            return await super().get_story_async(topic)
+
+    llm = SlowLlm()
+
+    async def run():
+        first = await asyncio.gather(
+            *[cache.get_story_async(llm, "cats") for _ in range(3)]
+        )
+        return first, await cache.get_story_async(llm, "cats")
+
+    first, again = asyncio.run(run())
+
+    assert sorted(status for _, status in first) == [COALESCED, COALESCED, MISS]
+    assert again[1] == HIT
+    assert llm.calls == 1
+    cache.close()
@@ -0,0 +1,30 @@
+import pytest
+from fastapi import HTTPException
+
+from benchmark.api.data import parse_range
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("bytes=0-9", (0, 10)),
+        ("bytes=90-", (90, 100)),
+        ("bytes=95-200", (95, 100)),
+        ("bytes=-10", (90, 100)),
+        ("bytes=-500", (0, 100)),
+        ("bytes=-", None),
+        ("bytes=0-1,5-6", None),
+        ("items=0-9", None),
+    ],
+)
+def test_parse_range(header, expected):
+    assert parse_range(header, 100) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=9-3", "bytes=-0"])
+def test_unsatisfiable_range(header):
+    with pytest.raises(HTTPException) as info:
+        parse_range(header, 100)
+
+    assert info.value.status_code == 416
+    assert info.value.headers == {"Content-Range": "bytes */100"}
@@ -0,0 +1,18 @@
+from contextvars import ContextVar
+
+from benchmark.core.executors import InstrumentedThreadPoolExecutor
+
+request_id: ContextVar[str] = ContextVar("request_id", default="none")
+
+
+def test_tasks_run_in_the_submitter_context():
+    executor = InstrumentedThreadPoolExecutor("test", max_workers=1)
+    token = request_id.set("abc")
+    try:
+        future = executor.submit(request_id.get)
+    finally:
+        request_id.reset(token)
+
+    assert future.result() == "abc"
+    assert executor.submit(request_id.get).result() == "none"
+    executor.shutdown()
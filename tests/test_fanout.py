@@ -0,0 +1,105 @@
+import pytest
+
+from benchmark.llms.exceptions import LlmException, LlmStreamLagException
+from benchmark.llms.fanout import Broadcast, SharedStreamLlm
+from tests.fakes import FakeLlm
+
+DELTAS = ["a", "b", "c", "d", "e"]
+
+
+def make_broadcast(llm: FakeLlm, replay_size=100, max_lag=100, lag_timeout=1.0):
+    return Broadcast(
+        llm.stream_story("topic"),
+        replay_size=replay_size,
+        max_lag=max_lag,
+        lag_timeout=lag_timeout,
+    )
+
+
+def test_late_subscribers_replay_the_stream():
+    llm = FakeLlm(deltas=DELTAS)
+    broadcast = make_broadcast(llm)
+    first = broadcast.subscribe()
+    assert [next(first), next(first)] == ["a", "b"]
+
+    second = broadcast.subscribe()
+
+    assert list(second) == DELTAS
+    assert list(first) == DELTAS[2:]
+    assert llm.calls == 1
+
+
+def test_upstream_is_closed_when_the_last_subscriber_leaves():
+    llm = FakeLlm(deltas=DELTAS)
+    broadcast = make_broadcast(llm)
+    first, second = broadcast.subscribe(), broadcast.subscribe()
+    next(first)
+    next(second)
+
+    first.close()
+    assert llm.closed == 0
+    assert list(second) == DELTAS[1:]
+
+    second.close()
+    assert llm.closed == 1
+    assert broadcast.subscribe() is None
+
+
+def test_abandoned_stream_closes_upstream():
+    llm = FakeLlm(deltas=DELTAS)
+    broadcast = make_broadcast(llm)
+    stream = broadcast.subscribe()
+    next(stream)
+
+    stream.close()
+
+    assert llm.closed == 1
+    assert not broadcast.joinable
+
+
+def test_not_joinable_once_trimmed():
+    broadcast = make_broadcast(FakeLlm(deltas=DELTAS), replay_size=2)
+    stream = broadcast.subscribe()
+    assert next(stream) == "a"
+    assert broadcast.joinable
+
+    assert next(stream) == "b"
+
+    assert not broadcast.joinable
+    assert broadcast.subscribe() is None
+
+
+def test_lagging_subscribers_are_dropped():
+    broadcast = make_broadcast(FakeLlm(deltas=DELTAS), max_lag=2, lag_timeout=0.01)
+    fast, slow = broadcast.subscribe(), broadcast.subscribe()
+
+    assert list(fast) == DELTAS
+    with pytest.raises(LlmStreamLagException):
+        next(slow)
+
+
+def test_upstream_errors_reach_every_subscriber():
+    llm = FakeLlm(deltas=DELTAS, error=LlmException(), fail_after=2)
+    broadcast = make_broadcast(llm)
+    first, second = broadcast.subscribe(), broadcast.subscribe()
+
+    for stream in (first, second):
+        assert [next(stream), next(stream)] == ["a", "b"]
+        with pytest.raises(LlmException):
+            next(stream)
+
+
+def test_identical_streams_share_the_upstream():
+    fake = FakeLlm(deltas=DELTAS)
+    llm = SharedStreamLlm(fake, replay_size=100, max_lag=100, lag_timeout=1.0)
+    first = llm.stream_story("topic")
+    assert next(first) == "a"
+
+    second = llm.stream_story("topic")
+    other = llm.stream_story("other topic")
+
+    assert list(second) == DELTAS
+    assert list(first) == DELTAS[1:]
+    assert list(other) == DELTAS
+    assert fake.calls == 2
+    assert not llm._broadcasts
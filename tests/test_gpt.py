@@ -0,0 +1,82 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from openai import APIConnectionError
+
+from benchmark.llms.exceptions import LlmException
+from benchmark.llms.gpt import OpenAILlm
+
+
+def chunk(content):
+    delta = SimpleNamespace(content=content)
+    return SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=delta)])
+
+
+def broken_chunks():
+    yield chunk("once ")
+    raise APIConnectionError(request=httpx.Request("POST", "http://openai"))
+
+
+class FakeStream:
+    def __init__(self) -> None:
+        self.closed = False
+        self._chunks = broken_chunks()
+
+    def __iter__(self):
+        return self._chunks
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._chunks)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    def close(self):
+        self.closed = True
+
+    async def aclose(self):
+        self.closed = True
+
+
+def make_llm(stream: FakeStream) -> OpenAILlm:
+    async def acreate(**kwargs):
+        return stream
+
+    def client(create):
+        completions = SimpleNamespace(create=create)
+        return SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+    return OpenAILlm(
+        "gpt-4o-mini",
+        client=client(lambda **kwargs: stream),
+        async_client=client(acreate),
+    )
+
+
+def test_stream_errors_are_llm_exceptions():
+    stream = FakeStream()
+    deltas = make_llm(stream).stream_story("cats")
+
+    assert next(deltas) == "once "
+    with pytest.raises(LlmException):
+        next(deltas)
+    assert stream.closed
+
+
+def test_async_stream_errors_are_llm_exceptions():
+    stream = FakeStream()
+    stream.close = stream.aclose
+    deltas = make_llm(stream).astream_story("cats")
+
+    async def run():
+        assert await deltas.__anext__() == "once "
+        with pytest.raises(LlmException):
+            await deltas.__anext__()
+
+    asyncio.run(run())
+    assert stream.closed
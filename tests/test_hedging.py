@@ -0,0 +1,116 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from benchmark.llms.hedging import HedgeBudget, HedgedLlm, LatencyWindow
+from tests.fakes import FakeLlm
+
+
+class SlowLlm(FakeLlm):
+    """Sleeps `delays[n]` seconds in its n-th call, and not at all after"""
+
+    def __init__(self, delays) -> None:
+        super().__init__()
+        self.delays = list(delays)
+        self._lock = threading.Lock()
+
+    def _delay(self) -> float:
+        with self._lock:
+            self.calls += 1
+            return self.delays[self.calls - 1] if self.calls <= len(self.delays) else 0
+
+    def get_story(self, topic):
+        time.sleep(self._delay())
+        return {"topic": topic, "story": f"story {self.calls}"}
+
+    async def get_story_async(self, topic):
+        await asyncio.sleep(self._delay())
+        return {"topic": topic, "story": f"story {self.calls}"}
+
+
+@pytest.fixture
+def executor():
+    executor = ThreadPoolExecutor(max_workers=4)
+    yield executor
+    executor.shutdown(wait=True)
+
+
+def make_llm(llm, executor, threshold=0.05, percent=100.0):
+    window = LatencyWindow(size=10, percentile=50, min_samples=1)
+    window.record(threshold)
+    return HedgedLlm(llm, executor, window, HedgeBudget(percent, burst=10))
+
+
+def test_latency_window_threshold():
+    window = LatencyWindow(size=4, percentile=50, min_samples=2)
+    window.record(1.0)
+    assert window.threshold() is None
+
+    for duration in (4.0, 2.0, 3.0, 5.0):
+        window.record(duration)
+
+    # 1.0 left the window
+    assert window.threshold() == 3.0
+
+
+def test_budget_caps_hedges():
+    budget = HedgeBudget(percent=50, burst=1)
+    spent = 0
+    for _ in range(10):
+        budget.deposit()
+        spent += budget.try_spend()
+
+    assert spent == 5
+
+
+def test_slow_sync_calls_are_hedged(executor):
+    llm = make_llm(SlowLlm([1.0]), executor)
+
+    start = time.perf_counter()
+    assert llm.get_story("cats")["story"] == "story 2"
+
+    assert time.perf_counter() - start < 0.5
+    assert llm.llm.calls == 2
+
+
+def test_fast_sync_calls_are_not_hedged(executor):
+    llm = make_llm(SlowLlm([0.0]), executor)
+
+    llm.get_story("cats")
+
+    assert llm.llm.calls == 1
+
+
+def test_queueing_does_not_trigger_hedges():
+    executor = ThreadPoolExecutor(max_workers=1)
+    llm = make_llm(SlowLlm([]), executor)
+    executor.submit(time.sleep, 0.2)
+
+    llm.get_story("cats")
+    executor.shutdown(wait=True)
+
+    assert llm.llm.calls == 1
+
+
+def test_no_hedge_without_budget(executor):
+    llm = make_llm(SlowLlm([0.2]), executor, percent=0)
+
+    assert llm.get_story("cats")["story"] == "story 1"
+    assert llm.llm.calls == 1
+
+
+def test_slow_async_calls_are_hedged(executor):
+    llm = make_llm(SlowLlm([1.0]), executor)
+
+    async def main():
+        start = time.perf_counter()
+        data = await llm.get_story_async("cats")
+        return data, time.perf_counter() - start
+
+    data, elapsed = asyncio.run(main())
+
+    assert data["story"] == "story 2"
+    assert elapsed < 0.5
@@ -0,0 +1,153 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from benchmark.api.schemas import JobStatus, StorytellerModel
+from benchmark.jobs.store import Job, JobStore, MemoryJobStore, SqliteJobStore
+from benchmark.jobs.worker import JobQueue
+from benchmark.llms.cache import StoryCache
+from tests.fakes import FakeLlm
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        yield MemoryJobStore(ttl=60, max_entries=100)
+    else:
+        store = SqliteJobStore(str(tmp_path / "jobs.sqlite3"), ttl=60)
+        yield store
+        store.close()
+
+
+def test_create_update_get(store):
+    job = Job(id="a", model="mock-fast", topic="cats")
+    store.create(job)
+    assert store.get("a") == job
+
+    job.status = JobStatus.SUCCEEDED
+    job.finished_at = time.time()
+    job.story = "once upon a time"
+    store.update(job)
+
+    assert store.get("a") == job
+    assert store.get("a").finished
+    assert store.get("b") is None
+
+
+def test_finished_jobs_expire(store):
+    job = Job(id="a", model="mock-fast", topic="cats")
+    store.create(job)
+    job.status = JobStatus.FAILED
+    job.finished_at = time.time() - 120
+    store.update(job)
+
+    assert store.get("a") is None
+
+
+def test_memory_store_evicts_finished_jobs_first():
+    store = MemoryJobStore(ttl=60, max_entries=2)
+    done = Job(id="done", model="m", topic="t", status=JobStatus.SUCCEEDED)
+    store.create(done)
+    store.create(Job(id="queued", model="m", topic="t"))
+    store.create(Job(id="new", model="m", topic="t"))
+
+    assert store.get("done") is None
+    assert store.get("queued") is not None
+    assert store.get("new") is not None
+
+
+def test_fail_stale_jobs(store):
+    store.create(Job(id="old", model="m", topic="t", created_at=time.time() - 120))
+    store.create(Job(id="new", model="m", topic="t"))
+
+    assert store.fail_stale(time.time() - 60, "WorkerLost") == 1
+
+    assert store.get("old").status == JobStatus.FAILED
+    assert store.get("old").error == "WorkerLost"
+    assert store.get("new").status == JobStatus.QUEUED
+
+
+def test_sqlite_store_in_the_working_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    SqliteJobStore("jobs.sqlite3", ttl=60).close()
+
+    assert (tmp_path / "jobs.sqlite3").exists()
+
+
+class SlowSaveStore(MemoryJobStore):
+    """Blocking store whose updates take `delay` seconds"""
+
+    blocking = True
+
+    def __init__(self, delay: float) -> None:
+        super().__init__(ttl=60, max_entries=100)
+        self.delay = delay
+
+    def update(self, job: Job) -> None:
+        time.sleep(self.delay)
+        super().update(job)
+
+
+def make_queue(store: JobStore) -> JobQueue:
+    registry = SimpleNamespace(aget=lambda model: asyncio.sleep(0, FakeLlm()))
+    return JobQueue(
+        store,
+        registry,
+        StoryCache(None),
+        archiver=None,
+        concurrency=1,
+        queue_size=10,
+        poll_interval=0.05,
+        stale_after=60,
+    )
+
+
+def test_queue_runs_jobs():
+    queue = make_queue(MemoryJobStore(ttl=60, max_entries=100))
+
+    async def main():
+        await queue.start()
+        job = await queue.submit(StorytellerModel.MOCK_INSTANT, "cats")
+        job = await queue.wait(job.id, timeout=5)
+        await queue.aclose(timeout=1)
+        return job
+
+    job = asyncio.run(main())
+
+    assert job.status == JobStatus.SUCCEEDED
+    assert job.story == "once upon a time"
+
+
+def test_queue_start_fails_stale_jobs():
+    store = MemoryJobStore(ttl=60, max_entries=100)
+    store.create(Job(id="old", model="m", topic="t", created_at=time.time() - 120))
+    queue = make_queue(store)
+
+    async def main():
+        await queue.start()
+        await queue.aclose(timeout=1)
+
+    asyncio.run(main())
+
+    assert store.get("old").status == JobStatus.FAILED
+
+
+def test_shutdown_while_saving_fails_the_job():
+    store = SlowSaveStore(delay=0.2)
+    queue = make_queue(store)
+
+    async def main():
+        await queue.start()
+        job = await queue.submit(StorytellerModel.MOCK_INSTANT, "cats")
+        # The worker is saving the job as running
+        await asyncio.sleep(0.05)
+        await queue.aclose(timeout=0)
+        return job
+
+    job = asyncio.run(main())
+
+    assert store.get(job.id).status == JobStatus.FAILED
+    assert store.get(job.id).error == "ShutdownError"
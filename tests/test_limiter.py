@@ -0,0 +1,198 @@
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from benchmark.api.errors import add_exception_handlers
+from benchmark.llms.exceptions import LlmOverloadedException, LlmThrottledException
+from benchmark.llms.limiter import AdaptiveLimiter, LimitedLlm
+from tests.fakes import FakeLlm
+
+
+def make_limiter(limit=2, max_queue=10, queue_timeout=1.0) -> AdaptiveLimiter:
+    return AdaptiveLimiter(
+        "fake",
+        "fake",
+        initial_limit=limit,
+        min_limit=1,
+        max_limit=10,
+        max_queue=max_queue,
+        queue_timeout=queue_timeout,
+        backoff=0.5,
+        latency_tolerance=2.0,
+    )
+
+
+def wait_for_queue(limiter: AdaptiveLimiter, size: int) -> None:
+    deadline = time.monotonic() + 1
+    while len(limiter._waiters) < size:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_limit_grows_when_used():
+    limiter = make_limiter(limit=2)
+    limiter.acquire()
+    limiter.acquire()
+
+    limiter.release(0.1, congested=False)
+
+    assert limiter.limit == 2.5
+    assert limiter.in_flight == 1
+
+
+def test_limit_holds_when_underused():
+    limiter = make_limiter(limit=4)
+    limiter.acquire()
+
+    limiter.release(0.1, congested=False)
+
+    assert limiter.limit == 4
+
+
+def test_limit_backs_off_once_per_burst():
+    limiter = make_limiter(limit=8)
+    for _ in range(2):
+        limiter.acquire()
+        limiter.release(None, congested=True)
+
+    assert limiter.limit == 4
+
+
+def test_latency_drift_is_congestion():
+    limiter = make_limiter(limit=8)
+    limiter.acquire()
+    limiter.release(1.0, congested=False)
+
+    for _ in range(2):
+        limiter.acquire()
+        limiter.release(10.0, congested=False)
+
+    assert limiter.limit == 4
+
+
+def test_waiters_are_served_in_order():
+    limiter = make_limiter(limit=1)
+    limiter.acquire()
+    served = []
+
+    def call(name):
+        limiter.acquire()
+        served.append(name)
+        limiter.release(None, congested=False)
+
+    threads = []
+    for i, name in enumerate("abc"):
+        thread = threading.Thread(target=call, args=(name,))
+        thread.start()
+        wait_for_queue(limiter, i + 1)
+        threads.append(thread)
+
+    limiter.release(None, congested=False)
+    for thread in threads:
+        thread.join()
+
+    assert served == ["a", "b", "c"]
+    assert limiter.in_flight == 0
+
+
+def test_full_queue_rejects_right_away():
+    limiter = make_limiter(limit=1, max_queue=0)
+    limiter.acquire()
+
+    with pytest.raises(LlmOverloadedException) as info:
+        limiter.acquire()
+
+    assert info.value.queue_full
+
+
+def test_queue_timeout_rejects():
+    limiter = make_limiter(limit=1, queue_timeout=0.01)
+    limiter.acquire()
+
+    with pytest.raises(LlmOverloadedException) as info:
+        limiter.acquire()
+
+    assert not info.value.queue_full
+    assert not limiter._waiters
+
+
+def test_async_acquire_waits_for_a_slot():
+    limiter = make_limiter(limit=1)
+    limiter.acquire()
+
+    async def main():
+        waiter = asyncio.ensure_future(limiter.acquire_async())
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+
+        # Released from another thread, like a sync call would
+        await asyncio.to_thread(limiter.release, None, False)
+        await asyncio.wait_for(waiter, 1)
+
+    asyncio.run(main())
+    assert limiter.in_flight == 1
+
+
+def test_cancelled_async_acquire_leaves_the_queue():
+    limiter = make_limiter(limit=1)
+    limiter.acquire()
+
+    async def main():
+        waiter = asyncio.ensure_future(limiter.acquire_async())
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+    asyncio.run(main())
+    assert not limiter._waiters
+    assert limiter.in_flight == 1
+
+
+def test_limited_llm_releases_and_backs_off():
+    limiter = make_limiter(limit=8)
+    llm = LimitedLlm(FakeLlm(error=LlmThrottledException()), limiter)
+
+    with pytest.raises(LlmThrottledException):
+        llm.get_story("cats")
+
+    assert limiter.in_flight == 0
+    assert limiter.limit == 4
+
+
+def test_limited_llm_streams_hold_their_slot():
+    limiter = make_limiter(limit=1)
+    llm = LimitedLlm(FakeLlm(), limiter)
+
+    stream = llm.stream_story("cats")
+    next(stream)
+    assert limiter.in_flight == 1
+
+    stream.close()
+    assert limiter.in_flight == 0
+
+
+@pytest.mark.parametrize("queue_full, status_code", [(True, 429), (False, 503)])
+def test_overloaded_responses(queue_full, status_code):
+    app = FastAPI()
+    add_exception_handlers(app)
+
+    @app.get("/story")
+    async def story():
+        raise LlmOverloadedException(2.5, queue_full=queue_full)
+
+    async def main():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://t"
+        ) as client:
+            return await client.get("/story")
+
+    response = asyncio.run(main())
+
+    assert response.status_code == status_code
+    assert response.headers["Retry-After"] == "3"
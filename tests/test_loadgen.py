@@ -0,0 +1,49 @@
+import asyncio
+
+import httpx
+
+from benchmark.api.sse import SseEncoder, format_event
+from benchmark.llms.exceptions import LlmThrottledException
+from benchmark.loadgen.runner import LoadRunner, parse_sse_error
+
+
+def send(body: str, endpoint: str = "/stream-story-async"):
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, text=body)
+
+    async def main():
+        transport = httpx.MockTransport(handler)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://t"
+        ) as client:
+            runner = LoadRunner("http://t", ["mock-fast"], timeout=5)
+            return await runner._send(client, endpoint, "mock-fast", "cats")
+
+    return asyncio.run(main())
+
+
+def test_parse_sse_error():
+    assert parse_sse_error(format_event('{"error": "Boom"}', event="error")) == "Boom"
+    assert parse_sse_error(format_event("not json", event="error")) == "StreamError"
+    assert parse_sse_error(format_event('{"error": "Boom"}', event="done")) is None
+
+
+def test_stream_errors_fail_the_sample():
+    encoder = SseEncoder()
+    body = encoder.push("once ") + encoder.error(LlmThrottledException())
+
+    sample = send(body)
+
+    assert sample.status_code == 200
+    assert sample.error == "LlmThrottledException"
+    assert not sample.ok
+
+
+def test_complete_streams_succeed():
+    encoder = SseEncoder()
+    body = encoder.push("once ") + encoder.push("upon a time")
+
+    sample = send(body)
+
+    assert sample.ok
+    assert sample.ttfb is not None
@@ -0,0 +1,45 @@
+import logging
+import os
+import time
+
+import pytest
+
+from benchmark.core.config import Settings
+from benchmark.core.logging.dict_config import configure_logging
+from benchmark.core.logging.handlers import JsonFormatter, install_queue_handler
+
+
+def test_log_format_comes_from_the_settings():
+    configure_logging(Settings(LOG_FORMAT="json", LOG_QUEUE_ENABLED=False))
+    handlers = logging.getLogger("benchmark").handlers
+    try:
+        assert handlers
+        assert all(isinstance(h.formatter, JsonFormatter) for h in handlers)
+    finally:
+        for handler in handlers:
+            handler.close()
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="Needs fork")
+def test_forked_processes_get_their_own_listener(tmp_path):
+    path = tmp_path / "records.log"
+    handler = logging.FileHandler(path)
+    logger = logging.getLogger("tests.logging.fork")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+    listener = install_queue_handler(logger, queue_size=100, filters=[])
+
+    pid = os.fork()
+    if pid == 0:
+        logger.info("from the child")
+        # Written by the child's listener thread
+        time.sleep(0.2)
+        os._exit(0)
+
+    os.waitpid(pid, 0)
+    logger.info("from the parent")
+    listener.stop()
+    handler.close()
+
+    assert path.read_text().splitlines() == ["from the child", "from the parent"]
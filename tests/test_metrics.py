@@ -0,0 +1,109 @@
+import asyncio
+import uuid
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from prometheus_client import REGISTRY
+
+from benchmark.utils import PrometheusMiddleware
+
+
+def make_app():
+    app_name = uuid.uuid4().hex
+    app = FastAPI()
+    app.add_middleware(PrometheusMiddleware, app_name=app_name)
+
+    @app.get("/items/{item_id}")
+    async def get_item(item_id: int):
+        return {"id": item_id}
+
+    @app.post("/in-progress")
+    async def in_progress():
+        labels = {"method": "POST", "path": "/in-progress", "app_name": app_name}
+        return REGISTRY.get_sample_value("fastapi_requests_in_progress", labels)
+
+    @app.get("/fail")
+    async def fail():
+        raise ValueError("boom")
+
+    @app.get("/fail-mid-stream")
+    async def fail_mid_stream():
+        async def chunks():
+            yield "a"
+            raise ValueError("boom")
+
+        return StreamingResponse(chunks())
+
+    app.add_route("/plain", lambda request: PlainTextResponse("ok"))
+    return app, app_name
+
+
+def request(app, path, method="GET"):
+    async def main():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://t"
+        ) as client:
+            return await client.request(method, path)
+
+    return asyncio.run(main())
+
+
+def sample(name, app_name, **labels):
+    return REGISTRY.get_sample_value(name, {"app_name": app_name, **labels})
+
+
+def test_labels_the_route_template():
+    app, app_name = make_app()
+
+    request(app, "/items/1")
+    request(app, "/items/2")
+    request(app, "/plain")
+
+    labels = {"method": "GET", "path": "/items/{item_id}"}
+    assert sample("fastapi_requests_total", app_name, **labels) == 2
+    assert sample("fastapi_requests_in_progress", app_name, **labels) == 0
+    assert sample("fastapi_responses_total", app_name, status_code="200", **labels) == 2
+    assert sample("fastapi_requests_total", app_name, method="GET", path="/plain") == 1
+
+
+def test_counts_requests_in_progress():
+    app, _ = make_app()
+
+    assert request(app, "/in-progress", method="POST").json() == 1
+
+
+def test_skips_unrouted_requests():
+    app, app_name = make_app()
+
+    assert request(app, "/missing").status_code == 404
+
+    assert (
+        sample("fastapi_requests_total", app_name, method="GET", path="/missing")
+        is None
+    )
+
+
+@pytest.mark.parametrize(
+    "path, status_code", [("/fail", "500"), ("/fail-mid-stream", "200")]
+)
+def test_exceptions_keep_the_status_sent(path, status_code):
+    app, app_name = make_app()
+
+    with pytest.raises(ValueError):
+        request(app, path)
+
+    labels = {"method": "GET", "path": path}
+    assert (
+        sample("fastapi_responses_total", app_name, status_code=status_code, **labels)
+        == 1
+    )
+    assert (
+        sample(
+            "fastapi_exceptions_total", app_name, exception_type="ValueError", **labels
+        )
+        == 1
+    )
+    assert sample("fastapi_requests_in_progress", app_name, **labels) == 0
@@ -0,0 +1,27 @@
+from benchmark.llms.mock import MockLlm, resolve_profile
+
+
+def make_llm(**kwargs) -> MockLlm:
+    return MockLlm("mock-instant", resolve_profile("mock-instant", {}), **kwargs)
+
+
+def test_replays_the_same_stories():
+    first, second = make_llm(seed=1), make_llm(seed=1)
+
+    for _ in range(3):
+        assert first.get_story("space") == second.get_story("space")
+
+
+def test_forgets_least_recently_used_topics():
+    llm = make_llm(max_topics=2)
+    story = llm.get_story("a")["story"]
+
+    llm.get_story("b")
+    llm.get_story("a")
+    llm.get_story("c")
+
+    assert list(llm._calls) == ["a", "c"]
+    llm.get_story("b")
+    assert list(llm._calls) == ["c", "b"]
+    # `a` was forgotten, it starts over
+    assert llm.get_story("a")["story"] == story
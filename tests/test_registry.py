@@ -0,0 +1,29 @@
+import asyncio
+import threading
+
+from benchmark.api.schemas import StorytellerModel
+from benchmark.core.config import Settings
+from benchmark.llms.registry import LlmRegistry
+
+
+def test_aget_builds_llms_off_the_event_loop(monkeypatch):
+    registry = LlmRegistry(Settings())
+    build = registry._build
+    threads = []
+
+    def record_thread(*args, **kwargs):
+        threads.append(threading.get_ident())
+        return build(*args, **kwargs)
+
+    monkeypatch.setattr(registry, "_build", record_thread)
+
+    async def main():
+        first = await registry.aget(StorytellerModel.MOCK_INSTANT)
+        second = await registry.aget(StorytellerModel.MOCK_INSTANT)
+        return first, second, threading.get_ident()
+
+    first, second, loop_thread = asyncio.run(main())
+
+    assert first is second
+    assert len(threads) == 1
+    assert threads[0] != loop_thread
@@ -0,0 +1,143 @@
+import asyncio
+
+import pytest
+
+from benchmark.llms.exceptions import LlmException
+from benchmark.llms.routing import CLOSED, HALF_OPEN, OPEN, Backend, RoutedLlm
+from tests.fakes import FakeLlm
+
+
+def make_backend(name: str, llm: FakeLlm, open_seconds: float = 0.0) -> Backend:
+    return Backend(
+        name,
+        llm,
+        alpha=0.5,
+        failure_threshold=0.5,
+        min_calls=2,
+        open_seconds=open_seconds,
+    )
+
+
+def open_circuit(backend: Backend) -> None:
+    backend.record_failure()
+    backend.record_failure()
+    assert backend.state == OPEN
+
+
+def test_circuit_opens_after_min_calls():
+    backend = make_backend("a", FakeLlm())
+
+    backend.record_failure()
+    assert backend.state == CLOSED
+    backend.record_failure()
+    assert backend.state == OPEN
+
+
+def test_open_circuit_rejects_until_probe():
+    backend = make_backend("a", FakeLlm(), open_seconds=60)
+    open_circuit(backend)
+
+    assert not backend.try_acquire()
+
+    backend.open_seconds = 0
+    assert backend.try_acquire()
+    assert backend.state == HALF_OPEN
+    # A single probe at a time
+    assert not backend.try_acquire()
+
+
+@pytest.mark.parametrize("succeeded, state", [(True, CLOSED), (False, OPEN)])
+def test_probe_outcome(succeeded, state):
+    backend = make_backend("a", FakeLlm())
+    open_circuit(backend)
+    assert backend.try_acquire()
+
+    if succeeded:
+        backend.record_success(0.1)
+    else:
+        backend.record_failure()
+
+    assert backend.state == state
+
+
+def test_abandoned_probe_lets_the_next_call_probe():
+    backend = make_backend("a", FakeLlm())
+    open_circuit(backend)
+    assert backend.try_acquire()
+
+    backend.record_abandoned()
+
+    assert backend.state == OPEN
+    assert backend.try_acquire()
+
+
+def test_fails_over_to_the_next_backend():
+    failing = make_backend("failing", FakeLlm(error=LlmException("boom")))
+    healthy = make_backend("healthy", FakeLlm())
+    failing.latency, healthy.latency = 0.1, 1.0
+    llm = RoutedLlm("fake", [failing, healthy], explore_rate=0.0)
+
+    assert llm.get_story("cats")["story"] == "once upon a time"
+    assert failing.calls == 1 and healthy.calls == 1
+    assert healthy.latency < 1.0
+
+
+def test_stream_doesnt_fail_over_once_started():
+    failing = make_backend("failing", FakeLlm(error=LlmException("boom"), fail_after=1))
+    healthy = make_backend("healthy", FakeLlm())
+    failing.latency, healthy.latency = 0.1, 1.0
+    llm = RoutedLlm("fake", [failing, healthy], explore_rate=0.0)
+
+    stream = llm.stream_story("cats")
+    assert next(stream) == "once "
+    with pytest.raises(LlmException):
+        next(stream)
+    assert healthy.llm.calls == 0
+
+
+def test_abandoned_stream_probe_doesnt_stay_half_open():
+    backend = make_backend("a", FakeLlm())
+    open_circuit(backend)
+    llm = RoutedLlm("fake", [backend], explore_rate=0.0)
+
+    stream = llm.stream_story("cats")
+    next(stream)
+    assert backend.state == HALF_OPEN
+    stream.close()
+
+    assert backend.state == OPEN
+    assert backend.llm.closed == 1
+
+
+def test_unexpected_error_fails_the_probe():
+    backend = make_backend("a", FakeLlm(error=ValueError("bug")))
+    open_circuit(backend)
+    backend.open_seconds = 60
+    backend.opened_at -= 60
+    llm = RoutedLlm("fake", [backend], explore_rate=0.0)
+
+    with pytest.raises(ValueError):
+        llm.get_story("cats")
+    assert backend.state == OPEN
+    assert not backend.try_acquire()
+
+
+def test_cancelled_async_probe_doesnt_stay_half_open():
+    class SlowLlm(FakeLlm):
+        async def get_story_async(self, topic):
+            await asyncio.sleep(10)
+
+    backend = make_backend("a", SlowLlm())
+    open_circuit(backend)
+    llm = RoutedLlm("fake", [backend], explore_rate=0.0)
+
+    async def run():
+        task = asyncio.ensure_future(llm.get_story_async("cats"))
+        await asyncio.sleep(0)
+        assert backend.state == HALF_OPEN
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert backend.state == OPEN
@@ -0,0 +1,79 @@
+import time
+
+from benchmark.api.sse import HEARTBEAT, SseEncoder, format_event, sse_stream
+
+
+def push_all(encoder: SseEncoder, deltas):
+    frames = [encoder.push(delta) for delta in deltas]
+    return [frame for frame in frames if frame is not None]
+
+
+def test_format_event_splits_lines():
+    assert format_event("a\nb", event="done", event_id=3) == (
+        "id: 3\nevent: done\ndata: a\ndata: b\n\n"
+    )
+
+
+def test_no_coalescing_sends_every_delta():
+    encoder = SseEncoder()
+
+    assert len(push_all(encoder, ["a"] * 50)) == 50
+
+
+def test_coalesce_bytes_only():
+    encoder = SseEncoder(coalesce_bytes=10)
+
+    frames = push_all(encoder, ["ab"] * 50)
+
+    assert len(frames) == 10
+    assert frames[0] == format_event("ab" * 5, event_id=1)
+    assert encoder.flush_deadline is None
+
+
+def test_coalesce_window_only(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(time, "perf_counter", lambda: now[0])
+    encoder = SseEncoder(coalesce_window=1.0)
+
+    frames = []
+    for _ in range(50):
+        now[0] += 0.25
+        frame = encoder.push("a")
+        if frame is not None:
+            frames.append(frame)
+
+    # The fifth delta comes a full window after the first one of the frame
+    assert len(frames) == 10
+    assert frames[0] == format_event("a" * 5, event_id=1)
+
+    encoder.push("a")
+    assert encoder.flush_deadline == now[0] + 1.0
+
+
+def test_done_flushes_buffer():
+    encoder = SseEncoder(coalesce_bytes=100)
+    encoder.push("hello")
+
+    frame = encoder.done()
+
+    assert frame.startswith(format_event("hello", event_id=1))
+    assert "event: done" in frame
+    assert encoder.deltas == 1
+
+
+def test_sse_stream_heartbeat_flushes(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(time, "perf_counter", lambda: now[0])
+
+    def deltas():
+        for _ in range(3):
+            now[0] += 10
+            yield "a"
+
+    encoder = SseEncoder(coalesce_bytes=100)
+    frames = list(sse_stream(deltas(), encoder, heartbeat=15))
+
+    # The buffer is flushed when a heartbeat is due, instead of a heartbeat
+    assert frames[0] == format_event("aa", event_id=1)
+    assert HEARTBEAT not in frames
+    assert "event: done" in frames[-1]